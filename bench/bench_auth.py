@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""基准测试：每次请求的 JWT 鉴权开销（经 FastAPI 依赖注入的完整路径）
+
+对比：
+  - sync 依赖 + 无缓存：原实现，每次 jwt.decode，且依赖在线程池中执行
+  - sync 依赖 + 缓存：命中缓存，但仍有线程池切换
+  - async 依赖 + 缓存：当前实现，直接在事件循环中执行
+
+用法：python bench/bench_auth.py [--requests 20000] [--tokens 100] [--concurrency 50]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+os.environ.setdefault("JWT_SECRET", "bench-secret-key-with-enough-length-for-hs256")
+
+import httpx
+import jwt
+from fastapi import Depends, FastAPI, Header, HTTPException
+from services import auth
+
+
+def make_tokens(count):
+    exp = datetime.utcnow() + timedelta(days=30)
+    return [
+        f"Bearer {jwt.encode({'user_id': f'user-{i}', 'exp': exp}, auth.JWT_SECRET, algorithm='HS256')}"
+        for i in range(count)
+    ]
+
+
+def sync_dependency(authorization: str = Header(None)) -> str:
+    """原先的同步依赖（FastAPI 将其放进线程池执行）"""
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="未授权")
+    return auth.verify_token(authorization[7:])
+
+
+def build_app():
+    app = FastAPI()
+
+    @app.get("/sync")
+    async def sync_route(user_id: str = Depends(sync_dependency)):
+        return user_id
+
+    @app.get("/async")
+    async def async_route(user_id: str = Depends(auth.get_user_id_from_token)):
+        return user_id
+
+    return app
+
+
+async def run(client, path, headers, requests, concurrency):
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            response = await client.get(path, headers={"Authorization": headers[i % len(headers)]})
+            assert response.status_code == 200, response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="JWT 鉴权开销基准测试")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=100, help="活跃用户（不同 Token）数量")
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    headers = make_tokens(args.tokens)
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        auth.token_cache = auth.VerifiedTokenCache(max_size=0)
+        uncached = await run(client, "/sync", headers, args.requests, args.concurrency)
+
+        auth.token_cache = auth.VerifiedTokenCache()
+        sync_cached = await run(client, "/sync", headers, args.requests, args.concurrency)
+
+        auth.token_cache = auth.VerifiedTokenCache()
+        async_cached = await run(client, "/async", headers, args.requests, args.concurrency)
+
+    print(f"请求数: {args.requests}，Token 数: {args.tokens}，并发: {args.concurrency}（含 ASGI 请求处理开销）")
+    print(f"sync 依赖，无缓存:  {uncached:.1f} µs/请求")
+    print(f"sync 依赖，有缓存:  {sync_cached:.1f} µs/请求")
+    print(f"async 依赖，有缓存: {async_cached:.1f} µs/请求")
+    print(f"加速比: {uncached / async_cached:.2f}x")
+    print(f"缓存统计: {auth.token_cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
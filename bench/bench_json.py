@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""基准测试：JSON 编解码（标准库 json vs services/json_codec.py）
+
+覆盖热路径：
+  1. 上游 SSE chunk 解析（每个 token 一次 loads）
+  2. WebSocket 帧编码（每个合帧后的增量一次 dumps）
+  3. 消息列表接口响应（200 条历史：jsonable_encoder + json.dumps vs 直接 FastJSONResponse）
+  4. 上游请求体编码（含系统提示词的消息列表；预编码 Fragment vs 逐次编码）
+
+用法：
+  python bench/bench_json.py
+  JSON_CODEC=stdlib python bench/bench_json.py    # 对照：codec 回退到标准库时的开销
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from services.json_codec import CODEC, Fragment, FastJSONResponse, dumps, dumps_text, encode_chat_request, loads
+
+SAMPLE_TEXT = (
+    "这是一个很好的问题。作为高管，你在团队管理中遇到的挑战往往源于沟通方式和期望的不一致。"
+    "我想先了解一下：你认为目前团队中最让你困扰的具体场景是什么？当这种情况发生时，你通常会怎么做？"
+)
+SYSTEM_PROMPT = "你是一位经验丰富的高管教练，专注于引导式对话而非直接给出答案。" * 4
+
+
+def sse_chunks(tokens):
+    chunks = []
+    for n in range(tokens):
+        chunk = {
+            "id": "021700000000000000000000000000000000000000000000000000",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "doubao-seed-1-6-lite-251015",
+            "choices": [{"index": 0, "delta": {"content": SAMPLE_TEXT[n % len(SAMPLE_TEXT)], "role": "assistant"}}]
+        }
+        chunks.append(json.dumps(chunk, ensure_ascii=False).encode())
+    return chunks
+
+
+def ws_frames(count):
+    return [
+        {"type": "chunk", "content": SAMPLE_TEXT[n % 40:n % 40 + 8], "sessionId": str(uuid.uuid4()), "seq": n}
+        for n in range(count)
+    ]
+
+
+def history_payload(messages):
+    now = datetime(2024, 1, 1)
+    return {
+        "code": 0,
+        "message": "success",
+        "data": [
+            {
+                "id": str(uuid.uuid4()),
+                "sessionId": str(uuid.uuid4()),
+                "role": "user" if n % 2 == 0 else "assistant",
+                "content": SAMPLE_TEXT,
+                "createdAt": now.isoformat(),
+            }
+            for n in range(messages)
+        ],
+        "hasMore": True,
+        "prevCursor": str(uuid.uuid4()),
+        "nextCursor": str(uuid.uuid4()),
+    }
+
+
+def chat_payload(system_message, turns):
+    messages = [system_message]
+    for n in range(turns):
+        messages.append({"role": "user" if n % 2 == 0 else "assistant", "content": SAMPLE_TEXT})
+    return {"model": "doubao-seed-1-6-lite-251015", "messages": messages, "stream": True, "max_tokens": 1024}
+
+
+def bench(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(name, unit, count, stdlib_time, codec_time):
+    print(f"{name}")
+    print(f"  标准库: {stdlib_time * 1e3:8.2f} ms（{stdlib_time / count * 1e6:.2f} µs/{unit}）")
+    print(f"  {CODEC:<6}: {codec_time * 1e3:8.2f} ms（{codec_time / count * 1e6:.2f} µs/{unit}）"
+          f"  加速比 {stdlib_time / codec_time:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 编解码基准测试")
+    parser.add_argument("--tokens", type=int, default=5000, help="SSE chunk / WebSocket 帧数")
+    parser.add_argument("--messages", type=int, default=200, help="消息列表接口的条目数")
+    parser.add_argument("--turns", type=int, default=40, help="上游请求中的历史消息数")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"JSON_CODEC: {CODEC}\n")
+
+    chunks = sse_chunks(args.tokens)
+    report("1. SSE chunk 解析", "token", args.tokens,
+           bench(lambda: [json.loads(chunk) for chunk in chunks], args.repeat),
+           bench(lambda: [loads(chunk) for chunk in chunks], args.repeat))
+
+    frames = ws_frames(args.tokens)
+    report("2. WebSocket 帧编码", "帧", args.tokens,
+           bench(lambda: [json.dumps(frame, separators=(",", ":"), ensure_ascii=False) for frame in frames],
+                 args.repeat),
+           bench(lambda: [dumps_text(frame) for frame in frames], args.repeat))
+
+    payload = history_payload(args.messages)
+    assert loads(FastJSONResponse(payload).body) == json.loads(JSONResponse(jsonable_encoder(payload)).body)
+    report(f"3. 消息列表响应（{args.messages} 条）", "次", 1,
+           bench(lambda: JSONResponse(jsonable_encoder(payload)), args.repeat),
+           bench(lambda: FastJSONResponse(payload), args.repeat))
+
+    plain = chat_payload({"role": "system", "content": SYSTEM_PROMPT}, args.turns)
+    fragment = chat_payload(Fragment(role="system", content=SYSTEM_PROMPT), args.turns)
+    assert loads(encode_chat_request(fragment)) == loads(dumps(plain))
+    report(f"4. 上游请求体编码（{args.turns} 条历史）", "次", 1,
+           bench(lambda: json.dumps(plain).encode(), args.repeat),
+           bench(lambda: encode_chat_request(fragment), args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""基准测试：上游 SSE 流解析（旧的字符串拼接实现 vs services/sse.py）
+
+用法：
+  python bench/bench_sse.py                       # 使用合成的中文回复流
+  python bench/bench_sse.py --file capture.sse    # 回放录制的上游原始响应体
+                                                  # （如 curl -N ... > capture.sse）
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from services.sse import SSEDecoder, parse_delta
+
+SAMPLE_TEXT = (
+    "这是一个很好的问题。作为高管，你在团队管理中遇到的挑战往往源于沟通方式和期望的不一致。"
+    "我想先了解一下：你认为目前团队中最让你困扰的具体场景是什么？当这种情况发生时，你通常会怎么做？"
+)
+
+
+def synth_stream(tokens):
+    """按上游 chat.completion.chunk 格式合成一段流，每个 token 一到两个字符"""
+    text = (SAMPLE_TEXT * (tokens // len(SAMPLE_TEXT) + 1))
+    events = []
+    i = 0
+    for n in range(tokens):
+        size = 1 + n % 2
+        chunk = {
+            "id": "021700000000000000000000000000000000000000000000000000",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "doubao-seed-1-6-lite-251015",
+            "choices": [{"index": 0, "delta": {"content": text[i:i + size], "role": "assistant"}}]
+        }
+        i += size
+        events.append(b"data: " + json.dumps(chunk, ensure_ascii=False).encode() + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+    return b"".join(events)
+
+
+def split_network(body, size):
+    """按固定大小切分，模拟网络分片（会切断多字节字符）"""
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def legacy_parse(chunks):
+    """原 chat_handler 中的实现"""
+    content = ""
+    buffer = ""
+    for chunk_bytes in chunks:
+        buffer += chunk_bytes.decode("utf-8", errors="ignore")
+        while "\n\n" in buffer:
+            event, buffer = buffer.split("\n\n", 1)
+            if not event.strip():
+                continue
+            for line in event.split("\n"):
+                if not line.startswith("data: "):
+                    continue
+                chunk_data = line[6:]
+                if chunk_data == "[DONE]":
+                    return content
+                try:
+                    chunk = json.loads(chunk_data)
+                    delta = chunk["choices"][0]["delta"].get("content", "")
+                    if delta:
+                        content += delta
+                except Exception:
+                    pass
+    return content
+
+
+def new_parse(chunks):
+    decoder = SSEDecoder()
+    parts = []
+    for chunk in chunks:
+        for data in decoder.feed(chunk):
+            delta = parse_delta(data)
+            if delta:
+                parts.append(delta)
+        if decoder.done:
+            break
+    return "".join(parts)
+
+
+def bench(fn, chunks, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 解析基准测试")
+    parser.add_argument("--file", help="录制的上游 SSE 原始响应体")
+    parser.add_argument("--tokens", type=int, default=2000, help="合成流的 token 数")
+    parser.add_argument("--chunk-size", type=int, default=37, help="网络分片大小（字节）")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            body = f.read()
+    else:
+        body = synth_stream(args.tokens)
+    chunks = split_network(body, args.chunk_size)
+    tokens = body.count(b"data: ") - 1
+
+    legacy_time, legacy_text = bench(legacy_parse, chunks, args.repeat)
+    new_time, new_text = bench(new_parse, chunks, args.repeat)
+    expected = new_parse([body])
+
+    print(f"流大小: {len(body) / 1024:.1f} KB，token 数: {tokens}，分片: {len(chunks)} 个 × {args.chunk_size} B")
+    print(f"旧实现: {legacy_time * 1e3:.2f} ms（{legacy_time / tokens * 1e6:.2f} µs/token）"
+          f"  内容完整: {legacy_text == expected}（丢失 {len(expected) - len(legacy_text)} 字符）")
+    print(f"新实现: {new_time * 1e3:.2f} ms（{new_time / tokens * 1e6:.2f} µs/token）"
+          f"  内容完整: {new_text == expected}")
+    print(f"加速比: {legacy_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
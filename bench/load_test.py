@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""压测：N 个并发 /ws/chat 客户端 + M 个 REST 轮询客户端
+
+用法：
+  # 自动启动模拟 OpenAI、模拟微信接口和服务（需要可用的 DATABASE_URL）
+  python bench/load_test.py --spawn --clients 50 --turns 3 --pollers 20
+
+  # 对已启动的服务压测（--server-pid 用于采集服务进程 CPU/内存）
+  python bench/load_test.py --server http://127.0.0.1:8000 --server-pid 12345
+
+  # 保存基线，之后与基线比较，p95 回退超过阈值时以非零状态退出
+  python bench/load_test.py --spawn --save bench/baseline.json
+  python bench/load_test.py --spawn --baseline bench/baseline.json --max-regression 0.2
+
+报告首字延迟（TTFT）、整轮耗时、选项到达耗时、REST 各接口延迟的 p50/p95/p99，吞吐量，
+以及服务进程 CPU/内存（需要 psutil，未安装时跳过）。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+import websockets
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, "..", "server")
+
+MESSAGES = [
+    "你好，我是一名创业公司的CEO",
+    "我现在面临团队管理的挑战",
+    "具体来说，团队成员之间沟通不畅",
+    "我应该先从哪里入手？",
+]
+
+# 参与回归比较的指标（越小越好）
+GATED_METRICS = ["ttft_ms", "turn_ms", "rest_ms"]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, name, value):
+        self.samples.setdefault(name, []).append(value)
+
+    def error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def percentile(values, pct):
+    """最近秩法百分位"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+        "max": round(max(values), 1),
+    }
+
+
+async def login(client, code):
+    resp = await client.post("/api/auth/login", json={"code": code})
+    resp.raise_for_status()
+    data = resp.json()["data"]
+    return data["token"], data["userId"]
+
+
+async def chat_client(index, args, client, recorder):
+    token, user_id = await login(client, f"bench-chat-{args.run_id}-{index}")
+    ws_url = args.server.replace("http", "ws", 1) + f"/ws/chat?user_id={user_id}&token={token}"
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        session_id = None
+        for turn in range(args.turns):
+            await ws.send(json.dumps({
+                "message": MESSAGES[turn % len(MESSAGES)],
+                "toolType": "free_chat",
+                "sessionId": session_id
+            }))
+            sent = time.perf_counter()
+            first = None
+            while True:
+                data = json.loads(await ws.recv())
+                if data["type"] == "session":
+                    session_id = data["sessionId"]
+                elif data["type"] == "chunk":
+                    if first is None:
+                        first = time.perf_counter()
+                        recorder.add("ttft_ms", (first - sent) * 1000)
+                    recorder.add("chunk_frames", 1)
+                elif data["type"] == "done":
+                    done = time.perf_counter()
+                    recorder.add("turn_ms", (done - sent) * 1000)
+                    break
+                elif data["type"] == "error":
+                    recorder.error("ws_error_frames")
+                    # 重试 / 续写提示之后本轮仍会继续，只有 final 错误结束本轮
+                    if data.get("final"):
+                        return
+            # 智能选项在 done 之后推送，等待其到达再开始下一轮
+            if args.options_timeout:
+                try:
+                    while json.loads(await asyncio.wait_for(ws.recv(), args.options_timeout))["type"] != "options":
+                        pass
+                    recorder.add("options_ms", (time.perf_counter() - done) * 1000)
+                except asyncio.TimeoutError:
+                    recorder.error("options_timeout")
+            if args.think_time:
+                await asyncio.sleep(args.think_time)
+
+
+async def rest_poller(index, args, client, recorder, stop):
+    token, _ = await login(client, f"bench-poll-{args.run_id}-{index}")
+    headers = {"Authorization": f"Bearer {token}"}
+    endpoints = ["/api/usage/check", "/api/sessions?limit=20"]
+    i = 0
+    while not stop.is_set():
+        path = endpoints[i % len(endpoints)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            resp = await client.get(path, headers=headers)
+            elapsed = (time.perf_counter() - start) * 1000
+            if resp.status_code >= 400:
+                recorder.error(f"rest_{resp.status_code}")
+            recorder.add("rest_ms", elapsed)
+            recorder.add(f"rest_ms {path.split('?')[0]}", elapsed)
+        except httpx.HTTPError:
+            recorder.error("rest_transport")
+        await asyncio.sleep(args.poll_interval)
+
+
+async def sample_process(pid, stop, samples):
+    if psutil is None or pid is None:
+        return
+    process = psutil.Process(pid)
+    process.cpu_percent(None)
+    while not stop.is_set():
+        await asyncio.sleep(0.5)
+        try:
+            samples["cpu"].append(process.cpu_percent(None))
+            samples["rss_mb"].append(process.memory_info().rss / 1024 / 1024)
+        except psutil.Error:
+            return
+
+
+async def run(args, server_pid):
+    recorder = Recorder()
+    stop = asyncio.Event()
+    process_samples = {"cpu": [], "rss_mb": []}
+    limits = httpx.Limits(max_connections=args.clients + args.pollers + 10)
+
+    async with httpx.AsyncClient(base_url=args.server, timeout=60, limits=limits) as client:
+        sampler = asyncio.create_task(sample_process(server_pid, stop, process_samples))
+        pollers = [
+            asyncio.create_task(rest_poller(i, args, client, recorder, stop))
+            for i in range(args.pollers)
+        ]
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[chat_client(i, args, client, recorder) for i in range(args.clients)],
+            return_exceptions=True
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*pollers, return_exceptions=True)
+        await sampler
+
+    for result in results:
+        if isinstance(result, Exception):
+            recorder.error(f"client_{type(result).__name__}")
+
+    report = {
+        "config": {
+            "clients": args.clients,
+            "turns": args.turns,
+            "pollers": args.pollers,
+            "poll_interval": args.poll_interval,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "throughput": {
+            "turns_per_s": round(len(recorder.samples.get("turn_ms", [])) / elapsed, 2),
+            "rest_per_s": round(len(recorder.samples.get("rest_ms", [])) / elapsed, 2),
+        },
+        "latency_ms": {
+            name: summarize(values)
+            for name, values in sorted(recorder.samples.items())
+            if name != "chunk_frames"
+        },
+        "chunk_frames": len(recorder.samples.get("chunk_frames", [])),
+        "errors": recorder.errors,
+    }
+    if process_samples["cpu"]:
+        report["server"] = {
+            "cpu_avg_pct": round(sum(process_samples["cpu"]) / len(process_samples["cpu"]), 1),
+            "cpu_max_pct": round(max(process_samples["cpu"]), 1),
+            "rss_max_mb": round(max(process_samples["rss_mb"]), 1),
+        }
+    return report
+
+
+def compare(report, baseline, max_regression):
+    """返回超过阈值的 p95 回退列表"""
+    failures = []
+    for name in GATED_METRICS:
+        current = report["latency_ms"].get(name)
+        previous = baseline.get("latency_ms", {}).get(name)
+        if not current or not previous or not previous["p95"]:
+            continue
+        change = current["p95"] / previous["p95"] - 1
+        status = "❌" if change > max_regression else "✅"
+        print(f"{status} {name} p95: {previous['p95']}ms -> {current['p95']}ms ({change:+.1%})")
+        if change > max_regression:
+            failures.append(name)
+    return failures
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待 {url} 超时")
+
+
+def spawn(args):
+    """启动模拟接口与服务，返回 (进程列表, 服务进程 PID)"""
+    python = sys.executable
+    processes = [
+        subprocess.Popen([
+            python, os.path.join(BENCH_DIR, "mock_openai.py"), "--port", str(args.openai_port),
+            "--tps", str(args.tps), "--ttft", str(args.ttft), "--reply-tokens", str(args.reply_tokens),
+            "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate),
+            "--drop-rate", str(args.drop_rate)
+        ]),
+        subprocess.Popen([python, os.path.join(BENCH_DIR, "mock_wechat.py"), "--port", str(args.wechat_port)]),
+    ]
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{args.openai_port}",
+        OPENAI_API_KEY="bench",
+        OPENAI_MODEL="mock",
+        WECHAT_API_BASE=f"http://127.0.0.1:{args.wechat_port}",
+        WECHAT_APP_ID="bench",
+        WECHAT_APP_SECRET="bench",
+    )
+    port = args.server.rsplit(":", 1)[-1].strip("/")
+    server = subprocess.Popen(
+        [python, "-m", "uvicorn", "app:app", "--port", port, "--log-level", "warning"],
+        cwd=SERVER_DIR, env=env
+    )
+    processes.append(server)
+    wait_for(f"http://127.0.0.1:{args.openai_port}/stats")
+    wait_for(f"http://127.0.0.1:{args.wechat_port}/stats")
+    wait_for(f"{args.server}/health")
+    return processes, server.pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Coach 压测")
+    parser.add_argument("--server", default="http://127.0.0.1:8000")
+    parser.add_argument("--server-pid", type=int, help="服务进程 PID（用于采集 CPU/内存）")
+    parser.add_argument("--clients", type=int, default=20, help="并发 WebSocket 客户端数")
+    parser.add_argument("--turns", type=int, default=3, help="每个客户端的对话轮数")
+    parser.add_argument("--think-time", type=float, default=0.0, help="两轮之间的间隔（秒）")
+    parser.add_argument("--options-timeout", type=float, default=5.0, help="done 之后等待选项的时间，0 表示不等待")
+    parser.add_argument("--pollers", type=int, default=10, help="并发 REST 轮询客户端数")
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--save", help="将结果保存为 JSON（作为基线）")
+    parser.add_argument("--baseline", help="与基线 JSON 比较")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的 p95 回退比例")
+    spawn_group = parser.add_argument_group("--spawn 模式（启动模拟接口和服务）")
+    spawn_group.add_argument("--spawn", action="store_true")
+    spawn_group.add_argument("--openai-port", type=int, default=9200)
+    spawn_group.add_argument("--wechat-port", type=int, default=9100)
+    spawn_group.add_argument("--tps", type=float, default=50.0)
+    spawn_group.add_argument("--ttft", type=float, default=0.3)
+    spawn_group.add_argument("--reply-tokens", type=int, default=120)
+    spawn_group.add_argument("--error-rate", type=float, default=0.0)
+    spawn_group.add_argument("--rate-limit-rate", type=float, default=0.0)
+    spawn_group.add_argument("--drop-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    args.run_id = uuid.uuid4().hex[:8]
+
+    processes = []
+    server_pid = args.server_pid
+    try:
+        if args.spawn:
+            processes, server_pid = spawn(args)
+        report = asyncio.run(run(args, server_pid))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=15)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = compare(report, baseline, args.max_regression)
+        if failures:
+            print(f"性能回退超过 {args.max_regression:.0%}: {', '.join(failures)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""本地模拟 OpenAI 兼容的 chat/completions 接口，用于压测与回归测试
+
+用法：python bench/mock_openai.py [--port 9200] [--tps 50] [--ttft 0.3] [--reply-tokens 120]
+                                  [--error-rate 0] [--rate-limit-rate 0] [--drop-rate 0]
+然后设置 OPENAI_BASE_URL=http://127.0.0.1:9200 启动服务。
+
+- 流式请求：等待 ttft 秒后按 tps（token/秒）输出 reply-tokens 个增量
+- 非流式请求：带 max_tokens 的视为摘要请求，其余返回智能选项 JSON
+- error-rate / rate-limit-rate：按概率返回 500 / 429（带 Retry-After）
+- drop-rate：按概率在流式输出中途断开，不发送 [DONE]
+- 续写请求（最后一条消息要求从中断处继续）：从该部分回复的长度处接着输出，
+  先重复 continue-overlap 个已输出的字符，用于验证去重
+GET /stats 返回请求计数，POST /config 可在运行中修改上述参数。
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+config = {
+    "tps": 50.0,
+    "ttft": 0.3,
+    "reply_tokens": 120,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "retry_after": 1,
+    "drop_rate": 0.0,
+    "continue_overlap": 0,
+}
+counters = {
+    "stream": 0, "continued": 0, "completion": 0, "errors": 0, "rate_limited": 0, "dropped": 0, "in_flight": 0
+}
+
+REPLY_TEXT = (
+    "这是一个很好的问题。作为高管，你在团队管理中遇到的挑战往往源于沟通方式和期望的不一致。"
+    "我想先了解一下：你认为目前团队中最让你困扰的具体场景是什么？当这种情况发生时，你通常会怎么做？"
+)
+
+OPTIONS = [
+    {"label": "分析团队协作", "value": "我想深入分析一下团队协作方面的问题"},
+    {"label": "明确目标", "value": "帮我梳理一下这个季度最重要的目标"},
+    {"label": "下一步行动", "value": "接下来我应该先做哪件事？"},
+]
+
+
+def _chunk(content):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "mock",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+    }
+
+
+def _injected_error():
+    roll = random.random()
+    if roll < config["rate_limit_rate"]:
+        counters["rate_limited"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+            headers={"Retry-After": str(config["retry_after"])}
+        )
+    if roll < config["rate_limit_rate"] + config["error_rate"]:
+        counters["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"message": "Injected error", "type": "server_error"}})
+    return None
+
+
+async def _stream(offset=0):
+    counters["in_flight"] += 1
+    try:
+        await asyncio.sleep(config["ttft"])
+        tokens = max(config["reply_tokens"] - offset, 0)
+        drop_at = random.randrange(1, tokens) if tokens > 1 and random.random() < config["drop_rate"] else None
+        interval = 1 / config["tps"] if config["tps"] > 0 else 0
+        start = time.perf_counter()
+        for i in range(tokens):
+            if i == drop_at:
+                counters["dropped"] += 1
+                raise ConnectionError("injected stream drop")
+            text = REPLY_TEXT[(offset + i) % len(REPLY_TEXT)]
+            yield f"data: {json.dumps(_chunk(text), ensure_ascii=False)}\n\n".encode("utf-8")
+            # 按绝对时间对齐，避免 sleep 误差累积
+            delay = start + (i + 1) * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield b"data: [DONE]\n\n"
+    finally:
+        counters["in_flight"] -= 1
+
+
+@app.post("/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    if body.get("stream"):
+        counters["stream"] += 1
+        messages = body.get("messages") or []
+        offset = 0
+        if len(messages) >= 2 and messages[-2].get("role") == "assistant" \
+                and "中断处" in messages[-1].get("content", ""):
+            # 续写：从已输出部分之后接着输出（可配置重复开头几个字符）
+            counters["continued"] += 1
+            offset = max(len(messages[-2].get("content", "")) - config["continue_overlap"], 0)
+        return StreamingResponse(_stream(offset), media_type="text/event-stream")
+
+    counters["completion"] += 1
+    await asyncio.sleep(config["ttft"])
+    if body.get("max_tokens"):
+        content = "用户是一名创业公司 CEO，正在处理团队沟通不畅的问题。"
+    else:
+        content = json.dumps(OPTIONS, ensure_ascii=False)
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "model": "mock",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return {**counters, "config": config}
+
+
+@app.post("/config")
+async def update_config(request: Request):
+    for key, value in (await request.json()).items():
+        if key in config:
+            config[key] = type(config[key])(value)
+    return config
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--tps", type=float, default=50.0, help="每秒输出 token 数")
+    parser.add_argument("--ttft", type=float, default=0.3, help="首个 token 前的延迟（秒）")
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--continue-overlap", type=int, default=0, help="续写时重复输出的已输出字符数")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = parse_args()
+    for key in config:
+        config[key] = getattr(args, key)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""本地模拟微信开放接口，用于测试 access_token 缓存与登录流程
+
+用法：python bench/mock_wechat.py [--port 9100] [--expires-in 7200] [--latency 0.05]
+然后设置 WECHAT_API_BASE=http://127.0.0.1:9100 启动服务。
+GET /stats 返回各接口被调用的次数。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+
+from fastapi import FastAPI, Request
+
+app = FastAPI()
+
+config = {"expires_in": 7200, "latency": 0.05}
+counters = {"token": 0, "jscode2session": 0, "getuserphonenumber": 0}
+valid_tokens = set()
+_token_seq = itertools.count(1)
+
+
+@app.get("/cgi-bin/token")
+async def token(grant_type: str = "", appid: str = "", secret: str = ""):
+    counters["token"] += 1
+    await asyncio.sleep(config["latency"])
+    if grant_type != "client_credential":
+        return {"errcode": 40002, "errmsg": "invalid grant_type"}
+    access_token = f"mock-token-{next(_token_seq)}"
+    valid_tokens.add(access_token)
+    return {"access_token": access_token, "expires_in": config["expires_in"]}
+
+
+@app.get("/sns/jscode2session")
+async def jscode2session(js_code: str = ""):
+    counters["jscode2session"] += 1
+    await asyncio.sleep(config["latency"])
+    if not js_code:
+        return {"errcode": 40029, "errmsg": "invalid code"}
+    openid = "mock-" + hashlib.sha1(js_code.encode()).hexdigest()[:24]
+    return {"openid": openid, "session_key": "mock-session-key"}
+
+
+@app.post("/wxa/business/getuserphonenumber")
+async def getuserphonenumber(request: Request, access_token: str = ""):
+    counters["getuserphonenumber"] += 1
+    await asyncio.sleep(config["latency"])
+    if access_token not in valid_tokens:
+        return {"errcode": 40001, "errmsg": "invalid credential"}
+    body = await request.json()
+    code = body.get("code") or ""
+    suffix = str(int(hashlib.sha1(code.encode()).hexdigest(), 16))[:8]
+    return {"errcode": 0, "errmsg": "ok", "phone_info": {"phoneNumber": f"138{suffix}"}}
+
+
+@app.post("/revoke")
+async def revoke():
+    """使已签发的 token 全部失效，模拟微信侧提前过期"""
+    valid_tokens.clear()
+    return {"revoked": True}
+
+
+@app.get("/stats")
+async def stats():
+    return counters
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--expires-in", type=int, default=7200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    config["expires_in"] = args.expires_in
+    config["latency"] = args.latency
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
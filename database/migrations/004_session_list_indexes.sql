@@ -0,0 +1,5 @@
+-- 会话列表键集分页：(created_at, id) 作为游标，id 用于同一时间戳的排序
+CREATE INDEX IF NOT EXISTS idx_sessions_user_created_id ON chat_sessions(user_id, created_at DESC, id DESC);
+
+-- 会话首条用户消息查询（会话列表标题）
+CREATE INDEX IF NOT EXISTS idx_messages_session_user_created ON chat_messages(session_id, created_at ASC) WHERE role = 'user';
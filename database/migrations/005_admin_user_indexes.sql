@@ -0,0 +1,9 @@
+-- 管理后台用户列表：按注册时间键集分页
+CREATE INDEX IF NOT EXISTS idx_users_created_id ON users(created_at DESC, id DESC);
+
+-- 会员筛选
+CREATE INDEX IF NOT EXISTS idx_users_premium_created_id ON users(created_at DESC, id DESC) WHERE is_premium;
+
+-- 昵称、手机号前缀搜索（LIKE 'xxx%'）
+CREATE INDEX IF NOT EXISTS idx_users_nickname_prefix ON users(nickname text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_phone_prefix ON users(phone text_pattern_ops);
@@ -0,0 +1,3 @@
+-- 会话滚动摘要：超出上下文预算的旧消息压缩后保存
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary TEXT;
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summarized_count INTEGER NOT NULL DEFAULT 0;
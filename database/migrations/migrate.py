@@ -6,6 +6,7 @@ Database migration script
 import psycopg2
 import sys
 import io
+import os
 
 # Set UTF-8 encoding for Windows console
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
@@ -19,6 +20,13 @@ DB_CONFIG = {
     'password': '123456'
 }
 
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def read_sql(filename):
+    """Read a migration file from this directory"""
+    with open(os.path.join(MIGRATIONS_DIR, filename), encoding='utf-8') as f:
+        return f.read()
+
 # Migration SQL statements
 MIGRATIONS = [
     {
@@ -28,6 +36,18 @@ MIGRATIONS = [
     {
         'name': '003_add_phone_field',
         'sql': 'ALTER TABLE users ADD COLUMN IF NOT EXISTS phone VARCHAR(20);'
+    },
+    {
+        'name': '004_session_list_indexes',
+        'sql': read_sql('004_session_list_indexes.sql')
+    },
+    {
+        'name': '005_admin_user_indexes',
+        'sql': read_sql('005_admin_user_indexes.sql')
+    },
+    {
+        'name': '006_session_summary',
+        'sql': read_sql('006_session_summary.sql')
     }
 ]
 
@@ -83,6 +83,10 @@ const ChatPage = () => {
       setStreamingText(prev => prev + text);
     };
 
+    websocket.onSnapshot = (content: string) => {
+      setStreamingText(content);
+    };
+
     websocket.onDone = (sid: string) => {
       setStreamingText(current => {
         if (current) {
@@ -132,6 +132,10 @@ const ToolsPage = () => {
       setStreamingText(prev => prev + text);
     };
 
+    websocket.onSnapshot = (content: string) => {
+      setStreamingText(content);
+    };
+
     websocket.onDone = (sid: string) => {
       setStreamingText(current => {
         if (current) {
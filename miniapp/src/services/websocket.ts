@@ -9,12 +9,20 @@ class WebSocketService {
   private reconnectTimer: NodeJS.Timeout | null = null;
   private heartbeatTimer: NodeJS.Timeout | null = null;
   private isConnecting = false;
+  // 进行中的一轮：断线重连后凭 sessionId + lastSeq 续传
+  private streamingSessionId: string | null = null;
+  private pendingTurn = false;
+  // seq 只在同一轮内递增：按轮去重，发送新消息后上一轮迟到的帧（如选项）直接忽略
+  private lastSeq = 0;
+  private currentTurn: string | null = null;
+  private staleTurn: string | null = null;
 
   onChunk?: (text: string) => void;
   onDone?: (sessionId: string) => void;
   onError?: (error: string) => void;
   onSession?: (sessionId: string) => void;
   onOptions?: (options: SuggestedOption[]) => void;
+  onSnapshot?: (content: string) => void;
 
   async connect(): Promise<void> {
     if (this.socket || this.isConnecting) {
@@ -39,20 +47,45 @@ class WebSocketService {
         console.log('WebSocket 已连接');
         this.isConnecting = false;
         this.startHeartbeat();
+        this.resumeStream();
       });
 
       Taro.onSocketMessage((res) => {
         try {
           const data: WSMessage = JSON.parse(res.data as string);
 
+          if (data.turn) {
+            if (data.turn === this.staleTurn) return;
+            if (data.turn !== this.currentTurn) {
+              this.currentTurn = data.turn;
+              this.lastSeq = 0;
+            }
+          }
+
+          if (data.seq) {
+            if (data.seq <= this.lastSeq) return;
+            this.lastSeq = data.seq;
+          }
+
           if (data.type === 'chunk' && data.content) {
             this.onChunk?.(data.content);
           } else if (data.type === 'options' && data.options) {
             this.onOptions?.(data.options);
+          } else if (data.type === 'snapshot') {
+            this.onSnapshot?.(data.content || '');
           } else if (data.type === 'done' && data.sessionId) {
+            this.pendingTurn = false;
             this.onDone?.(data.sessionId);
           } else if (data.type === 'session' && data.sessionId) {
+            this.streamingSessionId = data.sessionId;
             this.onSession?.(data.sessionId);
+          } else if (data.type === 'resumed') {
+            if (!data.streaming && this.pendingTurn) {
+              // 之后不会再有本轮的帧（缓冲区已过期，回复已保存）：结束当前的流式状态；
+              // streaming 为 true 时服务端会补发到 done，由 done 结束
+              this.pendingTurn = false;
+              this.onDone?.(data.sessionId || '');
+            }
           } else if (data.type === 'error') {
             this.onError?.(data.error || '未知错误');
           }
@@ -61,10 +94,12 @@ class WebSocketService {
         }
       });
 
-      Taro.onSocketClose(() => {
+      Taro.onSocketClose((res) => {
         console.log('WebSocket 已关闭');
         this.stopHeartbeat();
         this.socket = null;
+        // 1008：服务端拒绝了连接参数（用户无效），重连也不会成功
+        if (res?.code === 1008) return;
         this.scheduleReconnect();
       });
 
@@ -83,6 +118,12 @@ class WebSocketService {
       throw new Error('WebSocket 未连接');
     }
 
+    this.streamingSessionId = sessionId || null;
+    this.pendingTurn = true;
+    this.staleTurn = this.currentTurn;
+    this.currentTurn = null;
+    this.lastSeq = 0;
+
     Taro.sendSocketMessage({
       data: JSON.stringify({ message, toolType, sessionId }),
       fail: (err) => {
@@ -92,6 +133,13 @@ class WebSocketService {
     });
   }
 
+  private resumeStream(): void {
+    if (!this.pendingTurn || !this.streamingSessionId) return;
+    Taro.sendSocketMessage({
+      data: JSON.stringify({ type: 'resume', sessionId: this.streamingSessionId, lastSeq: this.lastSeq })
+    });
+  }
+
   private startHeartbeat(): void {
     this.heartbeatTimer = setInterval(() => {
       if (this.socket) {
@@ -37,11 +37,14 @@ export interface SuggestedOption {
 }
 
 export interface WSMessage {
-  type: 'chunk' | 'done' | 'error' | 'session' | 'options';
+  type: 'chunk' | 'done' | 'error' | 'session' | 'options' | 'snapshot' | 'resumed';
   content?: string;
   sessionId?: string;
   error?: string;
   options?: SuggestedOption[];
+  seq?: number;
+  turn?: string;
+  streaming?: boolean;
 }
 
 export interface APIResponse<T = any> {
@@ -2,12 +2,51 @@
 from dotenv import load_dotenv
 load_dotenv('../.env')
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from routes import auth, chat, usage, admin
 from websocket import chat_handler
+from services import llm_client, wechat
+from services.history_cache import history_cache
+from services.context_builder import context_builder, load_tokenizer
+from services.options_cache import options_cache
+from services.quota_cache import quota_cache, QUOTA_CACHE_ENABLED
+from services.message_writer import message_writer
+from services.coordination import coordinator
+from services.turn_stream import turn_streams
+from services.upstream_scheduler import upstream_scheduler
+from services.upstream_pool import upstream_pool
+from services.retry_policy import retry_budget
+from services.json_codec import FastJSONResponse, CODEC as JSON_CODEC
+from services.frame_coalescer import get_coalescer_stats
+from services.database import async_engine, warm_pool, pool_stats
+from services.metrics import Gauge, MetricsMiddleware, instrument_engine, render_metrics
 
-app = FastAPI(title="AI Coach API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动：创建共享的上游 LLM 连接池
+    llm_client.init_llm_client()
+    wechat.init_wechat_client()
+    message_writer.start()
+    if QUOTA_CACHE_ENABLED:
+        quota_cache.start()
+    await warm_pool()
+    await load_tokenizer()
+    yield
+    # 关闭：等待进行中的回复完成，写完排队中的消息和次数增量，释放连接池
+    await turn_streams.stop()
+    await context_builder.stop()
+    await message_writer.stop()
+    if QUOTA_CACHE_ENABLED:
+        await quota_cache.stop()
+    await llm_client.close_llm_client()
+    await wechat.close_wechat_client()
+    await coordinator.close()
+    await async_engine.dispose()
+
+app = FastAPI(title="AI Coach API", version="1.0.0", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # CORS
 app.add_middleware(
@@ -18,6 +57,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求耗时与按路由的数据库耗时统计
+app.add_middleware(MetricsMiddleware)
+instrument_engine(async_engine.sync_engine)
+
 # 路由
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(chat.router, prefix="/api", tags=["chat"])
@@ -33,4 +76,35 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "json_codec": JSON_CODEC,
+        "db_pool": pool_stats(),
+        "llm_pool": llm_client.get_pool_stats(),
+        "upstream_scheduler": upstream_scheduler.stats(),
+        "upstream_pool": upstream_pool.stats(),
+        "retry_budget": retry_budget.stats(),
+        "history_cache": history_cache.stats(),
+        "context": context_builder.stats(),
+        "options_cache": options_cache.stats(),
+        "quota_cache": quota_cache.stats(),
+        "message_writer": message_writer.stats(),
+        "ws_frames": get_coalescer_stats(),
+        "wechat_token": wechat.access_token_manager.stats(),
+        "turn_streams": turn_streams.stats(),
+        "coordination": coordinator.stats()
+    }
+
+# 由现有统计派生的指标，在输出时读取
+Gauge("llm_requests_in_flight", "进行中的上游请求数", function=lambda: llm_client.get_pool_stats()["in_flight"])
+Gauge("upstream_queue_depth", "排队等待上游的调用数", function=lambda: upstream_scheduler.queued)
+Gauge("upstream_concurrency_limit", "当前上游并发上限（自适应）", function=lambda: upstream_scheduler.capacity)
+Gauge("db_pool_checked_out", "已取出的数据库连接数", function=lambda: pool_stats().get("checked_out", 0))
+Gauge("db_pool_utilization", "数据库连接池使用率（已取出 / 池大小 + 溢出上限）", function=lambda: pool_stats().get("utilization", 0))
+Gauge("message_writer_queue_size", "消息写入队列长度", function=lambda: message_writer.stats()["queued"])
+Gauge("turn_streams_running", "进行中的对话输出数（含客户端已断开的）", function=lambda: turn_streams.stats()["running"])
+Gauge("quota_cache_pending_users", "待回写的使用次数增量数", function=lambda: quota_cache.stats()["pending_daily"])
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 from services.database import Base
 from datetime import datetime
@@ -11,3 +11,6 @@ class ChatSession(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     tool_type = Column(String(50), default="free_chat")
     created_at = Column(DateTime, default=datetime.utcnow)
+    # 滚动摘要：最早的 summarized_count 条消息已压缩进 summary
+    summary = Column(Text)
+    summarized_count = Column(Integer, default=0, nullable=False)
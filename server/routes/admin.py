@@ -1,9 +1,18 @@
 # 管理员路由
-from fastapi import APIRouter, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
-from services.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.database import get_async_db, AsyncSessionLocal
+from services.pagination import cursor_key
+from services.quota_cache import quota_cache
+from services.json_codec import dumps_text
 from models.user import User
 from pydantic import BaseModel
+from datetime import datetime
+from uuid import UUID
+import csv
+import io
 
 router = APIRouter()
 
@@ -16,6 +25,42 @@ def verify_admin(authorization: str = Header(None)):
 class QuotaUpdate(BaseModel):
     amount: int
 
+USERS_PAGE_DEFAULT = 50
+EXPORT_BATCH_SIZE = 500
+EXPORT_FIELDS = ["id", "phone", "nickname", "avatar_url", "daily_quota", "purchased_quota", "created_at"]
+
+def user_filters(
+    nickname: str = None,
+    phone: str = None,
+    is_premium: bool = None,
+    created_from: datetime = None,
+    created_to: datetime = None
+):
+    """用户列表筛选条件（昵称、手机号前缀匹配）"""
+    conditions = []
+    if nickname:
+        conditions.append(User.nickname.startswith(nickname, autoescape=True))
+    if phone:
+        conditions.append(User.phone.startswith(phone, autoescape=True))
+    if is_premium is not None:
+        conditions.append(User.is_premium == is_premium)
+    if created_from:
+        conditions.append(User.created_at >= created_from)
+    if created_to:
+        conditions.append(User.created_at < created_to)
+    return conditions
+
+def serialize_user(user):
+    return {
+        "id": str(user.id),
+        "phone": getattr(user, 'phone', ''),
+        "nickname": user.nickname,
+        "avatar_url": user.avatar_url,
+        "daily_quota": user.daily_quota,
+        "purchased_quota": user.purchased_quota,
+        "created_at": user.created_at.isoformat()
+    }
+
 @router.post("/login")
 async def admin_login(authorization: str = Header(None)):
     """管理员登录"""
@@ -29,42 +74,101 @@ async def admin_login(authorization: str = Header(None)):
 
 @router.get("/users")
 async def get_users(
-    db: Session = Depends(get_db),
+    limit: int = Query(None, ge=1, le=200),
+    before: UUID = None,
+    filters: list = Depends(user_filters),
+    db: AsyncSession = Depends(get_async_db),
     _: bool = Depends(verify_admin)
 ):
-    """获取用户列表"""
-    users = db.query(User).order_by(User.created_at.desc()).all()
+    """获取用户列表（按注册时间倒序，before 为上一页最后一个用户的 id）
+
+    未带 limit / before 时返回全部匹配的用户（兼容不分页的管理后台）；只带 before 时每页 USERS_PAGE_DEFAULT 条。
+    """
+    paged = limit is not None or before is not None
+    limit = limit or USERS_PAGE_DEFAULT
+    stmt = (
+        select(User)
+        .where(*filters)
+        .order_by(User.created_at.desc(), User.id.desc())
+    )
+    if paged:
+        stmt = stmt.limit(limit + 1)
+    if before:
+        stmt = stmt.where(tuple_(User.created_at, User.id) < await cursor_key(db, User, before))
+
+    result = await db.execute(stmt)
+    users = result.scalars().all()
+    has_more = paged and len(users) > limit
+    if paged:
+        users = users[:limit]
+
     return {
         "code": 0,
         "message": "success",
-        "data": [
-            {
-                "id": str(user.id),
-                "phone": getattr(user, 'phone', ''),
-                "nickname": user.nickname,
-                "avatar_url": user.avatar_url,
-                "daily_quota": user.daily_quota,
-                "purchased_quota": user.purchased_quota,
-                "created_at": user.created_at.isoformat()
-            }
-            for user in users
-        ]
+        "data": [serialize_user(user) for user in users],
+        "nextCursor": str(users[-1].id) if has_more else None
     }
 
+@router.get("/users/export")
+async def export_users(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    filters: list = Depends(user_filters),
+    _: bool = Depends(verify_admin)
+):
+    """导出用户（服务端游标逐批读取，流式输出 CSV / NDJSON）"""
+    stmt = (
+        select(User)
+        .where(*filters)
+        .order_by(User.created_at.desc(), User.id.desc())
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    async def generate():
+        # 导出持续时间较长，使用独立的数据库会话
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(stmt)
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+                writer.writeheader()
+            async for users in result.scalars().partitions():
+                if format == "csv":
+                    writer.writerows(serialize_user(user) for user in users)
+                    chunk = buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                else:
+                    chunk = "".join(
+                        dumps_text(serialize_user(user)) + "\n"
+                        for user in users
+                    )
+                yield chunk
+            if format == "csv" and buffer.tell():
+                yield buffer.getvalue()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"users.{format}"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 @router.post("/users/{user_id}/quota")
 async def update_user_quota(
     user_id: str,
     quota_update: QuotaUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     _: bool = Depends(verify_admin)
 ):
     """修改用户购买次数"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         return {"code": 1, "message": "用户不存在"}
 
     user.purchased_quota = max(0, user.purchased_quota + quota_update.amount)
-    db.commit()
+    await db.commit()
+    await quota_cache.invalidate(user_id)
 
     return {
         "code": 0,
@@ -1,20 +1,17 @@
 # 认证路由
-from fastapi import APIRouter, Depends, HTTPException, Header
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from services.database import get_db
+from services.database import get_async_db
+from services.auth import JWT_SECRET, get_user_id_from_token
+from services.wechat import code2session, get_phone_number, WeChatError, AccessTokenError
 from models.user import User
-import os
-import httpx
 import jwt
 from datetime import datetime, timedelta
 
 router = APIRouter()
 
-WECHAT_APP_ID = os.getenv("WECHAT_APP_ID")
-WECHAT_APP_SECRET = os.getenv("WECHAT_APP_SECRET")
-JWT_SECRET = os.getenv("JWT_SECRET")
-
 class LoginRequest(BaseModel):
     code: str
 
@@ -24,34 +21,25 @@ class UpdateProfileRequest(BaseModel):
     avatar_url: str = None
 
 @router.post("/login", response_model=dict)
-async def login(req: LoginRequest, db: Session = Depends(get_db)):
+async def login(req: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     # 调用微信 API 用 code 换取 openid
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(
-            "https://api.weixin.qq.com/sns/jscode2session",
-            params={
-                "appid": WECHAT_APP_ID,
-                "secret": WECHAT_APP_SECRET,
-                "js_code": req.code,
-                "grant_type": "authorization_code"
-            }
-        )
-        data = resp.json()
-
-        if "errcode" in data and data["errcode"] != 0:
-            raise HTTPException(status_code=400, detail=data.get("errmsg", "微信登录失败"))
+    try:
+        data = await code2session(req.code)
+    except WeChatError as e:
+        raise HTTPException(status_code=400, detail=e.errmsg or "微信登录失败")
 
-        openid = data.get("openid")
-        if not openid:
-            raise HTTPException(status_code=400, detail="获取 openid 失败")
+    openid = data.get("openid")
+    if not openid:
+        raise HTTPException(status_code=400, detail="获取 openid 失败")
 
     # 查询或创建用户
-    user = db.query(User).filter(User.openid == openid).first()
+    result = await db.execute(select(User).where(User.openid == openid))
+    user = result.scalars().first()
     if not user:
         user = User(openid=openid)
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
 
     # 生成 JWT token
     payload = {
@@ -70,64 +58,27 @@ async def login(req: LoginRequest, db: Session = Depends(get_db)):
         }
     }
 
-def get_user_id_from_token(authorization: str = Header(None)):
-    """从 JWT token 中获取用户 ID"""
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="未授权")
-
-    token = authorization.replace("Bearer ", "")
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return payload.get("user_id")
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token 已过期")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="无效的 Token")
-
 @router.post("/update-profile", response_model=dict)
 async def update_profile(
     req: UpdateProfileRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: str = Depends(get_user_id_from_token)
 ):
     """更新用户信息（昵称、头像、手机号）"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         return {"code": 1, "message": "用户不存在"}
 
-    # 调用微信 API 获取手机号
-    async with httpx.AsyncClient() as client:
-        # 获取 access_token
-        token_resp = await client.get(
-            "https://api.weixin.qq.com/cgi-bin/token",
-            params={
-                "grant_type": "client_credential",
-                "appid": WECHAT_APP_ID,
-                "secret": WECHAT_APP_SECRET
-            }
-        )
-        token_data = token_resp.json()
-
-        if "errcode" in token_data and token_data["errcode"] != 0:
-            return {"code": 1, "message": f"获取 access_token 失败: {token_data.get('errmsg')}"}
-
-        access_token = token_data.get("access_token")
-
-        # 获取手机号
-        phone_resp = await client.post(
-            f"https://api.weixin.qq.com/wxa/business/getuserphonenumber?access_token={access_token}",
-            json={"code": req.phone_code}
-        )
-        phone_data = phone_resp.json()
-
-        if phone_data.get("errcode") != 0:
-            return {"code": 1, "message": f"获取手机号失败: {phone_data.get('errmsg')}"}
-
-        phone_info = phone_data.get("phone_info", {})
-        phone_number = phone_info.get("phoneNumber")
+    # 调用微信 API 获取手机号（access_token 由 token 管理器缓存）
+    try:
+        phone_number = await get_phone_number(req.phone_code)
+    except AccessTokenError as e:
+        return {"code": 1, "message": f"获取 access_token 失败: {e.errmsg}"}
+    except WeChatError as e:
+        return {"code": 1, "message": f"获取手机号失败: {e.errmsg}"}
 
-        if not phone_number:
-            return {"code": 1, "message": "获取手机号失败"}
+    if not phone_number:
+        return {"code": 1, "message": "获取手机号失败"}
 
     # 更新用户信息
     user.nickname = req.nickname
@@ -135,7 +86,7 @@ async def update_profile(
     if req.avatar_url:
         user.avatar_url = req.avatar_url
 
-    db.commit()
+    await db.commit()
 
     return {
         "code": 0,
@@ -1,44 +1,32 @@
 # 聊天路由
-from fastapi import APIRouter, Depends, Header, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select, tuple_, true
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from services.database import get_db
+from uuid import UUID
+from services.database import get_async_db
+from services.auth import get_user_id_from_token
+from services.message_writer import message_writer
+from services.json_codec import FastJSONResponse
+from services.pagination import cursor_key
 from models.chat_session import ChatSession
 from models.chat_message import ChatMessage
-from datetime import datetime
-import jwt
-import os
 
 router = APIRouter()
 
-JWT_SECRET = os.getenv("JWT_SECRET")
-
-def get_user_id_from_token(authorization: str = Header(None)) -> str:
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="未授权")
-
-    token = authorization.replace("Bearer ", "")
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return payload["user_id"]
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token 已过期")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="无效的 Token")
-
 class CreateSessionRequest(BaseModel):
     tool_type: str
 
 @router.post("/sessions")
 async def create_session(
     req: CreateSessionRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: str = Depends(get_user_id_from_token)
 ):
     session = ChatSession(user_id=user_id, tool_type=req.tool_type)
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
 
     return {
         "code": 0,
@@ -51,48 +39,130 @@ async def create_session(
         }
     }
 
+SESSIONS_PAGE_DEFAULT = 20
+
 @router.get("/sessions")
 async def get_sessions(
-    db: Session = Depends(get_db),
+    limit: int = Query(None, ge=1, le=100),
+    before: UUID = None,
+    db: AsyncSession = Depends(get_async_db),
     user_id: str = Depends(get_user_id_from_token)
 ):
-    sessions = db.query(ChatSession).filter(
-        ChatSession.user_id == user_id
-    ).order_by(ChatSession.created_at.desc()).all()
-
-    result = []
-    for s in sessions:
-        # 查询该会话的第一条用户消息
-        first_user_msg = db.query(ChatMessage).filter(
-            ChatMessage.session_id == s.id,
-            ChatMessage.role == "user"
-        ).order_by(ChatMessage.created_at.asc()).first()
-
-        result.append({
-            "id": str(s.id),
-            "userId": str(s.user_id),
-            "toolType": s.tool_type,
-            "createdAt": s.created_at.isoformat(),
-            "firstMessage": first_user_msg.content if first_user_msg else "新对话"
-        })
+    """会话列表（按创建时间倒序，before 为上一页最后一个会话的 id）
 
-    return {
+    未带 limit / before 时返回全部会话（兼容按完整列表过滤的旧客户端）；只带 before 时每页 SESSIONS_PAGE_DEFAULT 条。
+    """
+    paged = limit is not None or before is not None
+    limit = limit or SESSIONS_PAGE_DEFAULT
+    # 每个会话的第一条用户消息，通过 LATERAL 子查询一次取回
+    first_msg = (
+        select(ChatMessage.content)
+        .where(ChatMessage.session_id == ChatSession.id, ChatMessage.role == "user")
+        .order_by(ChatMessage.created_at.asc())
+        .limit(1)
+        .lateral("first_msg")
+    )
+
+    stmt = (
+        select(ChatSession, first_msg.c.content)
+        .outerjoin(first_msg, true())
+        .where(ChatSession.user_id == user_id)
+        .order_by(ChatSession.created_at.desc(), ChatSession.id.desc())
+    )
+    if paged:
+        stmt = stmt.limit(limit + 1)
+
+    # 键集分页：从游标会话之后继续
+    if before:
+        stmt = stmt.where(
+            tuple_(ChatSession.created_at, ChatSession.id)
+            < await cursor_key(db, ChatSession, before, ChatSession.user_id == user_id)
+        )
+
+    result = await db.execute(stmt)
+    rows = result.all()
+    has_more = paged and len(rows) > limit
+    if paged:
+        rows = rows[:limit]
+
+    # 列表接口直接返回响应对象，跳过 FastAPI 对返回值的逐项 jsonable_encoder 遍历
+    return FastJSONResponse({
         "code": 0,
         "message": "success",
-        "data": result
-    }
+        "data": [
+            {
+                "id": str(s.id),
+                "userId": str(s.user_id),
+                "toolType": s.tool_type,
+                "createdAt": s.created_at.isoformat(),
+                "firstMessage": first_message or "新对话"
+            }
+            for s, first_message in rows
+        ],
+        "nextCursor": str(rows[-1][0].id) if has_more else None
+    })
+
+MESSAGES_PAGE_DEFAULT = 50
+MESSAGES_PAGE_MAX = 200
 
 @router.get("/sessions/{session_id}/messages")
 async def get_messages(
     session_id: str,
-    db: Session = Depends(get_db),
+    limit: int = Query(None, ge=1, le=MESSAGES_PAGE_MAX),
+    before: UUID = None,
+    after: UUID = None,
+    since: UUID = None,
+    db: AsyncSession = Depends(get_async_db),
     user_id: str = Depends(get_user_id_from_token)
 ):
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at.asc()).all()
+    """会话消息（键集分页）
 
-    return {
+    - 不带任何参数：全部消息（兼容一次加载完整历史的旧客户端）
+    - 只带 limit：最新的 limit 条
+    - before：早于该消息的 limit 条（向上翻页）
+    - after：晚于该消息的 limit 条（向下翻页）
+    - since：增量同步，返回晚于该消息的全部消息（单次最多 MESSAGES_PAGE_MAX 条）
+
+    带游标但未带 limit 时每页 MESSAGES_PAGE_DEFAULT 条。
+    """
+    if since:
+        after = since
+        limit = MESSAGES_PAGE_MAX
+    paged = limit is not None or before is not None or after is not None
+    limit = limit or MESSAGES_PAGE_DEFAULT
+
+    # 读己之写：等待该会话尚在写入队列中的消息落库
+    await message_writer.sync(session_id)
+
+    key = tuple_(ChatMessage.created_at, ChatMessage.id)
+    stmt = select(ChatMessage).where(ChatMessage.session_id == session_id)
+
+    cursor_id = after or before
+    if cursor_id:
+        cursor = await cursor_key(db, ChatMessage, cursor_id, ChatMessage.session_id == session_id)
+
+    if after:
+        # 向后读取：正序取 limit + 1 条
+        stmt = stmt.where(key > cursor).order_by(
+            ChatMessage.created_at.asc(), ChatMessage.id.asc()
+        )
+    else:
+        # 最新一页或向前翻页：倒序取 limit + 1 条，返回前再反转
+        if before:
+            stmt = stmt.where(key < cursor)
+        stmt = stmt.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+
+    if paged:
+        stmt = stmt.limit(limit + 1)
+    result = await db.execute(stmt)
+    messages = list(result.scalars().all())
+    has_more = paged and len(messages) > limit
+    if paged:
+        messages = messages[:limit]
+    if not after:
+        messages.reverse()
+
+    return FastJSONResponse({
         "code": 0,
         "message": "success",
         "data": [
@@ -104,5 +174,8 @@ async def get_messages(
                 "createdAt": m.created_at.isoformat()
             }
             for m in messages
-        ]
-    }
+        ],
+        "hasMore": has_more,
+        "prevCursor": str(messages[0].id) if messages else before and str(before),
+        "nextCursor": str(messages[-1].id) if messages else after and str(after)
+    })
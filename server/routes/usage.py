@@ -1,78 +1,69 @@
 # 使用次数路由
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from services.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.database import get_async_db
 from models.user import User
 from models.usage_log import UsageLog
-from routes.chat import get_user_id_from_token
+from services.auth import get_user_id_from_token
+from services.quota import consume_quota, quota_summary
+from services.quota_cache import quota_cache, QUOTA_CACHE_ENABLED
+from services.metrics import QUOTA_REJECTIONS
 from datetime import date
 
 router = APIRouter()
 
 @router.get("/check")
 async def check_usage(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: str = Depends(get_user_id_from_token)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    if QUOTA_CACHE_ENABLED:
+        summary = await quota_cache.check(user_id)
+        if summary is None:
+            return {"code": 1, "message": "用户不存在"}
+        return {"code": 0, "message": "success", "data": summary}
+
+    user = await db.get(User, user_id)
     if not user:
         return {"code": 1, "message": "用户不存在"}
 
     today = date.today()
-    usage = db.query(UsageLog).filter(
-        UsageLog.user_id == user_id,
-        UsageLog.date == today
-    ).first()
+    result = await db.execute(
+        select(UsageLog).where(UsageLog.user_id == user_id, UsageLog.date == today)
+    )
+    usage = result.scalars().first()
 
     daily_used = usage.count if usage else 0
-    daily_remaining = max(0, user.daily_quota - daily_used)
-    total_remaining = daily_remaining + user.purchased_quota
 
     return {
         "code": 0,
         "message": "success",
-        "data": {
-            "remaining": total_remaining,
-            "total": user.daily_quota + user.purchased_quota,
-            "daily_remaining": daily_remaining,
-            "purchased_remaining": user.purchased_quota
-        }
+        "data": quota_summary(user.daily_quota, daily_used, user.purchased_quota)
     }
 
 @router.post("/increment")
 async def increment_usage(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: str = Depends(get_user_id_from_token)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        return {"code": 1, "message": "用户不存在"}
-
-    today = date.today()
-    usage = db.query(UsageLog).filter(
-        UsageLog.user_id == user_id,
-        UsageLog.date == today
-    ).first()
-
-    daily_used = usage.count if usage else 0
-
-    # 优先扣每日免费次数
-    if daily_used < user.daily_quota:
-        if usage:
-            usage.count += 1
-        else:
-            usage = UsageLog(user_id=user_id, date=today, count=1)
-            db.add(usage)
+    # 优先扣每日免费次数，其次扣购买次数
+    if QUOTA_CACHE_ENABLED:
+        # 内存扣减，增量由后台批量写回
+        consumed = await quota_cache.consume(user_id)
     else:
-        # 扣购买次数
-        if user.purchased_quota > 0:
-            user.purchased_quota -= 1
-        else:
-            return {"code": 1, "message": "次数不足"}
+        # 单次往返原子扣减
+        consumed = await consume_quota(db, user_id)
+    if consumed is None:
+        return {"code": 1, "message": "用户不存在"}
 
-    db.commit()
+    ok, summary = consumed
+    if not ok:
+        QUOTA_REJECTIONS.inc()
+        return {"code": 1, "message": "次数不足", "data": summary}
 
     return {
         "code": 0,
-        "message": "success"
+        "message": "success",
+        "data": summary
     }
@@ -0,0 +1,96 @@
+# JWT 鉴权（带已验证 Token 缓存）
+from fastapi import Header, HTTPException
+from collections import OrderedDict
+import hashlib
+import os
+import time
+import jwt
+
+JWT_SECRET = os.getenv("JWT_SECRET")
+TOKEN_CACHE_MAX_SIZE = int(os.getenv("TOKEN_CACHE_MAX_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+
+class VerifiedTokenCache:
+    """已通过签名校验的 Token 缓存，按 Token 摘要索引，过期时间不晚于 Token 自身的 exp
+
+    未加锁，只在事件循环线程中访问（鉴权依赖为 async def，不会被放进线程池执行）。
+    """
+
+    def __init__(self, max_size=TOKEN_CACHE_MAX_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest):
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        user_id, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[digest]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return user_id
+
+    def put(self, digest, user_id, exp=None):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self._entries[digest] = (user_id, expires_at)
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+        }
+
+
+token_cache = VerifiedTokenCache()
+
+
+def verify_token(token: str) -> str:
+    """校验 Token 并返回用户 ID，已验证过的 Token 直接命中缓存"""
+    digest = hashlib.sha256(token.encode()).digest()
+    user_id = token_cache.get(digest)
+    if user_id is not None:
+        return user_id
+
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token 已过期")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="无效的 Token")
+
+    user_id = payload.get("user_id")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="无效的 Token")
+
+    token_cache.put(digest, user_id, payload.get("exp"))
+    return user_id
+
+
+async def get_user_id_from_token(authorization: str = Header(None)) -> str:
+    """从 JWT token 中获取用户 ID
+
+    不涉及 I/O，声明为 async 使其直接在事件循环中执行，省去线程池切换，也保证 token_cache 单线程访问。
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="未授权")
+
+    return verify_token(authorization[7:])
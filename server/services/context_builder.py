@@ -0,0 +1,335 @@
+# 上下文构建：按 token 预算从最新消息向前填充，超出预算的旧消息压缩为滚动摘要
+from collections import OrderedDict
+from sqlalchemy import select, update, func
+from services.database import AsyncSessionLocal
+from services.metrics import db_route
+from services.history_cache import history_cache, HISTORY_WINDOW
+from services.message_writer import message_writer
+from services.llm_client import OPENAI_MODEL, create_chat_completion
+from services.upstream_scheduler import PRIORITY_BACKGROUND
+from services.json_codec import Fragment
+from models.chat_session import ChatSession
+from models.chat_message import ChatMessage
+import asyncio
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 历史对话（含摘要）的 token 预算；系统提示词与当前用户消息始终发送，不占用该预算
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+# tiktoken 编码名；未安装 tiktoken 或编码文件不可用时按字符估算
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+# token 数缓存的条目数（按文本摘要缓存，不保留原文）
+CONTEXT_TOKEN_CACHE_SIZE = int(os.getenv("CONTEXT_TOKEN_CACHE_SIZE", "8192"))
+
+# 滚动摘要：未摘要且超出预算的旧消息累计达到 SUMMARY_TRIGGER_TOKENS 时后台刷新
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "600"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "40"))
+SUMMARY_CACHE_MAX_SESSIONS = int(os.getenv("SUMMARY_CACHE_MAX_SESSIONS", "10000"))
+
+# 每条消息的格式开销（role 与分隔符）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "请将以下高管教练对话整理为一段摘要，供后续对话参考。"
+    "保留用户的目标、背景、已识别的障碍、关键结论和尚待探讨的问题，不要添加对话中没有的信息。"
+    "如果提供了已有摘要，请将新增对话合并进去，输出完整的新摘要。只输出摘要正文，不超过 {limit} 字。"
+)
+
+_SUMMARY_SYSTEM_MESSAGE = Fragment(role="system", content="你负责压缩对话历史，输出简洁准确的摘要。")
+
+_encoding = None
+_token_cache = OrderedDict()
+
+
+def _load_encoding():
+    import tiktoken
+    return tiktoken.get_encoding(CONTEXT_TOKENIZER)
+
+
+async def load_tokenizer():
+    """启动时在线程中加载编码（首次可能需要下载编码文件，不阻塞事件循环）；失败时继续按字符估算"""
+    global _encoding
+    try:
+        _encoding = await asyncio.to_thread(_load_encoding)
+    except Exception as e:
+        logger.warning(f"[Context] tiktoken 不可用，按字符估算 token 数: {e}")
+
+
+def count_tokens(text):
+    """计算文本 token 数；编码未加载时按字符估算"""
+    if not text:
+        return 0
+    if _encoding is None:
+        # 估算：中文等非 ASCII 字符约 1 token/字，英文约 4 字符/token
+        ascii_chars = len(text.encode("ascii", "ignore"))
+        return len(text) - ascii_chars + (ascii_chars + 3) // 4
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    tokens = _token_cache.get(key)
+    if tokens is not None:
+        _token_cache.move_to_end(key)
+        return tokens
+    tokens = len(_encoding.encode(text, disallowed_special=()))
+    _token_cache[key] = tokens
+    if len(_token_cache) > CONTEXT_TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+    return tokens
+
+
+def count_message_tokens(content):
+    return count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_history(history, budget):
+    """从最新消息向前填充预算，返回保留的条数"""
+    used = 0
+    kept = 0
+    for _, content in reversed(history):
+        tokens = count_message_tokens(content)
+        if used + tokens > budget:
+            break
+        used += tokens
+        kept += 1
+    return kept
+
+
+class Context:
+    __slots__ = ("session_id", "messages", "history", "prompt_tokens", "summarized", "summarize_until")
+
+    def __init__(self, session_id, messages, history, prompt_tokens, summarized, summarize_until):
+        self.session_id = session_id
+        self.messages = messages
+        self.history = history
+        self.prompt_tokens = prompt_tokens
+        self.summarized = summarized
+        self.summarize_until = summarize_until
+
+    def usage(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "history_messages": len(self.history),
+            "summary": self.summarized,
+        }
+
+
+class ContextBuilder:
+    """按 token 预算构建每轮请求的消息列表
+
+    - 历史消息来自 history_cache，摘要状态 (summary, summarized_count) 单独按会话 LRU 缓存
+    - 预算内放不下的旧消息不再发送，由后台任务增量合并进会话摘要
+    - 每个会话同一时间只有一个摘要任务；写库时校验 summarized_count，避免多进程重复合并
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, max_sessions=SUMMARY_CACHE_MAX_SESSIONS):
+        self.budget = budget
+        self.max_sessions = max_sessions
+        self._summaries = OrderedDict()
+        self._tasks = {}
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.summaries = 0
+        self.summary_errors = 0
+
+    def new_session(self, session_id):
+        history_cache.put(session_id, [])
+        self._remember(session_id, (None, 0))
+
+    def append(self, session_id, role, content):
+        history_cache.append(session_id, role, content)
+
+    def discard(self, session_id):
+        """丢弃会话的本地缓存，下次构建时从数据库重新加载"""
+        history_cache.discard(session_id)
+        self._summaries.pop(session_id, None)
+
+    async def _load(self, session_id):
+        history = history_cache.get(session_id)
+        state = self._summaries.get(session_id)
+        if history is not None and state is not None:
+            self._summaries.move_to_end(session_id)
+            return history, history_cache.total(session_id), state
+
+        # 先等待该会话尚在写入队列中的数据落库
+        await message_writer.sync(session_id)
+        async with AsyncSessionLocal() as db:
+            if history is None:
+                result = await db.execute(
+                    select(ChatMessage.role, ChatMessage.content, func.count().over())
+                    .where(ChatMessage.session_id == session_id)
+                    .order_by(ChatMessage.created_at.desc())
+                    .limit(HISTORY_WINDOW)
+                )
+                rows = result.all()
+                # 反转顺序（从旧到新）
+                history = [(role, content) for role, content, _ in reversed(rows)]
+                history_cache.put(session_id, history, rows[0][2] if rows else 0)
+            if state is None:
+                result = await db.execute(
+                    select(ChatSession.summary, ChatSession.summarized_count)
+                    .where(ChatSession.id == session_id)
+                )
+                row = result.first()
+                state = (row.summary, row.summarized_count) if row else (None, 0)
+                self._remember(session_id, state)
+        return history, history_cache.total(session_id), state
+
+    def _remember(self, session_id, state):
+        self._summaries[session_id] = state
+        self._summaries.move_to_end(session_id)
+        while len(self._summaries) > self.max_sessions:
+            self._summaries.popitem(last=False)
+
+    async def build(self, session_id, system_message, user_message):
+        """返回本轮的 Context（消息列表、保留的历史、prompt token 数）
+
+        system_message 为固定的系统消息，通常是预编码的 Fragment，直接放在消息列表开头。
+        """
+        history, total, (summary, summarized_count) = await self._load(session_id)
+
+        # 已合并进摘要的消息不再单独发送
+        window_start = total - len(history)
+        if summarized_count > window_start:
+            history = history[summarized_count - window_start:]
+            window_start = summarized_count
+
+        budget = self.budget
+        if summary:
+            budget -= count_message_tokens(summary)
+        kept = fit_history(history, max(budget, 0))
+        recent = history[len(history) - kept:] if kept else []
+
+        messages = [system_message]
+        if summary:
+            messages.append({"role": "system", "content": f"此前对话摘要：{summary}"})
+        for role, content in recent:
+            messages.append({"role": role, "content": content})
+        messages.append({"role": "user", "content": user_message})
+        prompt_tokens = sum(count_message_tokens(message["content"]) for message in messages)
+
+        # 超出预算且尚未摘要的旧消息：累计足够多时触发摘要刷新
+        summarize_until = 0
+        dropped_until = total - kept
+        if SUMMARY_ENABLED and dropped_until > summarized_count:
+            dropped = history[:len(history) - kept]
+            dropped_tokens = sum(count_message_tokens(content) for _, content in dropped)
+            if window_start > summarized_count or dropped_tokens >= SUMMARY_TRIGGER_TOKENS:
+                summarize_until = dropped_until
+
+        self.turns += 1
+        self.prompt_tokens += prompt_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        return Context(session_id, messages, recent, prompt_tokens, bool(summary), summarize_until)
+
+    def refresh_summary(self, context):
+        """本轮结束后调用，需要时在后台刷新会话摘要"""
+        session_id = context.session_id
+        if not context.summarize_until or session_id in self._tasks:
+            return
+        task = asyncio.create_task(self._refresh(session_id, context.summarize_until))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+
+    async def _refresh(self, session_id, until):
+        db_route.set("context_summary")
+        try:
+            await message_writer.sync(session_id)
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(ChatSession.summary, ChatSession.summarized_count)
+                    .where(ChatSession.id == session_id)
+                )
+                row = result.first()
+                if row is None:
+                    return
+                summary, start = row.summary, row.summarized_count
+                until = min(until, start + SUMMARY_BATCH_MESSAGES)
+                if until <= start:
+                    return
+                result = await db.execute(
+                    select(ChatMessage.role, ChatMessage.content)
+                    .where(ChatMessage.session_id == session_id)
+                    .order_by(ChatMessage.created_at.asc())
+                    .offset(start)
+                    .limit(until - start)
+                )
+                messages = result.all()
+            if not messages:
+                return
+
+            new_summary = await self._summarize(session_id, summary, messages)
+            if not new_summary:
+                return
+            count = start + len(messages)
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    update(ChatSession)
+                    .where(ChatSession.id == session_id, ChatSession.summarized_count == start)
+                    .values(summary=new_summary, summarized_count=count)
+                )
+                await db.commit()
+            if result.rowcount:
+                self.summaries += 1
+                self._remember(session_id, (new_summary, count))
+            else:
+                # 其他进程已更新摘要，下次访问时重新加载
+                self._summaries.pop(session_id, None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.summary_errors += 1
+            logger.warning(f"[Context] 会话 {session_id} 摘要刷新失败: {e}")
+
+    async def _summarize(self, session_id, summary, messages):
+        lines = []
+        for role, content in messages:
+            role_label = "用户" if role == "user" else "AI"
+            lines.append(f"{role_label}: {content}")
+        parts = [SUMMARY_PROMPT.format(limit=SUMMARY_MAX_TOKENS)]
+        if summary:
+            parts.append(f"已有摘要：\n{summary}")
+        parts.append("新增对话：\n" + "\n".join(lines))
+
+        result = await create_chat_completion({
+            "model": OPENAI_MODEL,
+            "messages": [
+                _SUMMARY_SYSTEM_MESSAGE,
+                {"role": "user", "content": "\n\n".join(parts)}
+            ],
+            "max_tokens": SUMMARY_MAX_TOKENS,
+            "stream": False
+        }, user_key=f"summary:{session_id}", priority=PRIORITY_BACKGROUND)
+        content = (
+            result.get("choices", [{}])[0]
+            .get("message", {})
+            .get("content", "")
+        )
+        return content.strip()
+
+    async def stop(self):
+        """取消进行中的摘要任务（摘要可在下次对话时重新生成）"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "token_budget": self.budget,
+            "tokenizer": CONTEXT_TOKENIZER if _encoding is not None else "estimate",
+            "token_cache": len(_token_cache),
+            "turns": self.turns,
+            "avg_prompt_tokens": self.prompt_tokens / self.turns if self.turns else 0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "summary_sessions": len(self._summaries),
+            "summaries_running": len(self._tasks),
+            "summaries": self.summaries,
+            "summary_errors": self.summary_errors,
+        }
+
+
+context_builder = ContextBuilder()
@@ -0,0 +1,550 @@
+# 多 worker 协调：流归属、跨 worker 转发流式帧、共享计数
+#
+# COORDINATION_BACKEND=memory（默认，单进程）或 redis（多 worker / 多机部署，需要 redis 包与 REDIS_URL）
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from services.json_codec import dumps_text, loads
+
+logger = logging.getLogger(__name__)
+
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+COORDINATION_PREFIX = os.getenv("COORDINATION_PREFIX", "aicoach:")
+# 流归属租约时长（秒），持有方每 1/3 租期续约一次；worker 异常退出后租约自动过期
+STREAM_OWNER_TTL = float(os.getenv("STREAM_OWNER_TTL", "30"))
+# 用户余额版本号的保留时长（秒）
+USER_VERSION_TTL = 30 * 86400
+# 转发流式帧给其他 worker 上重连的客户端
+COORDINATION_RELAY = os.getenv("COORDINATION_RELAY", "true").lower() == "true"
+# 后台发布队列的帧数上限，满时丢帧并在下一帧写入完整快照（发布慢或失败都不阻塞输出）
+COORDINATION_PUBLISH_QUEUE = int(os.getenv("COORDINATION_PUBLISH_QUEUE", "1000"))
+# 每轮输出的共享快照（本轮标识、已输出内容、seq、结束帧）在最后一次写入后的保留时长（秒）
+STREAM_SNAPSHOT_TTL = float(os.getenv("STREAM_SNAPSHOT_TTL", "600"))
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end
+return 0
+"""
+_INCR_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then redis.call('set', KEYS[1], ARGV[2]) end
+local value = redis.call('incrby', KEYS[1], ARGV[1])
+if tonumber(ARGV[3]) > 0 then redis.call('pexpire', KEYS[1], ARGV[3]) end
+return value
+"""
+# KEYS: owner, turn, content, seq, end；ARGV: worker_id, owner_ttl_ms, turn, turn_ttl_ms
+_CLAIM_SCRIPT = """
+if not redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then return 0 end
+redis.call('del', KEYS[3], KEYS[4], KEYS[5])
+redis.call('set', KEYS[2], ARGV[3], 'PX', ARGV[4])
+return 1
+"""
+# KEYS: turn, content, seq, end；ARGV: turn, seq, content, message, ended, reset, ttl_ms, channel
+# 不属于当前一轮的帧（上一轮延迟发布的帧）直接丢弃
+_APPEND_STREAM_SCRIPT = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then return 0 end
+if ARGV[6] == '1' then redis.call('del', KEYS[2], KEYS[4]) end
+if ARGV[3] ~= '' then redis.call('append', KEYS[2], ARGV[3]) end
+if ARGV[5] == '1' then
+  redis.call('set', KEYS[4], ARGV[4], 'px', ARGV[7])
+elseif redis.call('exists', KEYS[4]) == 0 then
+  redis.call('set', KEYS[3], ARGV[2], 'px', ARGV[7])
+end
+redis.call('pexpire', KEYS[1], ARGV[7])
+redis.call('pexpire', KEYS[2], ARGV[7])
+return redis.call('publish', ARGV[8], ARGV[4])
+"""
+
+
+class MemoryBackend:
+    """进程内实现；测试时多个 Coordinator 共用同一实例（shared=True）可模拟多 worker"""
+
+    def __init__(self, shared=False):
+        self.shared = shared
+        self._values = {}
+        self._expires = {}
+        self._channels = {}
+
+    def _alive(self, key):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and time.monotonic() >= expires_at:
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._values
+
+    def _expire(self, key, ttl):
+        if ttl:
+            self._expires[key] = time.monotonic() + ttl
+        else:
+            self._expires.pop(key, None)
+
+    async def get(self, key):
+        return self._values.get(key) if self._alive(key) else None
+
+    async def get_many(self, keys):
+        return [await self.get(key) for key in keys]
+
+    async def set_if_absent(self, key, value, ttl=None):
+        if self._alive(key):
+            return False
+        self._values[key] = value
+        self._expire(key, ttl)
+        return True
+
+    async def delete_if_equal(self, key, value):
+        if self._alive(key) and self._values[key] == value:
+            del self._values[key]
+            self._expires.pop(key, None)
+            return True
+        return False
+
+    async def expire_if_equal(self, key, value, ttl):
+        if self._alive(key) and self._values[key] == value:
+            self._expire(key, ttl)
+            return True
+        return False
+
+    async def incr(self, key, amount=1, ttl=None, initial=0):
+        value = (self._values[key] if self._alive(key) else initial) + amount
+        self._values[key] = value
+        if ttl:
+            self._expire(key, ttl)
+        return value
+
+    async def publish(self, channel, message):
+        for queue in self._channels.get(channel, ()):
+            queue.put_nowait(message)
+
+    async def claim_turn(self, keys, value, ttl, turn, turn_ttl):
+        owner_key, turn_key, *snapshot_keys = keys
+        if not await self.set_if_absent(owner_key, value, ttl):
+            return False
+        for key in snapshot_keys:
+            self._values.pop(key, None)
+            self._expires.pop(key, None)
+        self._values[turn_key] = turn
+        self._expire(turn_key, turn_ttl)
+        return True
+
+    async def append_stream(self, keys, channel, turn, seq, content, message, ended, reset, ttl):
+        turn_key, content_key, seq_key, end_key = keys
+        if await self.get(turn_key) != turn:
+            return
+        if reset:
+            for key in (content_key, end_key):
+                self._values.pop(key, None)
+                self._expires.pop(key, None)
+        if content:
+            self._values[content_key] = (self._values[content_key] if self._alive(content_key) else "") + content
+        if ended:
+            self._values[end_key] = message
+            self._expire(end_key, ttl)
+        elif not self._alive(end_key):
+            self._values[seq_key] = seq
+            self._expire(seq_key, ttl)
+        self._expire(turn_key, ttl)
+        if content_key in self._values:
+            self._expire(content_key, ttl)
+        await self.publish(channel, message)
+
+    async def subscribe(self, channel):
+        queue = asyncio.Queue()
+        self._channels.setdefault(channel, set()).add(queue)
+
+        def close():
+            subscribers = self._channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._channels[channel]
+
+        return Subscription(queue.get, close)
+
+    async def close(self):
+        self._channels.clear()
+
+
+class RedisBackend:
+    """基于 Redis 的共享实现（SET NX 租约、Lua 原子操作、PUBLISH/SUBSCRIBE）"""
+
+    shared = True
+
+    def __init__(self, url=REDIS_URL):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("COORDINATION_BACKEND=redis 需要安装 redis 包（pip install redis）")
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+        self._renew = self._redis.register_script(_RENEW_SCRIPT)
+        self._incr = self._redis.register_script(_INCR_SCRIPT)
+        self._claim = self._redis.register_script(_CLAIM_SCRIPT)
+        self._append_stream = self._redis.register_script(_APPEND_STREAM_SCRIPT)
+
+    async def get(self, key):
+        return await self._redis.get(key)
+
+    async def get_many(self, keys):
+        return await self._redis.mget(keys)
+
+    async def set_if_absent(self, key, value, ttl=None):
+        return bool(await self._redis.set(key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    async def delete_if_equal(self, key, value):
+        return bool(await self._release(keys=[key], args=[value]))
+
+    async def expire_if_equal(self, key, value, ttl):
+        return bool(await self._renew(keys=[key], args=[value, int(ttl * 1000)]))
+
+    async def incr(self, key, amount=1, ttl=None, initial=0):
+        return int(await self._incr(keys=[key], args=[amount, initial, int(ttl * 1000) if ttl else 0]))
+
+    async def publish(self, channel, message):
+        await self._redis.publish(channel, message)
+
+    async def claim_turn(self, keys, value, ttl, turn, turn_ttl):
+        return bool(await self._claim(keys=list(keys), args=[value, int(ttl * 1000), turn, int(turn_ttl * 1000)]))
+
+    async def append_stream(self, keys, channel, turn, seq, content, message, ended, reset, ttl):
+        """一次原子操作中更新快照并发布，订阅方读到的快照与收到的帧序号一致"""
+        await self._append_stream(keys=list(keys), args=[
+            turn, seq, content, message, int(ended), int(reset), int(ttl * 1000), channel
+        ])
+
+    async def subscribe(self, channel):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(channel)
+
+        async def receive():
+            while True:
+                message = await pubsub.get_message(timeout=None)
+                if message is not None:
+                    return message["data"]
+
+        async def close():
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+
+        return Subscription(receive, close)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class Subscription:
+    """订阅句柄：await receive(timeout) 取下一条消息，超时返回 None"""
+
+    def __init__(self, receive, close):
+        self._receive = receive
+        self._close = close
+
+    async def receive(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._receive(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        result = self._close()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+class StreamLease:
+    """一轮流式输出期间持有会话的流归属，后台定期续约"""
+
+    def __init__(self, coordinator, session_id):
+        self.coordinator = coordinator
+        self.session_id = session_id
+        # 本轮的标识：共享快照只接受本轮的帧
+        self.turn = uuid.uuid4().hex
+        self._renew_task = None
+
+    async def acquire(self):
+        acquired = await self.coordinator.claim_stream(self.session_id, self.turn)
+        if acquired:
+            self._renew_task = asyncio.create_task(self._renew())
+        return acquired
+
+    async def _renew(self):
+        interval = STREAM_OWNER_TTL / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.coordinator.renew_stream(self.session_id)
+            except Exception as e:
+                logger.warning(f"[Coordination] 续约失败 {self.session_id}: {e}")
+
+    async def release(self):
+        if self._renew_task is not None:
+            self._renew_task.cancel()
+            self._renew_task = None
+            await self.coordinator.release_stream(self.session_id)
+
+
+class Coordinator:
+    """当前 worker 的协调入口
+
+    - 流归属：stream:{session_id}:owner = worker_id（带租期）
+    - 帧转发：每轮的帧经后台队列发布到 stream:{session_id}:frames，同时更新共享快照
+      （stream:{session_id}:content / seq / end，只接受当前一轮 stream:{session_id}:turn 的帧）；
+      重连到其他 worker 的客户端先补发快照再订阅转发
+    - 会话版本：每轮结束递增，其他 worker 据此判断本地缓存是否过期
+    - 用户余额版本：管理员直接修改余额后递增，各 worker 据此丢弃缓存的次数状态
+    - 共享计数：次数扣减与频率限制
+    """
+
+    def __init__(self, backend, worker_id=None, max_sessions=100000):
+        self.backend = backend
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.max_sessions = max_sessions
+        self._session_versions = OrderedDict()
+        self._outbox = None
+        self._publisher = None
+        self._resync_streams = set()
+        self.published = 0
+        self.dropped_frames = 0
+        self.publish_errors = 0
+        self.relayed = 0
+        self.resyncs = 0
+        self.rejected_streams = 0
+
+    @property
+    def shared(self):
+        return self.backend.shared
+
+    def _key(self, *parts):
+        return COORDINATION_PREFIX + ":".join(str(part) for part in parts)
+
+    # 流归属
+    def stream_lease(self, session_id):
+        return StreamLease(self, session_id)
+
+    async def claim_stream(self, session_id, turn=None):
+        """获取流归属，同时开始新一轮的共享快照"""
+        claimed = await self.backend.claim_turn(
+            (self._key("stream", session_id, "owner"),) + self._stream_keys(session_id),
+            self.worker_id, STREAM_OWNER_TTL, turn or uuid.uuid4().hex, STREAM_SNAPSHOT_TTL
+        )
+        if not claimed:
+            self.rejected_streams += 1
+        return claimed
+
+    async def renew_stream(self, session_id):
+        return await self.backend.expire_if_equal(
+            self._key("stream", session_id, "owner"), self.worker_id, STREAM_OWNER_TTL
+        )
+
+    async def release_stream(self, session_id):
+        return await self.backend.delete_if_equal(self._key("stream", session_id, "owner"), self.worker_id)
+
+    async def stream_owner(self, session_id):
+        return await self.backend.get(self._key("stream", session_id, "owner"))
+
+    # 帧转发
+    def _stream_keys(self, session_id):
+        return tuple(self._key("stream", session_id, name) for name in ("turn", "content", "seq", "end"))
+
+    def publish_frame(self, session_id, turn, seq, frame, content="", ended=False, snapshot=None):
+        """把本轮的一帧放入后台发布队列，不等待发布完成，也不抛出异常
+
+        turn 为获取流归属时的本轮标识；frame 可以是 dict 或已编码的 JSON 文本；
+        content 为该帧追加到回复的文本（chunk 帧），ended 表示本轮结束帧。
+        队列满时丢弃该帧，该会话下一帧改为写入 snapshot() 返回的完整内容。
+        """
+        if not self.shared:
+            return
+        if self._publisher is None or self._publisher.get_loop() is not asyncio.get_running_loop():
+            self._outbox = asyncio.Queue(maxsize=COORDINATION_PUBLISH_QUEUE)
+            self._publisher = asyncio.create_task(self._publish_loop())
+        reset = False
+        if session_id in self._resync_streams and snapshot is not None:
+            content, reset = snapshot(), True
+        text = frame if isinstance(frame, str) else dumps_text(frame)
+        try:
+            self._outbox.put_nowait((session_id, turn, seq, text, content, ended, reset))
+        except asyncio.QueueFull:
+            self.dropped_frames += 1
+            if self.dropped_frames % 100 == 1:
+                logger.warning(f"[Coordination] 帧发布队列已满，已丢弃 {self.dropped_frames} 帧")
+            if not ended:
+                self._resync_streams.add(session_id)
+            return
+        if reset or ended:
+            self._resync_streams.discard(session_id)
+
+    async def _publish_loop(self):
+        # 发布失败的会话跳过队列中已排队的增量帧，等待下一个完整快照
+        broken = set()
+        while True:
+            session_id, turn, seq, text, content, ended, reset = await self._outbox.get()
+            try:
+                if reset:
+                    broken.discard(session_id)
+                elif session_id in broken:
+                    self.dropped_frames += 1
+                    continue
+                await self.backend.append_stream(
+                    self._stream_keys(session_id), self._key("stream", session_id, "frames"),
+                    turn, seq, content, text, ended, reset, STREAM_SNAPSHOT_TTL
+                )
+                self.published += 1
+            except Exception as e:
+                self.publish_errors += 1
+                if self.publish_errors % 100 == 1:
+                    logger.warning(f"[Coordination] 帧发布失败（累计 {self.publish_errors} 次）: {e}")
+                if not ended:
+                    broken.add(session_id)
+                    self._resync_streams.add(session_id)
+            finally:
+                if ended:
+                    broken.discard(session_id)
+                self._outbox.task_done()
+
+    async def _send_snapshot(self, session_id, send_json, last_seq):
+        """补发共享快照中 last_seq 之后的内容；返回 (客户端已收到的 seq, 本轮是否已结束)"""
+        turn, content, seq, end = await self.backend.get_many(self._stream_keys(session_id))
+        seq = int(seq or 0)
+        if seq > last_seq:
+            await send_json({"type": "snapshot", "content": content or "", "seq": seq, "turn": turn})
+            last_seq = seq
+        if end is None:
+            return last_seq, False
+        frame = loads(end)
+        if frame.get("seq", 0) > last_seq:
+            await send_json(frame)
+            self.relayed += 1
+        return last_seq, True
+
+    async def relay_frames(self, session_id, send_json, last_seq=0, idle_timeout=5.0):
+        """把其他连接（可能在其他 worker 上）正在输出的帧转发给当前客户端
+
+        先订阅再读取共享快照：客户端缺失的已输出内容（seq 大于 last_seq）以 snapshot 帧补发，
+        之后只转发更新的帧；序号不连续（发布方丢帧）时重新读取快照。
+        收到 done（或最终错误）或流归属消失时结束；返回是否转发到了本轮结尾
+        """
+        subscription = await self.backend.subscribe(self._key("stream", session_id, "frames"))
+        try:
+            last_seq, ended = await self._send_snapshot(session_id, send_json, last_seq)
+            if ended:
+                return True
+            while True:
+                message = await subscription.receive(idle_timeout)
+                if message is None:
+                    # 长时间无数据：确认流是否仍在进行
+                    if await self.stream_owner(session_id) is None:
+                        return False
+                    continue
+                frame = loads(message)
+                seq = frame.get("seq", 0)
+                if seq <= last_seq:
+                    continue
+                if seq > last_seq + 1:
+                    self.resyncs += 1
+                    last_seq, ended = await self._send_snapshot(session_id, send_json, last_seq)
+                    if ended:
+                        return True
+                    if seq <= last_seq:
+                        continue
+                await send_json(frame)
+                self.relayed += 1
+                last_seq = seq
+                if frame.get("type") == "done" or frame.get("final"):
+                    return True
+        finally:
+            await subscription.close()
+
+    # 会话版本
+    async def session_stale(self, session_id):
+        """其他 worker 处理过该会话的新一轮对话后返回 True（本地缓存需要重新加载）"""
+        if not self.shared:
+            return False
+        current = await self.backend.get(self._key("session", session_id, "version"))
+        if current is None or str(current) == str(self._session_versions.get(session_id)):
+            return False
+        self._remember_version(session_id, current)
+        return True
+
+    async def bump_session(self, session_id):
+        if not self.shared:
+            return
+        version = await self.backend.incr(self._key("session", session_id, "version"), ttl=86400)
+        self._remember_version(session_id, version)
+
+    def _remember_version(self, session_id, version):
+        self._session_versions[session_id] = version
+        self._session_versions.move_to_end(session_id)
+        while len(self._session_versions) > self.max_sessions:
+            self._session_versions.popitem(last=False)
+
+    # 用户余额版本
+    async def user_version(self, user_id):
+        """非共享模式返回 None（本进程的缓存由调用方直接失效）"""
+        if not self.shared:
+            return None
+        return await self.backend.get(self._key("user", user_id, "version"))
+
+    async def bump_user(self, user_id):
+        if not self.shared:
+            return
+        # 以当前毫秒时间为初值：键过期后重新计数也不会与旧版本号重复
+        await self.backend.incr(
+            self._key("user", user_id, "version"), ttl=USER_VERSION_TTL, initial=int(time.time() * 1000)
+        )
+
+    # 共享计数
+    async def incr(self, name, amount=1, ttl=None, initial=0):
+        return await self.backend.incr(self._key("counter", name), amount, ttl, initial)
+
+    async def get_counter(self, name):
+        value = await self.backend.get(self._key("counter", name))
+        return int(value) if value is not None else None
+
+    async def hit(self, name, limit, window):
+        """固定窗口频率限制：窗口内第 limit 次之后返回 False"""
+        bucket = int(time.time() // window)
+        count = await self.incr(f"rate:{name}:{bucket}", ttl=window * 2)
+        return count <= limit
+
+    async def close(self):
+        if self._publisher is not None and self._publisher.get_loop() is asyncio.get_running_loop():
+            # 尽量发出队列中剩余的帧
+            try:
+                await asyncio.wait_for(self._outbox.join(), 1)
+            except asyncio.TimeoutError:
+                pass
+            self._publisher.cancel()
+        await self.backend.close()
+
+    def stats(self):
+        return {
+            "backend": type(self.backend).__name__,
+            "worker_id": self.worker_id,
+            "shared": self.shared,
+            "published_frames": self.published,
+            "dropped_frames": self.dropped_frames,
+            "publish_errors": self.publish_errors,
+            "publish_queue": self._outbox.qsize() if self._outbox is not None else 0,
+            "relayed_frames": self.relayed,
+            "relay_resyncs": self.resyncs,
+            "rejected_streams": self.rejected_streams,
+        }
+
+
+def create_backend(name=COORDINATION_BACKEND):
+    if name == "redis":
+        return RedisBackend()
+    if name == "memory":
+        return MemoryBackend()
+    raise ValueError(f"未知的 COORDINATION_BACKEND: {name}")
+
+
+coordinator = Coordinator(create_backend())
@@ -1,21 +1,146 @@
 # 数据库连接
-from sqlalchemy import create_engine
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from services import metrics
+from uuid import uuid4
+import asyncio
+import logging
 import os
+import time
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 连接池：常驻 SIZE 个连接，高峰时最多再临时创建 MAX_OVERFLOW 个；取连接最多等待 TIMEOUT 秒
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# 连接使用超过该时长（秒）后重建，避免被数据库 / 中间网络设备静默断开
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 取出连接时先做存活检查，失效连接自动替换
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# 启动时预先建立的连接数，0 表示不预热
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", str(DB_POOL_SIZE)))
+# 经 PgBouncer（transaction 模式）连接：由 PgBouncer 负责池化，应用侧不保留连接，并关闭预编译语句缓存
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+
+
+def _to_async_url(url: str) -> str:
+    """将同步连接串转换为 asyncpg 连接串"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _to_async_url(DATABASE_URL)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """记录取连接耗时与超时次数的连接池"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            metrics.DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+def _pool_options():
+    if DB_PGBOUNCER:
+        return {"poolclass": NullPool}
+    return {
+        "poolclass": InstrumentedPool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _async_connect_args():
+    if not DB_PGBOUNCER:
+        return {}
+    # PgBouncer transaction 模式下同一会话的语句可能落在不同后端连接上，预编译语句不能缓存或复用名称
+    return {
+        "statement_cache_size": 0,
+        "prepared_statement_cache_size": 0,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+    }
+
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+# 异步引擎：所有数据库访问统一使用，每个 worker 只有这一个连接池
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    connect_args=_async_connect_args(),
+    **_pool_options()
+)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
+
+async def warm_pool(count=DB_POOL_WARM):
+    """启动时并发建立连接并放回池中，避免首批请求承担建连耗时；失败只记录日志"""
+    if DB_PGBOUNCER or count <= 0:
+        return 0
+    count = min(count, DB_POOL_SIZE)
+
+    async def _open():
+        conn = await async_engine.connect().start()
+        await conn.execute(text("SELECT 1"))
+        return conn
+
+    # 全部建立后再统一归还，否则先归还的连接会被后面的任务复用
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(asyncio.wait_for(_open(), DB_POOL_TIMEOUT) for _ in range(count)), return_exceptions=True
+    )
+    opened = [conn for conn in results if not isinstance(conn, BaseException)]
+    for conn in opened:
+        await conn.close()
+    if len(opened) < count:
+        error = next(result for result in results if isinstance(result, BaseException))
+        logger.warning(f"[Database] 连接池预热 {len(opened)}/{count} 个连接，失败: {error!r}")
+    else:
+        logger.info(f"[Database] 连接池预热 {count} 个连接，耗时 {(time.perf_counter() - start) * 1000:.0f}ms")
+    return len(opened)
+
+
+def pool_stats():
+    pool = async_engine.pool
+    if DB_PGBOUNCER:
+        return {"mode": "pgbouncer", "pool": pool.status()}
+    checked_out = pool.checkedout()
+    capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    return {
+        "mode": "pool",
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": max(pool.overflow(), 0),
+        "utilization": round(checked_out / capacity, 3) if capacity else 0,
+        "pre_ping": DB_POOL_PRE_PING,
+        "recycle_seconds": DB_POOL_RECYCLE,
+    }
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,112 @@
+# 流式输出合帧：将多个增量合并为一个 WebSocket chunk 帧
+import asyncio
+import os
+import time
+
+# 合帧时间窗口（毫秒）与单帧内容上限（字节）
+WS_COALESCE_WINDOW_MS = float(os.getenv("WS_COALESCE_WINDOW_MS", "30"))
+WS_COALESCE_MAX_BYTES = int(os.getenv("WS_COALESCE_MAX_BYTES", "1024"))
+
+# 全局统计
+_stats = {
+    "streams": 0,
+    "deltas": 0,
+    "frames": 0,
+    "bytes": 0,
+    "stream_seconds": 0.0,
+}
+
+
+class FrameCoalescer:
+    """按时间窗口和大小合并增量
+
+    - 首个增量立即发送，保证首字延迟不变
+    - 之后的增量累积到时间窗口结束或达到 max_bytes 时发送
+    - close() 发送剩余内容
+    帧格式与原来一致：{"type": "chunk", "content": ...}
+    """
+
+    def __init__(self, send_json, window_ms=WS_COALESCE_WINDOW_MS, max_bytes=WS_COALESCE_MAX_BYTES):
+        self._send_json = send_json
+        self._window = window_ms / 1000
+        self._max_bytes = max_bytes
+        self._parts = []
+        self._pending_bytes = 0
+        self._send_lock = asyncio.Lock()
+        self._timer = None
+        # 定时器触发的后台发送任务，close() 时等待完成
+        self._flush_task = None
+        self._error = None
+        self._started = time.perf_counter()
+        self.deltas = 0
+        self.frames = 0
+        self.bytes = 0
+
+    async def add(self, delta):
+        if self._error is not None:
+            raise self._error
+        self.deltas += 1
+        self._parts.append(delta)
+        self._pending_bytes += len(delta.encode("utf-8"))
+
+        if self.deltas == 1 or self._window <= 0 or self._pending_bytes >= self._max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._window, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._flush_task = asyncio.create_task(self._flush_in_background())
+
+    async def _flush_in_background(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            # 发送失败留到下一次 add / close 时抛出
+            self._error = e
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._parts:
+            return
+        content = self._parts[0] if len(self._parts) == 1 else "".join(self._parts)
+        size = self._pending_bytes
+        self._parts = []
+        self._pending_bytes = 0
+
+        # 加锁保证帧按顺序发出
+        async with self._send_lock:
+            await self._send_json({"type": "chunk", "content": content})
+        self.frames += 1
+        self.bytes += size
+
+    async def close(self):
+        """发送剩余内容并记录统计"""
+        try:
+            # flush 会取消未触发的定时器；再等待已触发的后台发送完成，close() 返回后不会再有帧发出
+            await self.flush()
+            if self._flush_task is not None:
+                await self._flush_task
+        finally:
+            _stats["streams"] += 1
+            _stats["deltas"] += self.deltas
+            _stats["frames"] += self.frames
+            _stats["bytes"] += self.bytes
+            _stats["stream_seconds"] += time.perf_counter() - self._started
+        if self._error is not None:
+            raise self._error
+
+
+def get_coalescer_stats():
+    frames = _stats["frames"]
+    seconds = _stats["stream_seconds"]
+    return {
+        **_stats,
+        "window_ms": WS_COALESCE_WINDOW_MS,
+        "max_bytes": WS_COALESCE_MAX_BYTES,
+        "frames_per_second": frames / seconds if seconds else 0,
+        "bytes_per_frame": _stats["bytes"] / frames if frames else 0,
+        "deltas_per_frame": _stats["deltas"] / frames if frames else 0,
+    }
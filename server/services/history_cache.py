@@ -0,0 +1,94 @@
+# 会话历史缓存（按会话 LRU 淘汰，写穿透）
+from collections import OrderedDict, deque
+import os
+import sys
+
+# 每个会话缓存的最近消息条数（上下文构建的候选范围，实际发送量由 token 预算决定）
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "40"))
+HISTORY_CACHE_MAX_SESSIONS = int(os.getenv("HISTORY_CACHE_MAX_SESSIONS", "10000"))
+
+
+class HistoryCache:
+    """缓存每个会话最近 window 条 (role, content) 消息及会话消息总数"""
+
+    def __init__(self, max_sessions=HISTORY_CACHE_MAX_SESSIONS, window=HISTORY_WINDOW):
+        self.max_sessions = max_sessions
+        self.window = window
+        self._entries = OrderedDict()
+        self._totals = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, session_id):
+        """命中返回消息列表（从旧到新），未命中返回 None"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return list(entry)
+
+    def put(self, session_id, messages, total=None):
+        """用数据库查询结果（从旧到新）填充缓存，total 为会话消息总数"""
+        self.discard(session_id)
+        entry = deque(maxlen=self.window)
+        self._entries[session_id] = entry
+        self._totals[session_id] = len(messages) if total is None else total
+        for role, content in messages:
+            self._push(entry, role, content)
+        self._evict()
+
+    def append(self, session_id, role, content):
+        """消息落库后写穿透；未缓存的会话不处理，下次读取时从数据库加载"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        self._entries.move_to_end(session_id)
+        self._push(entry, role, content)
+        self._totals[session_id] += 1
+
+    def total(self, session_id):
+        """会话消息总数（含已滑出窗口的消息），未缓存返回 None"""
+        return self._totals.get(session_id)
+
+    def discard(self, session_id):
+        self._totals.pop(session_id, None)
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= sum(_size(item) for item in entry)
+
+    def _push(self, entry, role, content):
+        item = (role, content)
+        if len(entry) == entry.maxlen:
+            self._bytes -= _size(entry[0])
+        entry.append(item)
+        self._bytes += _size(item)
+
+    def _evict(self):
+        while len(self._entries) > self.max_sessions:
+            session_id, entry = self._entries.popitem(last=False)
+            self._totals.pop(session_id, None)
+            self._bytes -= sum(_size(item) for item in entry)
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "messages": sum(len(entry) for entry in self._entries.values()),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0,
+        }
+
+
+def _size(item):
+    return sys.getsizeof(item[1])
+
+
+history_cache = HistoryCache()
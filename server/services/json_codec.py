@@ -0,0 +1,91 @@
+# JSON 编解码：REST 响应、WebSocket 帧、上游请求体与 SSE 解析共用
+#
+# JSON_CODEC=orjson（默认，未安装时自动回退）或 stdlib
+import json
+import logging
+import os
+
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+JSON_CODEC = os.getenv("JSON_CODEC", "orjson").lower()
+
+_orjson = None
+if JSON_CODEC == "orjson":
+    try:
+        import orjson as _orjson
+    except ImportError:
+        logger.warning("未安装 orjson，JSON 编解码回退到标准库")
+
+if _orjson is not None:
+    CODEC = "orjson"
+    _ORJSON_OPTIONS = _orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        """编码为 UTF-8 bytes（紧凑格式，非 ASCII 字符不转义）"""
+        return _orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def dumps_text(obj):
+        return _orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode()
+
+    loads = _orjson.loads
+else:
+    CODEC = "stdlib"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=lambda obj: _default(obj))
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+
+    def dumps_text(obj):
+        return _encoder.encode(obj)
+
+    loads = json.loads
+
+
+def _default(obj):
+    # 路由直接返回的少数非原生类型（datetime / UUID 等）交给 FastAPI 的编码器处理
+    from fastapi.encoders import jsonable_encoder
+    return jsonable_encoder(obj)
+
+
+class Fragment(dict):
+    """预先编码的 JSON 对象（如固定的系统提示词消息），编码请求体时直接拼接缓存的字节
+
+    按普通 dict 读取；创建后不应再修改。
+    """
+
+    __slots__ = ("encoded",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoded = dumps(dict(self))
+
+
+def encode_chat_request(payload):
+    """编码 chat/completions 请求体；messages 中的 Fragment 使用预编码的字节"""
+    messages = payload.get("messages")
+    if not messages or not any(isinstance(message, Fragment) for message in messages):
+        return dumps(payload)
+    head = dumps({key: value for key, value in payload.items() if key != "messages"})
+    body = b",".join(
+        message.encoded if isinstance(message, Fragment) else dumps(message) for message in messages
+    )
+    separator = b"," if len(head) > 2 else b""
+    return head[:-1] + separator + b'"messages":[' + body + b"]}"
+
+
+class FastJSONResponse(JSONResponse):
+    """默认响应类：使用上面的编码器输出响应体
+
+    路由直接返回 FastJSONResponse(...) 时还可跳过 FastAPI 对返回值的 jsonable_encoder 遍历，
+    适合条目较多的列表接口。
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+async def send_frame(websocket, frame):
+    """以文本帧发送 JSON（小程序端按字符串解析，不使用二进制帧）"""
+    await websocket.send_text(dumps_text(frame))
@@ -0,0 +1,253 @@
+# 上游 LLM HTTP 客户端（进程级共享连接池）
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import logging
+import time
+import httpx
+from services.upstream_scheduler import upstream_scheduler, PRIORITY_STREAM, PRIORITY_OPTIONS
+from services.upstream_pool import upstream_pool, LLM_HEDGE_ENABLED
+from services.json_codec import encode_chat_request
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+# 请求中的默认模型名；配置了 OPENAI_ENDPOINTS 时由各端点的 model 替换
+OPENAI_MODEL = os.getenv("OPENAI_MODEL") or upstream_pool.default_model
+
+# 连接池配置
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() == "true"
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_POOL_TIMEOUT = float(os.getenv("LLM_POOL_TIMEOUT", "10"))
+
+_client = None
+
+# 连接池使用统计
+_stats = {
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "requests_total": 0,
+    "saturated_total": 0,
+    "pool_timeouts_total": 0,
+}
+
+
+def init_llm_client():
+    """创建共享客户端（在应用启动时调用）"""
+    global _client
+    if _client is not None:
+        return _client
+
+    http2 = LLM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("未安装 h2，LLM 客户端回退到 HTTP/1.1")
+            http2 = False
+
+    # 各端点的地址与密钥随请求传入，同一客户端按 origin 分别维护连接池
+    _client = httpx.AsyncClient(
+        headers={"Content-Type": "application/json"},
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(
+            LLM_READ_TIMEOUT,
+            connect=LLM_CONNECT_TIMEOUT,
+            pool=LLM_POOL_TIMEOUT
+        )
+    )
+    return _client
+
+
+async def close_llm_client():
+    """关闭共享客户端（在应用关闭时调用）"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_llm_client():
+    """获取共享客户端，未初始化时惰性创建"""
+    return _client or init_llm_client()
+
+
+@asynccontextmanager
+async def _track_request():
+    _stats["requests_total"] += 1
+    _stats["in_flight"] += 1
+    if _stats["in_flight"] > _stats["peak_in_flight"]:
+        _stats["peak_in_flight"] = _stats["in_flight"]
+    if _stats["in_flight"] > LLM_MAX_CONNECTIONS:
+        # 并发请求数超过连接上限，需要排队等待空闲连接
+        _stats["saturated_total"] += 1
+    try:
+        yield
+    except httpx.PoolTimeout:
+        _stats["pool_timeouts_total"] += 1
+        raise
+    finally:
+        _stats["in_flight"] -= 1
+
+
+class StreamResponse:
+    """上游流式响应：首个数据块已读出（用于计算首 token 耗时与对冲胜负），其余按原样迭代"""
+
+    def __init__(self, endpoint, response, iterator, first_chunk):
+        self.endpoint = endpoint
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._iterator = iterator
+        self._first_chunk = first_chunk
+
+    async def aiter_bytes(self):
+        try:
+            if self._first_chunk:
+                yield self._first_chunk
+            async for chunk in self._iterator:
+                yield chunk
+        except httpx.HTTPError as e:
+            # 输出中途断开同样计为端点失败（该请求已在收到首个数据块时计入）
+            self.endpoint.record_failure(e, counted=True)
+            raise
+
+    async def aclose(self):
+        await self.response.aclose()
+
+
+async def _open_stream(endpoint, payload, ticket):
+    """向指定端点发起流式请求，读到首个数据块后返回 StreamResponse"""
+    client = get_llm_client()
+    started = time.monotonic()
+    request = client.build_request(
+        "POST", endpoint.url, content=encode_chat_request(endpoint.prepare(payload)), headers=endpoint.headers
+    )
+    response = None
+    try:
+        response = await client.send(request, stream=True)
+        ticket.response(response, started)
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        iterator = response.aiter_bytes()
+        first_chunk = await anext(iterator, b"")
+    except asyncio.CancelledError:
+        # 对冲落败被取消：没有测到首 token 耗时，不记录样本
+        if response is not None:
+            await response.aclose()
+        raise
+    except Exception as e:
+        endpoint.record_failure(e)
+        if response is not None:
+            await response.aclose()
+        raise
+    endpoint.observe_ttft(time.monotonic() - started)
+    endpoint.record_success()
+    return StreamResponse(endpoint, response, iterator, first_chunk)
+
+
+async def _open_hedged(payload, ticket):
+    """选择端点发起流式请求；开启对冲时，首 token 超过 p95 未到则向次优端点再发一次，先到者胜出
+
+    对冲请求另占一个调度器名额，只在有空闲名额时发出，胜负确定后即释放（之后只有一个上游调用）
+    """
+    primary = upstream_pool.select()
+    if not LLM_HEDGE_ENABLED:
+        return await _open_stream(primary, payload, ticket)
+
+    tasks = [asyncio.create_task(_open_stream(primary, payload, ticket))]
+    winner = None
+    hedge_ticket = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=upstream_pool.hedge_delay(primary))
+        if not done:
+            secondary = upstream_pool.select(exclude=(primary,))
+            if secondary is not None:
+                hedge_ticket = upstream_scheduler.try_acquire()
+                if hedge_ticket is None:
+                    upstream_pool.hedges_skipped += 1
+                    metrics.UPSTREAM_HEDGES.labels("skipped").inc()
+                else:
+                    tasks.append(asyncio.create_task(_open_stream(secondary, payload, hedge_ticket)))
+                    upstream_pool.hedges += 1
+
+        pending = set(tasks)
+        error = None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    break
+                error = task.exception()
+        if winner is None:
+            raise error
+
+        if len(tasks) > 1:
+            hedge_won = winner is tasks[1]
+            upstream_pool.hedges_won += hedge_won
+            metrics.UPSTREAM_HEDGES.labels("won" if hedge_won else "lost").inc()
+        return winner.result()
+    finally:
+        # 取消落败的请求；已完成的落败请求关闭响应
+        losers = [task for task in tasks if task is not winner]
+        for task in losers:
+            task.cancel()
+        for result in await asyncio.gather(*losers, return_exceptions=True):
+            if isinstance(result, StreamResponse):
+                await result.aclose()
+        if hedge_ticket is not None:
+            upstream_scheduler.release()
+
+
+@asynccontextmanager
+async def stream_chat_completion(payload, user_key=None, priority=PRIORITY_STREAM):
+    """流式调用 chat/completions，返回 StreamResponse（经调度器排队，错误状态码抛出 HTTPStatusError）"""
+    async with upstream_scheduler.slot(user_key, priority) as ticket:
+        async with _track_request():
+            response = await _open_hedged(payload, ticket)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+
+async def create_chat_completion(payload, user_key=None, priority=PRIORITY_OPTIONS):
+    """非流式调用 chat/completions，返回解析后的 JSON（经调度器排队）"""
+    client = get_llm_client()
+    async with upstream_scheduler.slot(user_key, priority) as ticket:
+        endpoint = upstream_pool.select()
+        async with _track_request():
+            try:
+                response = await client.post(
+                    endpoint.url, content=encode_chat_request(endpoint.prepare(payload)), headers=endpoint.headers
+                )
+                ticket.response(response)
+                response.raise_for_status()
+                result = response.json()
+            except Exception as e:
+                endpoint.record_failure(e)
+                raise
+            endpoint.record_success()
+            return result
+
+
+def get_pool_stats():
+    """连接池使用情况"""
+    return {
+        **_stats,
+        "max_connections": LLM_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_MAX_KEEPALIVE_CONNECTIONS,
+        "http2": LLM_HTTP2,
+        "utilization": _stats["in_flight"] / LLM_MAX_CONNECTIONS if LLM_MAX_CONNECTIONS else 0,
+    }
@@ -0,0 +1,213 @@
+# 聊天消息异步批量写入
+from sqlalchemy import exc, insert
+from services.database import AsyncSessionLocal
+from services.metrics import db_route
+from models.chat_session import ChatSession
+from models.chat_message import ChatMessage
+from datetime import datetime
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 批量写入配置：攒够 MESSAGE_BATCH_SIZE 条或等待 MESSAGE_FLUSH_INTERVAL 秒后写入一次
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "10000"))
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "200"))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.05"))
+# 数据库不可用时持续重试（指数退避，最长间隔 MESSAGE_RETRY_BACKOFF_MAX 秒），期间队列写满后由背压减缓生产方
+MESSAGE_RETRY_BACKOFF_MAX = float(os.getenv("MESSAGE_RETRY_BACKOFF_MAX", "5"))
+# 停止时等待剩余数据写入的最长时间（秒），超时后未写入的数据记入日志
+MESSAGE_STOP_TIMEOUT = float(os.getenv("MESSAGE_STOP_TIMEOUT", "30"))
+
+_SESSION = "session"
+_MESSAGE = "message"
+
+
+def _is_transient(error):
+    """连接断开、数据库不可用、取连接超时等与数据本身无关的错误"""
+    if isinstance(error, exc.DBAPIError):
+        return error.connection_invalidated or isinstance(error, (exc.OperationalError, exc.InterfaceError))
+    return isinstance(error, (exc.TimeoutError, exc.DisconnectionError, OSError, asyncio.TimeoutError))
+
+
+def _backoff(attempt):
+    return min(MESSAGE_RETRY_BACKOFF_MAX, 0.1 * 2 ** (attempt - 1))
+
+
+class MessageWriter:
+    """会话与消息的写入队列
+
+    - 队列满时 add_* 会等待（背压）
+    - 单个写入任务按批次在一个事务中多行插入，会话先于消息写入
+    - 数据库不可用时持续重试，不丢弃数据；只丢弃自身违反约束 / 数据有误的行
+    - sync(session_id) 等待该会话已入队的数据全部落库（读己之写）
+    - stop() 会写完队列中剩余的数据
+    """
+
+    def __init__(self, queue_size=MESSAGE_QUEUE_SIZE, batch_size=MESSAGE_BATCH_SIZE,
+                 flush_interval=MESSAGE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._pending = {}
+        self._synced = asyncio.Condition()
+        self._task = None
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+
+    async def add_session(self, session_id, user_id, tool_type):
+        await self._put(session_id, _SESSION, {
+            "id": session_id,
+            "user_id": user_id,
+            "tool_type": tool_type,
+            "created_at": datetime.utcnow()
+        })
+
+    async def add_message(self, session_id, role, content):
+        """入队一条消息，返回消息 ID（创建时间在入队时确定，保证顺序）"""
+        message_id = uuid.uuid4()
+        await self._put(session_id, _MESSAGE, {
+            "id": message_id,
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.utcnow()
+        })
+        return message_id
+
+    async def _put(self, session_id, kind, row):
+        if self._task is None:
+            self.start()
+        self._pending[session_id] = self._pending.get(session_id, 0) + 1
+        try:
+            await self._queue.put((session_id, kind, row))
+        except BaseException:
+            self._pending[session_id] -= 1
+            raise
+        self.enqueued += 1
+
+    def pending(self, session_id):
+        return self._pending.get(session_id, 0)
+
+    async def sync(self, session_id):
+        """等待会话已入队的数据写入数据库"""
+        if not self._pending.get(session_id):
+            return
+        async with self._synced:
+            await self._synced.wait_for(lambda: not self._pending.get(session_id))
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            # 队列中已有的数据直接取走，不再等待
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, items):
+        sessions = [row for _, kind, row in items if kind == _SESSION]
+        messages = [row for _, kind, row in items if kind == _MESSAGE]
+        async with AsyncSessionLocal() as db:
+            if sessions:
+                await db.execute(insert(ChatSession), sessions)
+            if messages:
+                await db.execute(insert(ChatMessage), messages)
+            await db.commit()
+
+    async def _write_with_retry(self, items):
+        """写入 items；临时性错误持续重试，其他错误抛出"""
+        attempt = 0
+        while True:
+            try:
+                await self._write(items)
+                return
+            except Exception as e:
+                if not _is_transient(e):
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = _backoff(attempt)
+                if attempt == 1 or attempt % 10 == 0:
+                    logger.warning(f"[MessageWriter] 数据库暂不可用，{delay:.1f}s 后重试（第 {attempt} 次，{len(items)} 条）: {e}")
+                await asyncio.sleep(delay)
+
+    async def _write_batch(self, batch):
+        try:
+            await self._write_with_retry(batch)
+            self.written += len(batch)
+            return
+        except Exception as e:
+            logger.warning(f"[MessageWriter] 批量写入失败，改为逐条写入: {e}")
+
+        # 批量中有数据本身写不进去：逐条写入，隔离出错的数据
+        for item in batch:
+            try:
+                await self._write_with_retry([item])
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"[MessageWriter] 丢弃无法写入的数据 {item[1]} {item[2].get('id')}: {e}")
+
+    async def _run(self):
+        db_route.set("message_writer")
+        while True:
+            batch = await self._next_batch()
+            stop = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                await self._write_batch(batch)
+                self.batches += 1
+                for session_id, _, _ in batch:
+                    self._pending[session_id] -= 1
+                    if not self._pending[session_id]:
+                        del self._pending[session_id]
+                async with self._synced:
+                    self._synced.notify_all()
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=MESSAGE_STOP_TIMEOUT):
+        """写完队列中剩余的数据后停止；数据库持续不可用时最多等待 timeout 秒"""
+        if self._task is not None:
+            await self._queue.put(None)
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"[MessageWriter] 停止超时，{sum(self._pending.values())} 条数据未写入")
+            self._task = None
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "pending_sessions": len(self._pending),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,308 @@
+# 运行指标（Prometheus 文本格式，无第三方依赖）
+from bisect import bisect_left
+from contextvars import ContextVar
+import time
+
+# 数据库耗时按路由统计：HTTP 中间件、WebSocket 处理和后台任务设置当前路由
+db_route = ContextVar("db_route", default="background")
+
+# 秒级耗时的默认分桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+_registry = []
+
+
+class _Metric:
+    """指标基类：按标签值缓存子项，热路径上应先调用 labels() 取得子项再重复使用"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _label_text(self, values, extra=None):
+        pairs = list(zip(self.labelnames, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{self._label_text(values)} {_format(child.value)}"]
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Gauge(_Metric):
+    """数值型指标；传入 function 时在输出时调用取值"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self._function = function
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.value = value
+
+    def inc(self, amount=1):
+        self._default.value += amount
+
+    def dec(self, amount=1):
+        self._default.value -= amount
+
+    def _render_child(self, values, child):
+        value = child.value
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                return []
+        return [f"{self.name}{self._label_text(values)} {_format(value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # 每次观测只做一次二分查找和三次加法
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return _Timer(self._default)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _format(bound)
+            lines.append(f"{self.name}_bucket{self._label_text(values, ('le', le))} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(values)} {_format(child.sum)}")
+        lines.append(f"{self.name}_count{self._label_text(values)} {child.count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    if isinstance(value, float):
+        return repr(value) if value == value else "NaN"
+    return str(value)
+
+
+def render_metrics():
+    """所有指标的文本格式输出"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def instrument_engine(engine):
+    """为数据库引擎注册语句耗时统计（按当前路由分组）"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_start", None)
+        if start is not None:
+            DB_QUERY_SECONDS.labels(db_route.get()).observe(time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        DB_QUERY_ERRORS.labels(db_route.get()).inc()
+
+
+class MetricsMiddleware:
+    """记录 HTTP 请求耗时，并把路由模板写入 db_route 供数据库耗时统计使用"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        route = _route_template(scope)
+        token = db_route.set(route)
+        if scope["type"] == "websocket":
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                db_route.reset(token)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            db_route.reset(token)
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status["code"])).observe(
+                time.perf_counter() - start
+            )
+
+
+def _route_template(scope):
+    from starlette.routing import Match
+
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+# WebSocket 与对话流程
+WS_CONNECTIONS = Gauge("ws_connections", "当前 WebSocket 连接数")
+WS_CONNECTIONS_TOTAL = Counter("ws_connections_total", "累计 WebSocket 连接数")
+CHAT_TURNS = Counter("chat_turns_total", "对话轮数", ["status"])
+CHAT_TTFT_SECONDS = Histogram("chat_time_to_first_token_seconds", "上游流式响应首个增量的耗时")
+CHAT_STREAM_SECONDS = Histogram("chat_stream_duration_seconds", "上游流式响应总耗时")
+CHAT_TOKENS_PER_SECOND = Histogram(
+    "chat_stream_tokens_per_second", "流式输出速率（回复 token 数 / 流式耗时）",
+    buckets=(5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+)
+CHAT_PROMPT_TOKENS = Histogram(
+    "chat_prompt_tokens", "每轮请求的 prompt token 数",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 16000)
+)
+CHAT_COMPLETION_TOKENS = Counter("chat_completion_tokens_total", "回复 token 总数")
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "上游请求重试次数（first_token：首个 token 前失败；continue：中途失败后续写）", ["kind"])
+RETRY_BUDGET_EXHAUSTED = Counter("retry_budget_exhausted_total", "因重试预算耗尽而放弃的重试次数")
+UPSTREAM_ERRORS = Counter("upstream_errors_total", "上游请求错误次数", ["type"])
+UPSTREAM_QUEUE_WAIT_SECONDS = Histogram("upstream_queue_wait_seconds", "上游调用排队等待耗时", ["priority"])
+UPSTREAM_QUEUE_TIMEOUTS = Counter("upstream_queue_timeouts_total", "排队超时放弃的上游调用数", ["priority"])
+UPSTREAM_ENDPOINT_REQUESTS = Counter("upstream_endpoint_requests_total", "各上游端点的请求数", ["endpoint", "status"])
+UPSTREAM_ENDPOINT_TTFT = Gauge("upstream_endpoint_ttft_ewma_seconds", "各上游端点首 token 耗时 EWMA", ["endpoint"])
+UPSTREAM_EJECTIONS = Counter("upstream_endpoint_ejections_total", "上游端点因连续失败被摘除的次数", ["endpoint"])
+UPSTREAM_HEDGES = Counter("upstream_hedges_total", "对冲请求次数（won 表示对冲请求先到，skipped 表示无空闲并发名额未发出）", ["outcome"])
+UPSTREAM_RATE_LIMITED = Counter("upstream_rate_limited_total", "上游返回 429 的次数")
+OPTIONS_SECONDS = Histogram("options_generation_seconds", "智能选项生成耗时", ["source"])
+STREAM_RESUMES = Counter("stream_resumes_total", "重连续传次数（buffer/snapshot/relay/none）", ["source"])
+STREAM_SUBSCRIBERS_DROPPED = Counter("stream_subscribers_dropped_total", "因接收过慢被断开的订阅数")
+
+# HTTP 与数据库
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP 请求耗时", ["method", "route", "status"])
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "数据库语句耗时", ["route"], buckets=DB_BUCKETS)
+DB_QUERY_ERRORS = Counter("db_query_errors_total", "数据库语句错误次数", ["route"])
+DB_POOL_CHECKOUT_SECONDS = Histogram("db_pool_checkout_seconds", "从连接池取得连接的耗时（含排队与新建连接）", buckets=DB_BUCKETS)
+DB_POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "连接池取连接超时次数")
+
+# 使用次数
+QUOTA_REJECTIONS = Counter("quota_rejections_total", "因次数不足被拒绝的请求数")
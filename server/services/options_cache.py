@@ -0,0 +1,86 @@
+# 智能选项缓存（按对话状态内容寻址，TTL + LRU 淘汰）
+from collections import OrderedDict
+import hashlib
+import os
+import time
+
+OPTIONS_CACHE_ENABLED = os.getenv("OPTIONS_CACHE_ENABLED", "true").lower() == "true"
+OPTIONS_CACHE_MAX_SIZE = int(os.getenv("OPTIONS_CACHE_MAX_SIZE", "10000"))
+OPTIONS_CACHE_TTL = float(os.getenv("OPTIONS_CACHE_TTL", "3600"))
+# 不使用缓存的工具类型，逗号分隔
+OPTIONS_CACHE_DISABLED_TOOLS = {
+    tool.strip() for tool in os.getenv("OPTIONS_CACHE_DISABLED_TOOLS", "").split(",") if tool.strip()
+}
+
+
+def options_key(model, history_lines):
+    """模型 + 规范化后的对话历史的 SHA-256"""
+    digest = hashlib.sha256(str(model).encode("utf-8"))
+    for line in history_lines:
+        # 合并连续空白，忽略首尾空白差异
+        digest.update(b"\x00")
+        digest.update(" ".join(line.split()).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class OptionsCache:
+    """缓存生成的选项列表 [(label, value), ...]，命中时由调用方重新生成选项 ID"""
+
+    def __init__(self, max_size=OPTIONS_CACHE_MAX_SIZE, ttl=OPTIONS_CACHE_TTL,
+                 disabled_tools=OPTIONS_CACHE_DISABLED_TOOLS, enabled=OPTIONS_CACHE_ENABLED):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.disabled_tools = disabled_tools
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def is_enabled(self, tool_type):
+        return self.enabled and tool_type not in self.disabled_tools
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        options, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return options
+
+    def put(self, key, options):
+        self._entries[key] = (tuple(options), time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def bypass(self):
+        """记录因工具类型关闭缓存而直接调用模型的次数"""
+        self.bypassed += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "disabled_tools": sorted(self.disabled_tools),
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0,
+        }
+
+
+options_cache = OptionsCache()
@@ -0,0 +1,11 @@
+# 键集分页：游标为上一页边界记录的 id，按 (created_at, id) 比较
+from fastapi import HTTPException
+from sqlalchemy import literal, select, tuple_
+
+
+async def cursor_key(db, model, cursor_id, *conditions):
+    """游标记录的排序键 (created_at, id)；记录不存在（已删除或不在当前范围内）时返回 400，而不是静默返回空页"""
+    created_at = await db.scalar(select(model.created_at).where(model.id == cursor_id, *conditions))
+    if created_at is None:
+        raise HTTPException(status_code=400, detail="分页游标无效")
+    return tuple_(literal(created_at, model.created_at.type), literal(cursor_id, model.id.type))
@@ -0,0 +1,64 @@
+# 使用次数扣减
+from sqlalchemy import text
+from datetime import date
+
+# 单条语句完成扣减：优先累加当日免费次数（ON CONFLICT），免费次数用尽时条件扣减购买次数。
+# users 行加锁使同一用户的并发扣减串行执行，保证计数精确。
+CONSUME_QUOTA_SQL = text("""
+WITH u AS (
+    SELECT id, daily_quota, purchased_quota
+    FROM users
+    WHERE id = :user_id
+    FOR UPDATE
+),
+daily AS (
+    INSERT INTO usage_logs (user_id, date, count)
+    SELECT id, :today, 1 FROM u WHERE u.daily_quota > 0
+    ON CONFLICT (user_id, date) DO UPDATE
+        SET count = usage_logs.count + 1
+        WHERE usage_logs.count < (SELECT daily_quota FROM u)
+    RETURNING count
+),
+purchased AS (
+    UPDATE users
+    SET purchased_quota = users.purchased_quota - 1
+    FROM u
+    WHERE users.id = u.id
+      AND users.purchased_quota > 0
+      AND NOT EXISTS (SELECT 1 FROM daily)
+    RETURNING users.purchased_quota
+)
+SELECT
+    u.daily_quota,
+    (SELECT count FROM daily) AS daily_used,
+    COALESCE((SELECT purchased_quota FROM purchased), u.purchased_quota) AS purchased_quota,
+    EXISTS (SELECT 1 FROM daily) OR EXISTS (SELECT 1 FROM purchased) AS consumed
+FROM u
+""")
+
+
+def quota_summary(daily_quota, daily_used, purchased_quota):
+    """与 /api/usage/check 一致的剩余次数结构"""
+    daily_remaining = max(0, daily_quota - daily_used)
+    return {
+        "remaining": daily_remaining + purchased_quota,
+        "total": daily_quota + purchased_quota,
+        "daily_remaining": daily_remaining,
+        "purchased_remaining": purchased_quota
+    }
+
+
+async def consume_quota(db, user_id):
+    """扣减一次使用次数
+
+    返回 (consumed, summary)；用户不存在时返回 None
+    """
+    result = await db.execute(CONSUME_QUOTA_SQL, {"user_id": user_id, "today": date.today()})
+    row = result.first()
+    await db.commit()
+    if row is None:
+        return None
+
+    # 未扣减当日次数说明免费次数已用尽
+    daily_used = row.daily_used if row.daily_used is not None else row.daily_quota
+    return row.consumed, quota_summary(row.daily_quota, daily_used, row.purchased_quota)
@@ -0,0 +1,310 @@
+# 使用次数内存缓存（读写走内存，增量定期批量回写数据库）
+from collections import OrderedDict
+from sqlalchemy import select, and_, text
+from services.database import AsyncSessionLocal
+from services.metrics import db_route
+from services.quota import quota_summary
+from services.coordination import coordinator, COORDINATION_BACKEND
+from models.user import User
+from models.usage_log import UsageLog
+from datetime import date
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 缓存按进程独立；多 worker 部署时配置共享的协调后端（COORDINATION_BACKEND=redis），
+# 每日次数改由共享计数扣减，购买次数直接在数据库中原子扣减。
+# 默认只在配置了共享后端时开启：memory 后端下每个 worker 各自计数，多 worker 时每日次数会被放大
+QUOTA_CACHE_ENABLED = os.getenv(
+    "QUOTA_CACHE_ENABLED", "true" if COORDINATION_BACKEND == "redis" else "false"
+).lower() == "true"
+QUOTA_CACHE_MAX_USERS = int(os.getenv("QUOTA_CACHE_MAX_USERS", "100000"))
+QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", "1.0"))
+QUOTA_FLUSH_BATCH_SIZE = int(os.getenv("QUOTA_FLUSH_BATCH_SIZE", "1000"))
+
+FLUSH_USAGE_SQL = text("""
+INSERT INTO usage_logs (user_id, date, count)
+SELECT v.user_id, v.date, v.count
+FROM unnest(CAST(:user_ids AS uuid[]), CAST(:dates AS date[]), CAST(:counts AS int[])) AS v(user_id, date, count)
+WHERE EXISTS (SELECT 1 FROM users WHERE users.id = v.user_id)
+ON CONFLICT (user_id, date) DO UPDATE SET count = usage_logs.count + EXCLUDED.count
+""")
+
+# 共享模式下的购买次数扣减
+CONSUME_PURCHASED_SQL = text("""
+UPDATE users
+SET purchased_quota = purchased_quota - 1
+WHERE id = :user_id AND purchased_quota > 0
+RETURNING purchased_quota
+""")
+
+# 共享每日计数的保留时长（秒）
+DAILY_COUNTER_TTL = 2 * 86400
+
+FLUSH_PURCHASED_SQL = text("""
+UPDATE users
+SET purchased_quota = GREATEST(users.purchased_quota - v.amount, 0)
+FROM unnest(CAST(:user_ids AS uuid[]), CAST(:amounts AS int[])) AS v(id, amount)
+WHERE users.id = v.id
+""")
+
+
+class QuotaState:
+    __slots__ = ("daily_quota", "purchased_quota", "day", "daily_used", "version")
+
+    def __init__(self, daily_quota, purchased_quota, day, daily_used, version=None):
+        self.daily_quota = daily_quota
+        self.purchased_quota = purchased_quota
+        self.day = day
+        self.daily_used = daily_used
+        # 加载时的用户余额版本（共享模式），与协调后端中的版本不一致时重新加载
+        self.version = version
+
+
+class QuotaCache:
+    """活跃用户的次数状态缓存
+
+    - check / consume 命中时完全在内存中完成
+    - 扣减产生的增量记录在 pending 中，由后台任务按 flush_interval 批量写回
+    - 同一用户的并发未命中只加载一次，不同用户的加载互不等待
+    - 加载期间发生回写时重新加载，避免漏算已从 pending 取出、尚未提交的增量
+    """
+
+    def __init__(self, max_users=QUOTA_CACHE_MAX_USERS, flush_interval=QUOTA_FLUSH_INTERVAL):
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self._states = OrderedDict()
+        self._pending_daily = {}
+        self._pending_purchased = {}
+        # user_id -> [锁, 等待数]
+        self._load_locks = {}
+        self._flush_lock = asyncio.Lock()
+        # 回写代数：每次回写开始时加一；_flush_idle 在回写进行中时清除
+        self._flush_generation = 0
+        self._flush_idle = asyncio.Event()
+        self._flush_idle.set()
+        self._stopping = asyncio.Event()
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    async def _get_state(self, user_id):
+        today = date.today()
+        # 先读版本再加载：加载期间发生的修改会在下次访问时被发现
+        version = await coordinator.user_version(user_id)
+        state = self._states.get(user_id)
+        if state is not None and state.version != version:
+            # 余额在其他 worker 上被修改过
+            del self._states[user_id]
+            self.invalidations += 1
+            state = None
+        if state is None:
+            self.misses += 1
+            state = await self._load(user_id, today, version)
+            if state is None:
+                return None
+        else:
+            self.hits += 1
+            self._states.move_to_end(user_id)
+
+        # 跨天后重新计数
+        if state.day != today:
+            state.day = today
+            state.daily_used = self._pending_daily.get((user_id, today), 0)
+        return state
+
+    async def _load(self, user_id, today, version=None):
+        entry = self._load_locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # 等待锁期间可能已被同一用户的其他请求加载
+                state = self._states.get(user_id)
+                if state is not None and state.version == version:
+                    return state
+                return await self._load_from_db(user_id, today, version)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._load_locks[user_id]
+
+    async def _load_from_db(self, user_id, today, version):
+        while True:
+            await self._flush_idle.wait()
+            generation = self._flush_generation
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(User.daily_quota, User.purchased_quota, UsageLog.count)
+                    .outerjoin(UsageLog, and_(UsageLog.user_id == User.id, UsageLog.date == today))
+                    .where(User.id == user_id)
+                )
+                row = result.first()
+            # 查询期间没有回写开始：数据库中的值与 pending 中的增量不重不漏
+            if generation == self._flush_generation:
+                break
+        if row is None:
+            return None
+
+        # 叠加尚未回写的增量
+        state = QuotaState(
+            daily_quota=row.daily_quota,
+            purchased_quota=max(0, row.purchased_quota - self._pending_purchased.get(user_id, 0)),
+            day=today,
+            daily_used=(row.count or 0) + self._pending_daily.get((user_id, today), 0),
+            version=version
+        )
+        self._states[user_id] = state
+        while len(self._states) > self.max_users:
+            self._states.popitem(last=False)
+        return state
+
+    async def check(self, user_id):
+        """返回剩余次数；用户不存在返回 None"""
+        state = await self._get_state(user_id)
+        if state is None:
+            return None
+        if coordinator.shared:
+            # 其他 worker 的扣减只体现在共享计数中
+            used = await coordinator.get_counter(_daily_counter(user_id, state.day))
+            if used is not None:
+                state.daily_used = min(used, state.daily_quota)
+        return quota_summary(state.daily_quota, state.daily_used, state.purchased_quota)
+
+    async def consume(self, user_id):
+        """扣减一次，返回 (consumed, summary)；用户不存在返回 None"""
+        state = await self._get_state(user_id)
+        if state is None:
+            return None
+        if coordinator.shared:
+            return await self._consume_shared(user_id, state)
+
+        # 优先扣每日免费次数，其次扣购买次数
+        if state.daily_used < state.daily_quota:
+            state.daily_used += 1
+            key = (user_id, state.day)
+            self._pending_daily[key] = self._pending_daily.get(key, 0) + 1
+            consumed = True
+        elif state.purchased_quota > 0:
+            state.purchased_quota -= 1
+            self._pending_purchased[user_id] = self._pending_purchased.get(user_id, 0) + 1
+            consumed = True
+        else:
+            consumed = False
+
+        return consumed, quota_summary(state.daily_quota, state.daily_used, state.purchased_quota)
+
+    async def _consume_shared(self, user_id, state):
+        """多 worker 部署：每日次数用共享计数原子扣减，用尽后在数据库中扣购买次数"""
+        used = await coordinator.incr(
+            _daily_counter(user_id, state.day), ttl=DAILY_COUNTER_TTL, initial=state.daily_used
+        )
+        if used <= state.daily_quota:
+            state.daily_used = used
+            key = (user_id, state.day)
+            self._pending_daily[key] = self._pending_daily.get(key, 0) + 1
+            consumed = True
+        else:
+            state.daily_used = state.daily_quota
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(CONSUME_PURCHASED_SQL, {"user_id": user_id})
+                row = result.first()
+                await db.commit()
+            consumed = row is not None
+            state.purchased_quota = row.purchased_quota if consumed else 0
+
+        return consumed, quota_summary(state.daily_quota, state.daily_used, state.purchased_quota)
+
+    async def invalidate(self, user_id):
+        """数据库中的余额被直接修改后调用：丢弃本进程的缓存，并通知其他 worker 下次访问时重新加载"""
+        self._states.pop(str(user_id), None)
+        await coordinator.bump_user(str(user_id))
+
+    async def flush(self):
+        """将累计的增量批量写回数据库"""
+        if not self._pending_daily and not self._pending_purchased:
+            return
+
+        async with self._flush_lock:
+            self._flush_generation += 1
+            self._flush_idle.clear()
+            pending_daily, self._pending_daily = self._pending_daily, {}
+            pending_purchased, self._pending_purchased = self._pending_purchased, {}
+            try:
+                async with AsyncSessionLocal() as db:
+                    daily_items = list(pending_daily.items())
+                    for i in range(0, len(daily_items), QUOTA_FLUSH_BATCH_SIZE):
+                        batch = daily_items[i:i + QUOTA_FLUSH_BATCH_SIZE]
+                        await db.execute(FLUSH_USAGE_SQL, {
+                            "user_ids": [user_id for (user_id, _), _ in batch],
+                            "dates": [day for (_, day), _ in batch],
+                            "counts": [count for _, count in batch]
+                        })
+                    purchased_items = list(pending_purchased.items())
+                    for i in range(0, len(purchased_items), QUOTA_FLUSH_BATCH_SIZE):
+                        batch = purchased_items[i:i + QUOTA_FLUSH_BATCH_SIZE]
+                        await db.execute(FLUSH_PURCHASED_SQL, {
+                            "user_ids": [user_id for user_id, _ in batch],
+                            "amounts": [amount for _, amount in batch]
+                        })
+                    await db.commit()
+                self.flushes += 1
+            except Exception as e:
+                # 回写失败：增量放回，下次重试
+                self.flush_errors += 1
+                logger.error(f"[QuotaCache] 回写失败: {e}")
+                for key, count in pending_daily.items():
+                    self._pending_daily[key] = self._pending_daily.get(key, 0) + count
+                for key, amount in pending_purchased.items():
+                    self._pending_purchased[key] = self._pending_purchased.get(key, 0) + amount
+            finally:
+                self._flush_idle.set()
+
+    async def _run(self):
+        db_route.set("quota_cache")
+        # 不使用 cancel 停止，避免回写进行到一半被打断
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台任务并写回剩余增量"""
+        if self._task is not None:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "users": len(self._states),
+            "loading": len(self._load_locks),
+            "pending_daily": len(self._pending_daily),
+            "pending_purchased": len(self._pending_purchased),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0,
+            "invalidations": self.invalidations,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+        }
+
+
+def _daily_counter(user_id, day):
+    return f"quota:daily:{user_id}:{day.isoformat()}"
+
+
+quota_cache = QuotaCache()
@@ -0,0 +1,137 @@
+# 流式回复的重试策略：退避、进程级重试预算、中途失败时从已输出部分继续
+from services import metrics
+import httpx
+import os
+import random
+import time
+
+# 每轮最多重试次数
+STREAM_MAX_RETRIES = int(os.getenv("STREAM_MAX_RETRIES", "2"))
+# 指数退避（带完全抖动）：第 n 次重试等待 uniform(0, min(MAX, BASE * 2^(n-1))) 秒
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "8"))
+# 重试预算：每个请求存入 RATIO 个令牌，另按 MIN_PER_SECOND 匀速补充，最多积累 MAX 个；每次重试消耗 1 个
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "0.2"))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "10"))
+
+CONTINUE_PROMPT = "上一条回复因网络中断未完成。请从中断处直接继续输出剩余内容，不要重复已输出的部分，也不要添加任何说明。"
+
+# 续写开头与已输出内容重叠的检测范围（字符）
+OVERLAP_MIN = 4
+OVERLAP_MAX = 200
+# 续写开头缓冲到该长度后再检测重叠
+OVERLAP_PROBE = 32
+
+# 不应重试的上游状态码（请求本身有误或鉴权失败）
+_NON_RETRYABLE_STATUS = {400, 401, 403, 404, 422}
+
+
+def is_retryable(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code not in _NON_RETRYABLE_STATUS
+    return True
+
+
+def backoff_delay(attempt):
+    """第 attempt 次重试前的等待时长（秒）"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def continuation_messages(messages, partial):
+    """中途失败后的续写请求：原消息 + 已输出的部分回复 + 续写指令"""
+    return messages + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+
+
+def strip_overlap(partial, text):
+    """去掉续写开头与已输出内容末尾重复的部分（包括从头重新生成了已输出的全部内容）"""
+    if partial and text.startswith(partial):
+        return text[len(partial):]
+    if len(text) >= OVERLAP_PROBE and partial.startswith(text):
+        # 从头重新生成，但在覆盖全部已输出内容前就结束了
+        return ""
+    for size in range(min(len(partial), len(text), OVERLAP_MAX), OVERLAP_MIN - 1, -1):
+        if partial.endswith(text[:size]):
+            return text[size:]
+    return text
+
+
+class OverlapTrimmer:
+    """续写输出的开头先缓冲 OVERLAP_PROBE 个字符，去掉与已输出内容重复的部分后再放行
+
+    若缓冲的内容与已输出内容的开头一致（从头重新生成），继续缓冲直到覆盖全部已输出内容或出现分歧。
+    """
+
+    def __init__(self, partial):
+        self.partial = partial
+        self._text = ""
+        self._probing = True
+
+    def feed(self, delta):
+        if not self._probing:
+            return delta
+        self._text += delta
+        if len(self._text) < OVERLAP_PROBE:
+            return ""
+        if len(self._text) < len(self.partial) and self.partial.startswith(self._text):
+            return ""
+        return self.flush()
+
+    def flush(self):
+        if not self._probing:
+            return ""
+        self._probing = False
+        text, self._text = self._text, ""
+        return strip_overlap(self.partial, text)
+
+
+class RetryBudget:
+    """进程级重试预算：上游大面积故障时限制重试总量，避免重试放大负载"""
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND,
+                 max_tokens=RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._updated = time.monotonic()
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self):
+        self._refill()
+        self.requests += 1
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        metrics.RETRY_BUDGET_EXHAUSTED.inc()
+        return False
+
+    def stats(self):
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 2),
+            "max_tokens": self.max_tokens,
+            "ratio": self.ratio,
+            "requests": self.requests,
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+        }
+
+
+retry_budget = RetryBudget()
@@ -0,0 +1,78 @@
+# 上游 SSE 流增量解析（按字节处理，不重复拼接/切分字符串）
+from services.json_codec import loads as _loads
+
+DONE = b"[DONE]"
+
+
+class SSEDecoder:
+    """增量解析 SSE 字节流，返回每个事件的 data 字段
+
+    按 b"\\n" 切分完整的行后再处理，多字节 UTF-8 字符不会被拆开；
+    缓冲区只在每次 feed 结束时整体压缩一次。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data = []
+        self.done = False
+
+    def feed(self, chunk):
+        events = []
+        buffer = self._buffer
+        buffer += chunk
+        pos = 0
+        while not self.done:
+            end = buffer.find(b"\n", pos)
+            if end < 0:
+                break
+            line = buffer[pos:end]
+            pos = end + 1
+            if line.endswith(b"\r"):
+                line = line[:-1]
+
+            if not line:
+                # 空行：事件结束
+                if self._data:
+                    data = self._data[0] if len(self._data) == 1 else b"\n".join(self._data)
+                    self._data = []
+                    if data == DONE:
+                        self.done = True
+                    else:
+                        events.append(data)
+                continue
+
+            if line.startswith(b"data:"):
+                value = line[5:]
+                if value.startswith(b" "):
+                    value = value[1:]
+                # 兼容不以空行分隔事件的实现
+                if value == DONE:
+                    self.done = True
+                    break
+                self._data.append(value)
+            # 注释行（:）及 event/id/retry 字段忽略
+
+        if pos:
+            del buffer[:pos]
+        return events
+
+
+def parse_delta(data):
+    """从 chat.completion.chunk 中取出增量文本，格式不符时返回空字符串"""
+    try:
+        chunk = _loads(data)
+        return chunk["choices"][0]["delta"].get("content") or ""
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+async def iter_deltas(byte_iter):
+    """逐个产出上游流中的增量文本，遇到 [DONE] 结束"""
+    decoder = SSEDecoder()
+    async for chunk in byte_iter:
+        for data in decoder.feed(chunk):
+            delta = parse_delta(data)
+            if delta:
+                yield delta
+        if decoder.done:
+            break
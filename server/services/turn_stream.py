@@ -0,0 +1,238 @@
+# 可续传的流式输出：每轮对话的帧带序号缓存在服务端，客户端断线重连后从上次收到的序号继续
+from collections import deque
+from services.coordination import coordinator, COORDINATION_RELAY
+from services.json_codec import dumps_text
+from services import metrics
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# 每轮最多缓存的帧数（超出后丢弃最早的帧，重连时改发已输出内容的快照）
+STREAM_BUFFER_MAX_FRAMES = int(os.getenv("STREAM_BUFFER_MAX_FRAMES", "2000"))
+# 本轮结束后保留缓冲区的时长（秒），在此期间重连仍可取回剩余内容
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "60"))
+# 服务关闭时等待进行中的回复完成的时长（秒）
+STREAM_SHUTDOWN_TIMEOUT = float(os.getenv("STREAM_SHUTDOWN_TIMEOUT", "10"))
+
+# 标志一轮结束的帧
+_END_TYPES = ("done",)
+
+
+def is_turn_end(frame):
+    return frame.get("type") in _END_TYPES or (frame.get("type") == "error" and frame.get("final"))
+
+
+class Subscriber:
+    """一个 WebSocket 连接对某轮输出的订阅
+
+    帧先放入队列，由独立的发送任务写给客户端：客户端慢或已断开都不会阻塞上游读取。
+    队列超过缓冲上限时断开订阅，客户端可重连续传。
+    send_text 接收已编码的 JSON 文本（每帧只编码一次，多个订阅者共用）。
+    """
+
+    def __init__(self, stream, send_text, max_frames):
+        self.stream = stream
+        self._send_text = send_text
+        self._queue = asyncio.Queue(maxsize=max_frames)
+        self._turn_ended = asyncio.Event()
+        self._task = None
+        self.closed = False
+
+    def push(self, frame, text=None):
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait((frame, text if text is not None else dumps_text(frame)))
+        except asyncio.QueueFull:
+            metrics.STREAM_SUBSCRIBERS_DROPPED.inc()
+            logger.warning(f"[TurnStream] 会话 {self.stream.session_id} 客户端接收过慢，断开订阅")
+            self.close()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while True:
+                frame, text = await self._queue.get()
+                await self._send_text(text)
+                if is_turn_end(frame):
+                    self._turn_ended.set()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # 客户端已断开：上游继续输出，等待重连
+            self.close()
+
+    async def turn_ended(self):
+        """等待本轮的 done（或最终错误）送达客户端，订阅断开时也会返回"""
+        await self._turn_ended.wait()
+
+    def end_turn(self):
+        """客户端此前已收到本轮的结束帧"""
+        self._turn_ended.set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._turn_ended.set()
+        self.stream.detach(self)
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+
+class TurnStream:
+    """一轮对话的输出，与 WebSocket 连接解耦
+
+    - emit() 为帧分配递增的 seq（带上本轮标识 turn，客户端按轮去重）并写入有界缓冲区，同时推送给已连接的订阅者
+    - attach() 从客户端最后收到的 seq 之后补发，再接收后续帧；结束帧单独保留，客户端未收到时总会补发
+    - 没有客户端连接时上游照常输出，回复照常保存
+    """
+
+    def __init__(self, session_id, turn=None, max_frames=STREAM_BUFFER_MAX_FRAMES):
+        self.session_id = session_id
+        self.turn = turn
+        self.max_frames = max_frames
+        self.seq = 0
+        self._frames = deque(maxlen=max_frames)
+        self._content = []
+        self._end = None
+        self._subscribers = set()
+        self.finished = asyncio.Event()
+        self.task = None
+        self.options_task = None
+
+    async def emit(self, frame):
+        self.seq += 1
+        frame["seq"] = self.seq
+        if self.turn is not None:
+            frame["turn"] = self.turn
+        text = dumps_text(frame)
+        self._frames.append((frame, text))
+        if frame.get("type") == "chunk":
+            self._content.append(frame["content"])
+        ended = is_turn_end(frame)
+        if ended:
+            self._end = (frame, text)
+            self.finished.set()
+        for subscriber in list(self._subscribers):
+            subscriber.push(frame, text)
+        if COORDINATION_RELAY:
+            # 后台发布，不等待共享存储
+            coordinator.publish_frame(
+                self.session_id, self.turn, self.seq, text,
+                content=frame["content"] if frame.get("type") == "chunk" else "",
+                ended=ended, snapshot=self.content
+            )
+
+    def content(self):
+        """本轮已输出的全部内容"""
+        return "".join(self._content)
+
+    def delivers_end(self, last_seq):
+        """attach(last_seq) 后客户端是否还会收到本轮的结束帧（本轮未结束，或结束帧在 last_seq 之后）"""
+        return self._end is None or self._end[0]["seq"] > last_seq
+
+    def attach(self, send_text, last_seq=0, preface=None):
+        """订阅本轮输出，补发 seq 大于 last_seq 的帧"""
+        subscriber = Subscriber(self, send_text, self.max_frames + 3)
+        if preface is not None:
+            subscriber.push(preface)
+
+        end_seq = self._end[0]["seq"] if self._end is not None else None
+        first_buffered = self._frames[0][0]["seq"] if self._frames else self.seq + 1
+        if last_seq < first_buffered - 1 and self.delivers_end(last_seq):
+            # 缺失的帧已不在缓冲区：先发送已输出内容的快照（本轮已结束时快照截止到结束帧之前）
+            snapshot_seq = self.seq if end_seq is None else end_seq - 1
+            snapshot = {"type": "snapshot", "content": self.content(), "seq": snapshot_seq}
+            if self.turn is not None:
+                snapshot["turn"] = self.turn
+            subscriber.push(snapshot)
+            last_seq = snapshot_seq
+            metrics.STREAM_RESUMES.labels("snapshot").inc()
+        elif preface is not None:
+            metrics.STREAM_RESUMES.labels("buffer").inc()
+
+        if end_seq is not None and last_seq < end_seq < first_buffered:
+            # 结束帧已被挤出缓冲区（之后还有选项等帧）
+            subscriber.push(*self._end)
+        for frame, text in self._frames:
+            if frame["seq"] > last_seq:
+                subscriber.push(frame, text)
+        if end_seq is not None and end_seq <= last_seq:
+            subscriber.end_turn()
+        self._subscribers.add(subscriber)
+        subscriber.start()
+        return subscriber
+
+    def detach(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def cancel_options(self):
+        if self.options_task and not self.options_task.done():
+            self.options_task.cancel()
+
+
+class TurnStreamRegistry:
+    """按会话登记进行中及刚结束的输出；结束 grace 秒后移除"""
+
+    def __init__(self, grace=STREAM_RESUME_GRACE):
+        self.grace = grace
+        self._streams = {}
+        self.started = 0
+        self.unattended = 0
+
+    def start(self, session_id, run, turn=None):
+        """创建本轮输出并在后台运行 run(stream)；turn 为流归属租约的本轮标识"""
+        stream = TurnStream(session_id, turn)
+        self._streams[session_id] = stream
+        self.started += 1
+        stream.task = asyncio.create_task(self._run(stream, run))
+        return stream
+
+    async def _run(self, stream, run):
+        try:
+            await run(stream)
+        finally:
+            if not stream.subscribers:
+                # 本轮结束时没有客户端连接，回复已在后台保存
+                self.unattended += 1
+            asyncio.get_running_loop().call_later(self.grace, self._expire, stream)
+
+    def _expire(self, stream):
+        if self._streams.get(stream.session_id) is stream:
+            del self._streams[stream.session_id]
+
+    def get(self, session_id):
+        return self._streams.get(session_id)
+
+    async def stop(self):
+        """等待进行中的回复完成并保存，超时后取消"""
+        tasks = [stream.task for stream in self._streams.values() if stream.task and not stream.task.done()]
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=STREAM_SHUTDOWN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self):
+        running = sum(1 for stream in self._streams.values() if not stream.finished.is_set())
+        return {
+            "streams": len(self._streams),
+            "running": running,
+            "subscribers": sum(stream.subscribers for stream in self._streams.values()),
+            "started": self.started,
+            "unattended": self.unattended,
+            "grace_seconds": self.grace,
+        }
+
+
+turn_streams = TurnStreamRegistry()
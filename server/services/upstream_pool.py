@@ -0,0 +1,210 @@
+# 上游端点池：按近期首 token 耗时（EWMA）选择端点，连续失败的端点暂时摘除，可选对冲请求
+from collections import deque
+from services import metrics
+import httpx
+import json
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# 端点列表（JSON 数组），每项含 base_url，可选 name / api_key / model / weight；
+# 未配置时使用 OPENAI_BASE_URL / OPENAI_API_KEY / OPENAI_MODEL 作为唯一端点
+OPENAI_ENDPOINTS = os.getenv("OPENAI_ENDPOINTS", "")
+# 首 token 耗时 EWMA 的平滑系数
+LLM_TTFT_EWMA_ALPHA = float(os.getenv("LLM_TTFT_EWMA_ALPHA", "0.3"))
+# 按权重随机选择的比例，让较慢的端点也能定期更新耗时统计
+LLM_EXPLORE_RATE = float(os.getenv("LLM_EXPLORE_RATE", "0.05"))
+# 连续失败 N 次后摘除 COOLDOWN 秒
+LLM_EJECT_FAILURES = int(os.getenv("LLM_EJECT_FAILURES", "3"))
+LLM_EJECT_COOLDOWN = float(os.getenv("LLM_EJECT_COOLDOWN", "30"))
+# 对冲：首 token 超过该端点近期 p95 仍未到达时，向次优端点再发一次，先到者胜出
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+# 样本不足时的对冲等待时长（秒）
+LLM_HEDGE_INITIAL_DELAY = float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "3"))
+
+# 计算 p95 的样本窗口与最少样本数
+TTFT_WINDOW = 200
+TTFT_MIN_SAMPLES = 20
+
+
+def is_endpoint_failure(error):
+    """是否为端点自身的问题：连接 / 读取超时、传输错误、5xx
+
+    本地连接池已满（PoolTimeout）、4xx（内容审核、上下文超长等由单个请求引起）与 429（由调度器处理）不计入
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    if isinstance(error, httpx.PoolTimeout):
+        return False
+    return isinstance(error, httpx.TransportError)
+
+
+class Endpoint:
+    """一个上游端点及其近期表现"""
+
+    def __init__(self, name, base_url, api_key=None, model=None, weight=1.0):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.url = f"{self.base_url}/chat/completions"
+        self.model = model
+        self.weight = max(float(weight), 0.001)
+        # 请求体由 json_codec 预先编码后以 content 发送，需显式声明类型
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        self.ttft_ewma = None
+        self._ttft_samples = deque(maxlen=TTFT_WINDOW)
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self._ttft_gauge = metrics.UPSTREAM_ENDPOINT_TTFT.labels(name)
+        self._ok = metrics.UPSTREAM_ENDPOINT_REQUESTS.labels(name, "ok")
+        self._failed = metrics.UPSTREAM_ENDPOINT_REQUESTS.labels(name, "failed")
+
+    def prepare(self, payload):
+        """按端点替换请求中的模型名"""
+        if self.model and payload.get("model") != self.model:
+            payload = {**payload, "model": self.model}
+        return payload
+
+    def healthy(self, now):
+        return now >= self.ejected_until
+
+    def score(self):
+        """越小越优：EWMA / 权重，连续失败时加罚；尚无样本的端点优先试用"""
+        if self.ttft_ewma is None:
+            return 0.0
+        return self.ttft_ewma * (1 + self.consecutive_failures) / self.weight
+
+    def ttft_p95(self):
+        if len(self._ttft_samples) < TTFT_MIN_SAMPLES:
+            return None
+        samples = sorted(self._ttft_samples)
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def observe_ttft(self, seconds):
+        self._ttft_samples.append(seconds)
+        if self.ttft_ewma is None:
+            self.ttft_ewma = seconds
+        else:
+            self.ttft_ewma += LLM_TTFT_EWMA_ALPHA * (seconds - self.ttft_ewma)
+        self._ttft_gauge.set(self.ttft_ewma)
+
+    def record_success(self):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self._ok.inc()
+
+    def record_failure(self, error, counted=False):
+        """记录一次端点失败（非端点自身的问题直接忽略）；counted 表示该请求已作为成功计入（输出中途断开）"""
+        if not is_endpoint_failure(error):
+            return
+        if not counted:
+            self.requests += 1
+            self._failed.inc()
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= LLM_EJECT_FAILURES and self.healthy(time.monotonic()):
+            self.ejected_until = time.monotonic() + LLM_EJECT_COOLDOWN
+            self.ejections += 1
+            metrics.UPSTREAM_EJECTIONS.labels(self.name).inc()
+            logger.warning(
+                f"[Upstream] 端点 {self.name} 连续失败 {self.consecutive_failures} 次，摘除 {LLM_EJECT_COOLDOWN}s: {error}"
+            )
+
+    def stats(self, now):
+        p95 = self.ttft_p95()
+        return {
+            "name": self.name,
+            "model": self.model,
+            "weight": self.weight,
+            "healthy": self.healthy(now),
+            "ejected_seconds": round(max(self.ejected_until - now, 0), 1),
+            "ttft_ewma_ms": round(self.ttft_ewma * 1000, 1) if self.ttft_ewma is not None else None,
+            "ttft_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+        }
+
+
+class UpstreamPool:
+    """端点选择
+
+    - 默认选择健康端点中得分（EWMA 首 token 耗时 / 权重）最小的
+    - 以 LLM_EXPLORE_RATE 的概率按权重随机选择，避免慢端点的统计长期不更新
+    - 所有端点都被摘除时选择最早恢复的一个，不直接失败
+    """
+
+    def __init__(self, endpoints, explore_rate=LLM_EXPLORE_RATE):
+        if not endpoints:
+            raise ValueError("至少需要配置一个上游端点")
+        self.endpoints = endpoints
+        self.explore_rate = explore_rate
+        self.hedges = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+
+    @property
+    def default_model(self):
+        return self.endpoints[0].model
+
+    def select(self, exclude=()):
+        """选择端点；exclude 中的端点不参与（无可选端点时返回 None）"""
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda endpoint: endpoint.ejected_until)
+        if len(healthy) > 1 and random.random() < self.explore_rate:
+            return random.choices(healthy, weights=[endpoint.weight for endpoint in healthy])[0]
+        return min(healthy, key=Endpoint.score)
+
+    def hedge_delay(self, endpoint):
+        """对冲等待时长：该端点近期首 token 耗时 p95，样本不足时用初始值"""
+        p95 = endpoint.ttft_p95()
+        if p95 is None:
+            return LLM_HEDGE_INITIAL_DELAY
+        return max(p95, LLM_HEDGE_MIN_DELAY)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "hedging": LLM_HEDGE_ENABLED,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "hedges_skipped": self.hedges_skipped,
+            "endpoints": [endpoint.stats(now) for endpoint in self.endpoints],
+        }
+
+
+def load_endpoints(raw=OPENAI_ENDPOINTS):
+    if not raw:
+        return [Endpoint(
+            "default",
+            os.getenv("OPENAI_BASE_URL") or "",
+            os.getenv("OPENAI_API_KEY"),
+            os.getenv("OPENAI_MODEL"),
+        )]
+    endpoints = []
+    for i, item in enumerate(json.loads(raw)):
+        endpoints.append(Endpoint(
+            item.get("name") or f"endpoint-{i}",
+            item["base_url"],
+            item.get("api_key") or os.getenv("OPENAI_API_KEY"),
+            item.get("model") or os.getenv("OPENAI_MODEL"),
+            item.get("weight", 1.0),
+        ))
+    return endpoints
+
+
+upstream_pool = UpstreamPool(load_endpoints())
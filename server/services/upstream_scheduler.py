@@ -0,0 +1,268 @@
+# 上游 LLM 调用调度：全局并发上限（AIMD 自适应）、按用户公平排队、流式回复优先于选项与摘要
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from services import metrics
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# 并发上限：从 INITIAL 开始，在 [MIN, MAX] 内按上游反馈调整
+LLM_CONCURRENCY_INITIAL = int(os.getenv("LLM_CONCURRENCY_INITIAL", "16"))
+LLM_CONCURRENCY_MIN = int(os.getenv("LLM_CONCURRENCY_MIN", "2"))
+LLM_CONCURRENCY_MAX = int(os.getenv("LLM_CONCURRENCY_MAX", "64"))
+# 响应头到达耗时超过该值（秒）视为上游过载，收缩并发上限
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "5"))
+# 排队超过该时长（秒）放弃本次调用
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# Retry-After 最多暂停派发的时长（秒）
+LLM_RETRY_AFTER_MAX = float(os.getenv("LLM_RETRY_AFTER_MAX", "30"))
+
+# 优先级：数值越小越先派发
+PRIORITY_STREAM = 0
+PRIORITY_OPTIONS = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = ("stream", "options", "background")
+
+# 收缩系数：429 减半，延迟超标温和收缩
+RATE_LIMIT_BACKOFF = 0.5
+LATENCY_BACKOFF = 0.9
+# 同一批并发请求的多次过载信号只收缩一次
+DECREASE_COOLDOWN = 1.0
+
+_QUEUE_WAIT = [metrics.UPSTREAM_QUEUE_WAIT_SECONDS.labels(name) for name in PRIORITY_NAMES]
+_QUEUE_TIMEOUTS = [metrics.UPSTREAM_QUEUE_TIMEOUTS.labels(name) for name in PRIORITY_NAMES]
+
+
+class UpstreamBusy(Exception):
+    """排队超时：上游容量不足，不应立即重试"""
+
+
+def parse_retry_after(value):
+    """解析 Retry-After（秒数或 HTTP 日期），返回秒数"""
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Ticket:
+    """一次上游调用占用的并发名额；收到响应头后调用 response() 反馈上游状态"""
+
+    __slots__ = ("scheduler", "started")
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.started = time.monotonic()
+
+    def response(self, response, started=None):
+        """started 为本次请求的发出时间（对冲请求晚于名额分配），默认取名额分配时间"""
+        if response.status_code == 429:
+            self.scheduler.on_rate_limited(parse_retry_after(response.headers.get("retry-after")))
+        elif response.status_code < 500:
+            self.scheduler.on_latency(time.monotonic() - (started or self.started))
+
+
+class UpstreamScheduler:
+    """所有上游 LLM 调用的准入控制
+
+    - 进行中的调用数不超过当前并发上限，超出的按优先级排队
+    - 同一优先级内按用户轮转派发，单个用户的大量请求不会饿死其他用户
+    - 并发上限 AIMD：上限被用满且延迟正常时每轮加 1，429 减半、延迟超标乘 0.9
+    - 429 带 Retry-After 时在该时长内暂停派发新调用
+    """
+
+    def __init__(self, initial=LLM_CONCURRENCY_INITIAL, min_limit=LLM_CONCURRENCY_MIN,
+                 max_limit=LLM_CONCURRENCY_MAX, latency_target=LLM_LATENCY_TARGET,
+                 queue_timeout=LLM_QUEUE_TIMEOUT):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.latency_target = latency_target
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # 每个优先级一个 用户 -> 等待队列 的有序字典，按插入顺序轮转
+        self._queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._queued = 0
+        self._blocked_until = 0.0
+        self._wakeup = None
+        self._last_decrease = 0.0
+        self.admitted = 0
+        self.queued_total = 0
+        self.timeouts = 0
+        self.rate_limited = 0
+        self.increases = 0
+        self.decreases = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def capacity(self):
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def queued(self):
+        return self._queued
+
+    @asynccontextmanager
+    async def slot(self, user_key=None, priority=PRIORITY_STREAM):
+        """占用一个并发名额，退出时释放"""
+        await self._acquire(user_key or "anonymous", priority)
+        try:
+            yield Ticket(self)
+        finally:
+            self.release()
+
+    def try_acquire(self):
+        """有空闲名额且无人排队时立即占用一个（对冲等可有可无的调用），否则返回 None；用完调用 release()"""
+        if self._queued or not self._can_start():
+            return None
+        self.in_flight += 1
+        self.admitted += 1
+        return Ticket(self)
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    async def _acquire(self, key, priority):
+        if not self._queued and self._can_start():
+            self.in_flight += 1
+            self.admitted += 1
+            _QUEUE_WAIT[priority].observe(0)
+            return
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(key, deque()).append(future)
+        self._queued += 1
+        self.queued_total += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 名额已分配但调用方放弃了
+                self.in_flight -= 1
+                self._dispatch()
+            else:
+                self._remove(priority, key, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                _QUEUE_TIMEOUTS[priority].inc()
+                raise UpstreamBusy("服务繁忙，请稍后再试") from None
+            raise
+
+        waited = time.monotonic() - start
+        self.admitted += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        _QUEUE_WAIT[priority].observe(waited)
+
+    def _remove(self, priority, key, future):
+        queue = self._queues[priority].get(key)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self._queued -= 1
+            if not queue:
+                del self._queues[priority][key]
+
+    def _can_start(self):
+        return self.in_flight < self.capacity and time.monotonic() >= self._blocked_until
+
+    def _dispatch(self):
+        if time.monotonic() < self._blocked_until:
+            self._schedule_wakeup()
+            return
+        while self._queued and self.in_flight < self.capacity:
+            future = self._next_waiter()
+            if future.done():
+                # 已超时或被取消、还没来得及移出队列的等待者，不占用名额
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _next_waiter(self):
+        for queues in self._queues:
+            if queues:
+                key, queue = next(iter(queues.items()))
+                future = queue.popleft()
+                if queue:
+                    queues.move_to_end(key)
+                else:
+                    del queues[key]
+                self._queued -= 1
+                return future
+
+    def _schedule_wakeup(self):
+        if self._wakeup is not None:
+            return
+        delay = max(self._blocked_until - time.monotonic(), 0)
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup = None
+        self._dispatch()
+
+    # 上游反馈
+    def on_latency(self, latency):
+        if latency > self.latency_target:
+            self._decrease(LATENCY_BACKOFF)
+        elif self.in_flight + self._queued >= self.capacity and self.limit < self.max_limit:
+            # 上限被用满且延迟正常：加性增加，约每轮（limit 个调用）加 1
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+            self._dispatch()
+
+    def on_rate_limited(self, retry_after=0.0):
+        self.rate_limited += 1
+        metrics.UPSTREAM_RATE_LIMITED.inc()
+        self._decrease(RATE_LIMIT_BACKOFF)
+        if retry_after:
+            blocked_until = time.monotonic() + min(retry_after, LLM_RETRY_AFTER_MAX)
+            if blocked_until > self._blocked_until:
+                self._blocked_until = blocked_until
+                logger.warning(f"[Upstream] 上游限流，{retry_after:.1f}s 内暂停派发，并发上限 {self.capacity}")
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.decreases += 1
+
+    def stats(self):
+        return {
+            "limit": self.capacity,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "queued": self._queued,
+            "queued_by_priority": {
+                name: sum(len(queue) for queue in queues.values())
+                for name, queues in zip(PRIORITY_NAMES, self._queues)
+            },
+            "queued_users": len({key for queues in self._queues for key in queues}),
+            "blocked_seconds": round(max(self._blocked_until - time.monotonic(), 0), 2),
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "avg_wait_ms": round(self.wait_seconds / self.queued_total * 1000, 1) if self.queued_total else 0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 1),
+            "timeouts": self.timeouts,
+            "rate_limited": self.rate_limited,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+upstream_scheduler = UpstreamScheduler()
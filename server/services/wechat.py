@@ -0,0 +1,155 @@
+# 微信开放接口客户端（共享连接池 + access_token 缓存）
+import asyncio
+import logging
+import os
+import time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+WECHAT_APP_ID = os.getenv("WECHAT_APP_ID")
+WECHAT_APP_SECRET = os.getenv("WECHAT_APP_SECRET")
+# 可指向本地模拟服务进行测试
+WECHAT_API_BASE = os.getenv("WECHAT_API_BASE", "https://api.weixin.qq.com")
+WECHAT_TIMEOUT = float(os.getenv("WECHAT_TIMEOUT", "10"))
+# 距过期不足 REFRESH_AHEAD 秒时后台提前刷新；不足 EXPIRY_MARGIN 秒时视为已过期
+WECHAT_TOKEN_REFRESH_AHEAD = float(os.getenv("WECHAT_TOKEN_REFRESH_AHEAD", "300"))
+WECHAT_TOKEN_EXPIRY_MARGIN = float(os.getenv("WECHAT_TOKEN_EXPIRY_MARGIN", "60"))
+
+# access_token 无效或过期
+TOKEN_INVALID_ERRCODES = {40001, 40014, 42001}
+
+_client = None
+
+
+class WeChatError(Exception):
+    def __init__(self, errcode, errmsg):
+        super().__init__(f"{errcode}: {errmsg}")
+        self.errcode = errcode
+        self.errmsg = errmsg
+
+
+class AccessTokenError(WeChatError):
+    pass
+
+
+def init_wechat_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=WECHAT_API_BASE,
+            timeout=WECHAT_TIMEOUT,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+        )
+    return _client
+
+
+async def close_wechat_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_wechat_client():
+    return _client or init_wechat_client()
+
+
+class AccessTokenManager:
+    """缓存 access_token，过期前后台刷新，并发刷新合并为一次请求"""
+
+    def __init__(self):
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_task = None
+        self.refreshes = 0
+
+    async def get(self):
+        now = time.monotonic()
+        if self._token and now < self._expires_at - WECHAT_TOKEN_EXPIRY_MARGIN:
+            # 即将过期：返回当前 token，同时后台刷新
+            if now >= self._expires_at - WECHAT_TOKEN_REFRESH_AHEAD:
+                self._start_refresh()
+            return self._token
+        return await asyncio.shield(self._start_refresh())
+
+    def invalidate(self, token=None):
+        """微信返回 token 无效时调用"""
+        if token is None or token == self._token:
+            self._token = None
+            self._expires_at = 0.0
+
+    def _start_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(_log_refresh_error)
+        return self._refresh_task
+
+    async def _refresh(self):
+        resp = await get_wechat_client().get(
+            "/cgi-bin/token",
+            params={
+                "grant_type": "client_credential",
+                "appid": WECHAT_APP_ID,
+                "secret": WECHAT_APP_SECRET
+            }
+        )
+        data = resp.json()
+        if data.get("errcode") or not data.get("access_token"):
+            raise AccessTokenError(data.get("errcode"), data.get("errmsg"))
+
+        self.refreshes += 1
+        self._token = data["access_token"]
+        self._expires_at = time.monotonic() + data.get("expires_in", 7200)
+        return self._token
+
+    def stats(self):
+        return {
+            "cached": self._token is not None,
+            "expires_in": max(0.0, self._expires_at - time.monotonic()) if self._token else 0,
+            "refreshes": self.refreshes,
+        }
+
+
+def _log_refresh_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"[WeChat] access_token 刷新失败: {task.exception()}")
+
+
+access_token_manager = AccessTokenManager()
+
+
+async def code2session(code):
+    """小程序登录：用 code 换取 openid / session_key"""
+    resp = await get_wechat_client().get(
+        "/sns/jscode2session",
+        params={
+            "appid": WECHAT_APP_ID,
+            "secret": WECHAT_APP_SECRET,
+            "js_code": code,
+            "grant_type": "authorization_code"
+        }
+    )
+    data = resp.json()
+    if data.get("errcode"):
+        raise WeChatError(data["errcode"], data.get("errmsg"))
+    return data
+
+
+async def get_phone_number(phone_code):
+    """用手机号授权 code 换取手机号，token 失效时刷新后重试一次"""
+    for attempt in range(2):
+        access_token = await access_token_manager.get()
+        resp = await get_wechat_client().post(
+            "/wxa/business/getuserphonenumber",
+            params={"access_token": access_token},
+            json={"code": phone_code}
+        )
+        data = resp.json()
+        errcode = data.get("errcode", 0)
+        if errcode in TOKEN_INVALID_ERRCODES and attempt == 0:
+            access_token_manager.invalidate(access_token)
+            continue
+        if errcode != 0:
+            raise WeChatError(errcode, data.get("errmsg"))
+        return data.get("phone_info", {}).get("phoneNumber")
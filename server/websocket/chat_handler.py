@@ -1,269 +1,463 @@
 # WebSocket 聊天处理
 from fastapi import WebSocket
-from sqlalchemy.orm import Session
-from services.database import SessionLocal
-from models.chat_session import ChatSession
-from models.chat_message import ChatMessage
-import json
-import os
-import httpx
+from sqlalchemy import select
+from services.llm_client import OPENAI_MODEL, stream_chat_completion, create_chat_completion
+from services.context_builder import context_builder, count_tokens
+from services.message_writer import message_writer
+from services.sse import iter_deltas
+from services.frame_coalescer import FrameCoalescer
+from services.options_cache import options_cache, options_key
+from services.coordination import coordinator
+from services.turn_stream import turn_streams
+from services.upstream_scheduler import UpstreamBusy
+from services.retry_policy import (
+    STREAM_MAX_RETRIES, OverlapTrimmer, retry_budget, backoff_delay, continuation_messages, is_retryable
+)
+from services.json_codec import Fragment, loads, send_frame as send_ws_frame
+from services.database import AsyncSessionLocal
+from services import metrics
+from models.user import User
+import asyncio
 import logging
+import os
+import time
 import uuid
 
 logger = logging.getLogger(__name__)
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL")
+# 选项生成使用的模型（计入缓存键）
+OPTIONS_MODEL = OPENAI_MODEL
+
+# 热路径上使用的指标子项预先绑定标签
+_TURNS_OK = metrics.CHAT_TURNS.labels("ok")
+_TURNS_FAILED = metrics.CHAT_TURNS.labels("failed")
+_OPTIONS_FROM_CACHE = metrics.OPTIONS_SECONDS.labels("cache")
+_OPTIONS_FROM_MODEL = metrics.OPTIONS_SECONDS.labels("model")
+_RETRY_FIRST_TOKEN = metrics.UPSTREAM_RETRIES.labels("first_token")
+_RETRY_CONTINUE = metrics.UPSTREAM_RETRIES.labels("continue")
+
+# 每个用户每分钟最多发起的对话轮数，0 表示不限制
+CHAT_RATE_LIMIT_PER_MINUTE = int(os.getenv("CHAT_RATE_LIMIT_PER_MINUTE", "0"))
+# 上一轮已发出 done、正在落库并释放流归属时，新一轮最多等待的时长（秒）
+STREAM_RELEASE_WAIT = float(os.getenv("STREAM_RELEASE_WAIT", "5"))
+
+SYSTEM_PROMPT = "你是一位经验丰富的高管教练，专注于引导式对话而非直接给出答案。你的核心方法是通过提问帮助对方自己找到解决方案。你擅长倾听、提问和反思，帮助高管明确目标、识别障碍、探索可能性。保持专业、同理心和启发性。"
+# 每轮请求都相同的系统消息只编码一次
+SYSTEM_MESSAGE = Fragment(role="system", content=SYSTEM_PROMPT)
+_OPTIONS_SYSTEM_MESSAGE = Fragment(role="system", content="你是一位经验丰富的高管教练，专注于引导式对话而非直接给出答案。")
 
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     user_id = websocket.query_params.get("user_id")
-    db = SessionLocal()
+    # 会话和消息异步落库，用户不存在时写入必然失败：连接时拒绝，而不是接收注定丢失的消息
+    if not await _user_exists(user_id):
+        await send_ws_frame(websocket, {
+            "type": "error",
+            "error": "无效的用户",
+            "final": True
+        })
+        await websocket.close(code=1008)
+        return
+
+    metrics.WS_CONNECTIONS.inc()
+    metrics.WS_CONNECTIONS_TOTAL.inc()
+    # 当前连接订阅的输出（本轮结束后继续接收选项帧）
+    subscriber = None
 
     try:
         while True:
             data = await websocket.receive_text()
-            msg = json.loads(data)
+            msg = loads(data)
 
             # 忽略心跳消息
             if msg.get("type") == "ping":
                 continue
 
-            user_message = msg.get("message")
-            tool_type = msg.get("toolType", "free_chat")
-            session_id = msg.get("sessionId")
-
-            # 创建或获取会话
-            if not session_id:
-                session = ChatSession(user_id=user_id, tool_type=tool_type)
-                db.add(session)
-                db.commit()
-                db.refresh(session)
-                session_id = str(session.id)
-
-                await websocket.send_json({
-                    "type": "session",
-                    "sessionId": session_id
+            if subscriber is not None:
+                subscriber.close()
+                subscriber = None
+
+            # 重连后从最后收到的 seq 接续输出（本地缓冲区或其他 worker 转发）
+            if msg.get("type") == "resume":
+                subscriber = await _resume(websocket, msg)
+                if subscriber is not None:
+                    await subscriber.turn_ended()
+                continue
+
+            # 同一用户的对话频率限制（多 worker 共享计数）
+            if CHAT_RATE_LIMIT_PER_MINUTE and not await coordinator.hit(
+                f"chat:{user_id}", CHAT_RATE_LIMIT_PER_MINUTE, 60
+            ):
+                await send_ws_frame(websocket, {
+                    "type": "error",
+                    "error": "请求过于频繁，请稍后再试",
+                    "final": True
                 })
+                continue
 
-            # 刷新数据库会话，确保获取最新数据
-            db.expire_all()
-
-            # 查询历史消息（最近5轮对话 = 10条消息）
-            history = db.query(ChatMessage).filter(
-                ChatMessage.session_id == session_id
-            ).order_by(ChatMessage.created_at.desc()).limit(10).all()
-
-            # 反转顺序（从旧到新）
-            history.reverse()
-
-            # 构建消息列表（系统提示词 + 历史对话 + 当前用户消息）
-            messages = [
-                {
-                    "role": "system",
-                    "content": "你是一位经验丰富的高管教练，专注于引导式对话而非直接给出答案。你的核心方法是通过提问帮助对方自己找到解决方案。你擅长倾听、提问和反思，帮助高管明确目标、识别障碍、探索可能性。保持专业、同理心和启发性。"
-                }
-            ]
-
-            # 添加历史消息
-            for h in history:
-                messages.append({"role": h.role, "content": h.content})
-
-            # 添加当前用户消息
-            messages.append({"role": "user", "content": user_message})
-
-            # 保存用户消息到数据库
-            user_msg = ChatMessage(
-                session_id=session_id,
-                role="user",
-                content=user_message
-            )
-            db.add(user_msg)
-            db.commit()
-
-            # 调用 AI API（流式，带重试）
-            max_retries = 2
-            retry_count = 0
-            assistant_content = ""
-            headers = {
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json"
-            }
-            completion_url = f"{OPENAI_BASE_URL}/chat/completions"
-
-            async with httpx.AsyncClient() as client:
-                while retry_count <= max_retries:
-                    try:
-                        async with client.stream(
-                            "POST",
-                            completion_url,
-                            headers=headers,
-                            json={
-                                "model": OPENAI_MODEL,
-                                "messages": messages,
-                                "stream": True
-                            },
-                            timeout=60.0
-                        ) as response:
-                            buffer = ""
-                            stream_done = False
-                            async for chunk_bytes in response.aiter_bytes():
-                                buffer += chunk_bytes.decode("utf-8", errors="ignore")
-                                while "\n\n" in buffer:
-                                    event, buffer = buffer.split("\n\n", 1)
-                                    if not event.strip():
-                                        continue
-                                    for line in event.split("\n"):
-                                        if not line.startswith("data: "):
-                                            continue
-                                        chunk_data = line[6:]
-                                        if chunk_data == "[DONE]":
-                                            stream_done = True
-                                            break
-                                        try:
-                                            chunk = json.loads(chunk_data)
-                                            delta = chunk["choices"][0]["delta"].get("content", "")
-                                            if delta:
-                                                assistant_content += delta
-                                                await websocket.send_json({
-                                                    "type": "chunk",
-                                                    "content": delta
-                                                })
-                                        except:
-                                            pass
-                                    if stream_done:
-                                        break
-                                if stream_done:
-                                    break
-                        break
-                    except Exception as e:
-                        retry_count += 1
-                        if retry_count > max_retries:
-                            raise e
-                        await websocket.send_json({
-                            "type": "error",
-                            "error": f"请求失败，正在重试 ({retry_count}/{max_retries})..."
-                        })
-
-                # 生成并发送智能选项
-                await generate_and_send_options(
-                    client=client,
-                    websocket=websocket,
-                    headers=headers,
-                    history_messages=history,
-                    user_message=user_message,
-                    assistant_response=assistant_content,
-                    completion_url=completion_url
-                )
-
-            # 保存 AI 回复
-            assistant_msg = ChatMessage(
-                session_id=session_id,
-                role="assistant",
-                content=assistant_content
-            )
-            db.add(assistant_msg)
-            db.commit()
-
-            # 发送完成信号
-            await websocket.send_json({
-                "type": "done",
-                "sessionId": session_id
-            })
+            subscriber = await _run_turn(websocket, user_id, msg)
+            if subscriber is not None:
+                await subscriber.turn_ended()
 
     except Exception as e:
         logger.error(f"[WebSocket] 异常: {e}", exc_info=True)
         try:
-            await websocket.send_json({
+            await send_ws_frame(websocket, {
                 "type": "error",
-                "error": str(e)
+                "error": str(e),
+                "final": True
             })
         except:
             pass
     finally:
-        db.close()
+        metrics.WS_CONNECTIONS.dec()
+        # 只断开订阅：上游输出在后台继续并保存，客户端可在 grace 期内重连续传
+        if subscriber is not None:
+            subscriber.close()
+
+
+async def _user_exists(user_id):
+    """连接参数中的 user_id 是否为已存在用户的 ID"""
+    try:
+        user_uuid = uuid.UUID(user_id)
+    except (TypeError, ValueError):
+        return False
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(User.id).where(User.id == user_uuid)) is not None
+
+
+async def _run_turn(websocket, user_id, msg):
+    """开始一轮对话，返回当前连接的订阅（未能开始时返回 None）
+
+    上游输出在后台任务中进行，不随连接断开而中止。
+    """
+    turn_start = time.perf_counter()
+    timings = {}
+
+    tool_type = msg.get("toolType", "free_chat")
+    session_id = msg.get("sessionId")
+
+    # 创建或获取会话（异步批量落库，会话 ID 立即可用）
+    if not session_id:
+        session_id = str(uuid.uuid4())
+        await message_writer.add_session(session_id, user_id, tool_type)
+        context_builder.new_session(session_id)
+
+        await send_ws_frame(websocket, {
+            "type": "session",
+            "sessionId": session_id
+        })
+    elif await coordinator.session_stale(session_id):
+        # 上一轮由其他 worker 处理，本地缓存的历史已过期
+        context_builder.discard(session_id)
+
+    previous = turn_streams.get(session_id)
+    if previous is not None and previous.finished.is_set() and not previous.task.done():
+        # 上一轮已结束，正在等待消息落库后释放归属：等它完成，而不是拒绝紧接着发来的消息
+        await asyncio.wait({previous.task}, timeout=STREAM_RELEASE_WAIT)
+
+    # 同一会话同时只允许一个连接生成回复
+    lease = coordinator.stream_lease(session_id)
+    if not await lease.acquire():
+        await send_ws_frame(websocket, {
+            "type": "error",
+            "error": "该会话正在生成回复，请稍后再试",
+            "final": True
+        })
+        return None
+
+    if previous is not None:
+        # 上一轮尚未推送的选项不再需要
+        previous.cancel_options()
+
+    async def run(stream):
+        try:
+            await _stream_turn(stream, user_id, session_id, msg, turn_start, timings)
+        except Exception as e:
+            _TURNS_FAILED.inc()
+            logger.error(f"[WebSocket] 会话 {session_id} 本轮失败: {e}", exc_info=True)
+            await stream.emit({"type": "error", "error": str(e), "final": True})
+        finally:
+            if coordinator.shared:
+                # 本轮消息落库后再释放归属，其他 worker 随后能从数据库读到完整历史
+                await message_writer.sync(session_id)
+                await coordinator.bump_session(session_id)
+            await lease.release()
+
+    stream = turn_streams.start(session_id, run, lease.turn)
+    return stream.attach(websocket.send_text)
+
+
+async def _stream_turn(stream, user_id, session_id, msg, turn_start, timings):
+    """调用模型流式输出本轮回复；帧写入 stream，由订阅的连接发送给客户端"""
+    user_message = msg.get("message")
+    tool_type = msg.get("toolType", "free_chat")
+    send_frame = stream.emit
+
+    # 构建消息列表（系统提示词 + 摘要 + 预算内的历史对话 + 当前用户消息）
+    context = await context_builder.build(session_id, SYSTEM_MESSAGE, user_message)
+    messages = context.messages
+    history = context.history
+
+    # 保存用户消息（入队，后台批量写入）
+    await message_writer.add_message(session_id, "user", user_message)
+    context_builder.append(session_id, "user", user_message)
+
+    timings["prepare_ms"] = _elapsed_ms(turn_start)
+
+    # 调用 AI API（流式，带重试）
+    attempt = 0
+    assistant_parts = []
+    request_messages = messages
+    stream_start = time.perf_counter()
+    # 增量按时间窗口合并为较少的 chunk 帧
+    coalescer = FrameCoalescer(send_frame)
+    retry_budget.record_request()
 
+    while True:
+        # 中途失败后的续写：开头与已输出内容重复的部分不再发送
+        trimmer = OverlapTrimmer("".join(assistant_parts)) if assistant_parts else None
+        try:
+            async with stream_chat_completion({
+                "model": OPENAI_MODEL,
+                "messages": request_messages,
+                "stream": True
+            }, user_key=user_id) as response:
+                async for delta in iter_deltas(response.aiter_bytes()):
+                    if trimmer is not None:
+                        delta = trimmer.feed(delta)
+                        if not delta:
+                            continue
+                    if "first_token_ms" not in timings:
+                        timings["first_token_ms"] = _elapsed_ms(stream_start)
+                    assistant_parts.append(delta)
+                    await coalescer.add(delta)
+                if trimmer is not None:
+                    rest = trimmer.flush()
+                    if rest:
+                        assistant_parts.append(rest)
+                        await coalescer.add(rest)
+            break
+        except Exception as e:
+            attempt += 1
+            metrics.UPSTREAM_ERRORS.labels(type(e).__name__).inc()
+            # 已收到的增量先发给前端，续写从这里接上
+            await coalescer.flush()
+            # 排队超时说明上游容量不足；请求错误重试无效；预算耗尽时不再重试，避免放大上游故障
+            if (attempt > STREAM_MAX_RETRIES or isinstance(e, UpstreamBusy) or not is_retryable(e)
+                    or not retry_budget.try_spend()):
+                if assistant_parts:
+                    # 已输出的部分回复照常保存，用户重连后可以看到
+                    partial = "".join(assistant_parts)
+                    await message_writer.add_message(session_id, "assistant", partial)
+                    context_builder.append(session_id, "assistant", partial)
+                raise e
+
+            if assistant_parts:
+                # 中途失败：带上已输出的部分请求续写，而不是重新生成
+                request_messages = continuation_messages(messages, "".join(assistant_parts))
+                _RETRY_CONTINUE.inc()
+                delay = backoff_delay(attempt)
+                notice = f"连接中断，正在继续生成 ({attempt}/{STREAM_MAX_RETRIES})..."
+            else:
+                # 首个 token 之前失败：第一次立即重试，之后退避
+                _RETRY_FIRST_TOKEN.inc()
+                delay = backoff_delay(attempt) if attempt > 1 else 0
+                notice = f"请求失败，正在重试 ({attempt}/{STREAM_MAX_RETRIES})..."
+            logger.warning(f"[WebSocket] 会话 {session_id} 上游失败，{delay:.2f}s 后第 {attempt} 次重试: {e}")
+            await send_frame({
+                "type": "error",
+                "error": notice
+            })
+            if delay:
+                await asyncio.sleep(delay)
+
+    await coalescer.close()
+    assistant_content = "".join(assistant_parts)
+    timings["stream_ms"] = _elapsed_ms(stream_start)
+    _observe_stream(timings, assistant_content, context.prompt_tokens)
+
+    # 智能选项在后台并发生成，不阻塞本轮完成；done 发出后再推送给前端
+    done_sent = asyncio.Event()
+    stream.options_task = asyncio.create_task(generate_and_send_options(
+        send_json=send_frame,
+        user_id=user_id,
+        history_messages=history,
+        user_message=user_message,
+        assistant_response=assistant_content,
+        done_sent=done_sent,
+        tool_type=tool_type
+    ))
+
+    # 保存 AI 回复（入队，后台批量写入；与客户端是否仍在连接无关）
+    persist_start = time.perf_counter()
+    await message_writer.add_message(session_id, "assistant", assistant_content)
+    context_builder.append(session_id, "assistant", assistant_content)
+    timings["persist_ms"] = _elapsed_ms(persist_start)
+    timings["total_ms"] = _elapsed_ms(turn_start)
+
+    # 发送完成信号
+    await send_frame({
+        "type": "done",
+        "sessionId": session_id,
+        "timings": timings,
+        "usage": context.usage()
+    })
+    done_sent.set()
+    _TURNS_OK.inc()
+    logger.info(f"[WebSocket] 会话 {session_id} 本轮耗时: {timings} 用量: {context.usage()}")
+
+    # 超出预算的旧消息在后台合并进会话摘要
+    context_builder.refresh_summary(context)
 
-async def generate_and_send_options(client, websocket, headers, history_messages, user_message, assistant_response, completion_url):
-    """生成并发送智能选项"""
+
+async def _resume(websocket, msg):
+    """客户端重连后接续输出
+
+    - 本 worker 的缓冲区中有该会话：补发 seq 大于 lastSeq 的帧后继续订阅，返回订阅
+    - 输出在其他 worker 上：按共享快照补发 lastSeq 之后的内容，再转发后续帧直到 done
+    - 都没有：返回 streaming=False，客户端从 REST 接口读取已保存的消息
+    """
+    session_id = msg.get("sessionId")
+    try:
+        last_seq = int(msg.get("lastSeq") or 0)
+    except (TypeError, ValueError):
+        last_seq = 0
+
+    stream = turn_streams.get(session_id) if session_id else None
+    if stream is not None:
+        return stream.attach(websocket.send_text, last_seq, preface={
+            "type": "resumed",
+            "sessionId": session_id,
+            # 之后还会补发到本轮结束帧时为 True，客户端据此决定是否立即结束本轮
+            "streaming": stream.delivers_end(last_seq),
+            "lastSeq": stream.seq
+        })
+
+    streaming = bool(session_id) and await coordinator.stream_owner(session_id) is not None
+    await send_ws_frame(websocket, {
+        "type": "resumed",
+        "sessionId": session_id,
+        "streaming": streaming
+    })
+    metrics.STREAM_RESUMES.labels("relay" if streaming else "none").inc()
+    if streaming:
+        await coordinator.relay_frames(session_id, lambda frame: send_ws_frame(websocket, frame), last_seq)
+    return None
+
+
+def _elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def _observe_stream(timings, assistant_content, prompt_tokens):
+    """每轮结束后记录一次流式指标，流式循环内不做额外统计"""
+    stream_seconds = timings["stream_ms"] / 1000
+    if "first_token_ms" in timings:
+        metrics.CHAT_TTFT_SECONDS.observe(timings["first_token_ms"] / 1000)
+    metrics.CHAT_STREAM_SECONDS.observe(stream_seconds)
+    metrics.CHAT_PROMPT_TOKENS.observe(prompt_tokens)
+    completion_tokens = count_tokens(assistant_content)
+    metrics.CHAT_COMPLETION_TOKENS.inc(completion_tokens)
+    if stream_seconds > 0 and completion_tokens:
+        metrics.CHAT_TOKENS_PER_SECOND.observe(completion_tokens / stream_seconds)
+
+
+async def generate_and_send_options(send_json, user_id, history_messages, user_message, assistant_response,
+                                    done_sent=None, tool_type="free_chat"):
+    """生成并发送智能选项（相同对话状态命中缓存时不再调用模型）"""
+    options_start = time.perf_counter()
     try:
         # 构建对话历史文本
         history_lines = []
-        for record in history_messages:
-            role_label = "用户" if record.role == "user" else "AI"
-            history_lines.append(f"{role_label}: {record.content}")
+        for role, content in history_messages:
+            role_label = "用户" if role == "user" else "AI"
+            history_lines.append(f"{role_label}: {content}")
         if user_message:
             history_lines.append(f"用户: {user_message}")
         if assistant_response:
             history_lines.append(f"AI: {assistant_response}")
-        history_text = "\n".join(history_lines)
-
-        # 选项生成提示词
-        options_prompt = (
-            "基于以下对话历史，生成 3-5 个引导式选项供用户选择。选项应该是开放性的问题或下一步建议，帮助用户深入思考。"
-            "请以 JSON 数组格式返回，每个选项包含 label（简短显示文字，不超过20个字）和 value（完整实际值）字段。"
-            "重要：label 必须简短精炼，适合作为按钮文字显示。"
-            "示例格式：[{\"label\": \"分析团队协作\", \"value\": \"我想深入分析一下团队协作方面的问题\"}]"
-        )
-
-        # 构建请求负载
-        payload = {
-            "model": OPENAI_MODEL,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "你是一位经验丰富的高管教练，专注于引导式对话而非直接给出答案。"
-                },
-                {
-                    "role": "user",
-                    "content": f"{options_prompt}\n\n对话历史：\n{history_text}"
-                }
-            ],
-            "stream": False
-        }
-
-        # 调用 AI API（非流式）
-        response = await client.post(
-            completion_url,
-            headers=headers,
-            json=payload,
-            timeout=60.0
-        )
-        response.raise_for_status()
-        result = response.json()
-
-        # 提取内容
-        content = (
-            result.get("choices", [{}])[0]
-            .get("message", {})
-            .get("content", "")
-        )
-
-        # 解析 JSON 数组
-        parsed_options = json.loads(content)
-        if not isinstance(parsed_options, list):
-            return
-
-        # 格式化选项（添加唯一 ID）
-        formatted_options = []
-        for option in parsed_options:
-            label = option.get("label")
-            value = option.get("value")
-            if not label or not value:
-                continue
-            formatted_options.append({
-                "id": str(uuid.uuid4()),
-                "label": label,
-                "value": value
-            })
 
-        # 发送选项到前端
+        cache_key = None
+        option_pairs = None
+        if options_cache.is_enabled(tool_type):
+            cache_key = options_key(OPTIONS_MODEL, history_lines)
+            option_pairs = options_cache.get(cache_key)
+        else:
+            options_cache.bypass()
+
+        cached = option_pairs is not None
+        if not cached:
+            option_pairs = await _request_options("\n".join(history_lines), user_id)
+            if option_pairs and cache_key is not None:
+                options_cache.put(cache_key, option_pairs)
+
+        # 格式化选项（添加唯一 ID，缓存命中时同样重新生成）
+        formatted_options = [
+            {"id": str(uuid.uuid4()), "label": label, "value": value}
+            for label, value in option_pairs
+        ]
+
+        # 发送选项到前端（保证在本轮 done 之后）
         if formatted_options:
-            await websocket.send_json({
+            if done_sent is not None:
+                await done_sent.wait()
+            await send_json({
                 "type": "options",
                 "options": formatted_options
             })
+        options_seconds = time.perf_counter() - options_start
+        (_OPTIONS_FROM_CACHE if cached else _OPTIONS_FROM_MODEL).observe(options_seconds)
+        cache_state = "命中缓存" if cached else "调用模型"
+        logger.info(f"[WebSocket] 选项生成耗时: {_elapsed_ms(options_start)}ms（{cache_state}）")
     except Exception as e:
         # 静默失败，不影响正常对话流程
         logger.warning(f"选项生成失败: {e}")
+
+
+async def _request_options(history_text, user_id=None):
+    """调用模型生成选项，返回 [(label, value), ...]"""
+    # 选项生成提示词
+    options_prompt = (
+        "基于以下对话历史，生成 3-5 个引导式选项供用户选择。选项应该是开放性的问题或下一步建议，帮助用户深入思考。"
+        "请以 JSON 数组格式返回，每个选项包含 label（简短显示文字，不超过20个字）和 value（完整实际值）字段。"
+        "重要：label 必须简短精炼，适合作为按钮文字显示。"
+        "示例格式：[{\"label\": \"分析团队协作\", \"value\": \"我想深入分析一下团队协作方面的问题\"}]"
+    )
+
+    # 构建请求负载
+    payload = {
+        "model": OPTIONS_MODEL,
+        "messages": [
+            _OPTIONS_SYSTEM_MESSAGE,
+            {
+                "role": "user",
+                "content": f"{options_prompt}\n\n对话历史：\n{history_text}"
+            }
+        ],
+        "stream": False
+    }
+
+    # 调用 AI API（非流式）
+    result = await create_chat_completion(payload, user_key=user_id)
+
+    # 提取内容
+    content = (
+        result.get("choices", [{}])[0]
+        .get("message", {})
+        .get("content", "")
+    )
+
+    # 解析 JSON 数组
+    parsed_options = loads(content)
+    if not isinstance(parsed_options, list):
+        return []
+
+    option_pairs = []
+    for option in parsed_options:
+        label = option.get("label")
+        value = option.get("value")
+        if not label or not value:
+            continue
+        option_pairs.append((label, value))
+    return option_pairs
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试多 worker 协调：两个 Coordinator 共用一个共享的内存后端，模拟两个 worker
+
+覆盖流归属互斥与过期、跨 worker 转发帧、会话版本、用户余额版本、共享计数与频率限制。无需数据库与 Redis。
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+from services import coordination
+from services.coordination import Coordinator, MemoryBackend
+
+
+async def main():
+    backend = MemoryBackend(shared=True)
+    worker_a = Coordinator(backend, worker_id="worker-a")
+    worker_b = Coordinator(backend, worker_id="worker-b")
+    session_id = "session-1"
+
+    # 1. 同一会话的流归属互斥
+    lease = worker_a.stream_lease(session_id)
+    assert await lease.acquire()
+    assert not await worker_b.claim_stream(session_id)
+    assert await worker_b.stream_owner(session_id) == "worker-a"
+    assert not await worker_b.release_stream(session_id), "不能释放其他 worker 的归属"
+    print("✅ 流归属互斥")
+
+    # 2. 重连到 worker B 的客户端：已输出的部分以快照补发，之后转发 worker A 的新帧
+    received = []
+
+    async def send_json(frame):
+        received.append(frame)
+
+    def publish(seq, frame, **kwargs):
+        frame["seq"] = seq
+        worker_a.publish_frame(session_id, kwargs.pop("turn", lease.turn), seq, frame, content=frame.get("content", ""),
+                               ended=frame["type"] == "done", **kwargs)
+
+    publish(1, {"type": "chunk", "content": "你好"})
+    publish(2, {"type": "chunk", "content": "，"})
+    await asyncio.sleep(0.01)
+    relay = asyncio.create_task(worker_b.relay_frames(session_id, send_json, last_seq=1))
+    await asyncio.sleep(0.01)
+    publish(3, {"type": "chunk", "content": "！"})
+    publish(4, {"type": "done"})
+    assert await asyncio.wait_for(relay, 1) is True
+    assert received == [
+        {"type": "snapshot", "content": "你好，", "seq": 2, "turn": lease.turn},
+        {"type": "chunk", "content": "！", "seq": 3},
+        {"type": "done", "seq": 4},
+    ], received
+    print(f"✅ 跨 worker 续传：快照补发后转发 {len(received)} 帧")
+
+    # 2.1 本轮已结束后才重连：直接补发快照与结束帧
+    received.clear()
+    assert await asyncio.wait_for(worker_b.relay_frames(session_id, send_json, last_seq=3), 1) is True
+    assert received == [{"type": "done", "seq": 4}], received
+    print("✅ 本轮已结束时补发结束帧")
+
+    # 2.2 新一轮开始后，上一轮延迟发布的帧不会写入快照
+    await lease.release()
+    previous_turn, lease = lease.turn, worker_a.stream_lease(session_id)
+    assert await lease.acquire()
+    publish(5, {"type": "options", "options": []}, turn=previous_turn)
+    await asyncio.sleep(0.01)
+    received.clear()
+    relay = asyncio.create_task(worker_b.relay_frames(session_id, send_json))
+    await asyncio.sleep(0.01)
+    assert not relay.done() and received == [], received
+    relay.cancel()
+    print("✅ 新一轮不读取上一轮的快照与延迟帧")
+
+    # 2.3 发布队列满时丢帧：下一帧写入完整快照，转发方发现序号不连续后重新同步
+    received.clear()
+    coordination.COORDINATION_PUBLISH_QUEUE, queue_size = 2, coordination.COORDINATION_PUBLISH_QUEUE
+    worker_a._publisher.cancel()
+    worker_a._publisher = None
+    content = []
+    publish(1, {"type": "chunk", "content": "a"})
+    await asyncio.sleep(0.01)
+    relay = asyncio.create_task(worker_b.relay_frames(session_id, send_json))
+    await asyncio.sleep(0.01)
+    for seq, piece in enumerate("bcde", 2):
+        content.append(piece)
+        publish(seq, {"type": "chunk", "content": piece}, snapshot=lambda: "a" + "".join(content))
+    assert worker_a.dropped_frames == 2
+    await asyncio.sleep(0.01)
+    publish(6, {"type": "chunk", "content": "f"}, snapshot=lambda: "abcdef")
+    publish(7, {"type": "done"})
+    assert await asyncio.wait_for(relay, 1) is True
+    assert received[-2:] == [{"type": "snapshot", "content": "abcdef", "seq": 6, "turn": lease.turn}, {"type": "done", "seq": 7}], received
+    assert worker_b.resyncs == 1
+    coordination.COORDINATION_PUBLISH_QUEUE = queue_size
+    print(f"✅ 丢帧后按快照重新同步: {received}")
+
+    # 2.4 共享存储慢或出错时发布不阻塞调用方，也不抛出异常
+    append_stream = backend.append_stream
+
+    async def failing(*args):
+        await asyncio.sleep(0.05)
+        raise ConnectionError("redis down")
+
+    backend.append_stream = failing
+    start = time.perf_counter()
+    for seq in range(1, 11):
+        publish(seq, {"type": "chunk", "content": "x"})
+    assert time.perf_counter() - start < 0.01
+    await asyncio.sleep(0.1)
+    assert worker_a.publish_errors >= 1
+    backend.append_stream = append_stream
+    print(f"✅ 发布失败只记录: {worker_a.stats()['publish_errors']} 次")
+
+    # 3. 释放后其他 worker 可以接手
+    await lease.release()
+    assert await worker_b.stream_owner(session_id) is None
+    assert await worker_b.claim_stream(session_id)
+    await worker_b.release_stream(session_id)
+    print("✅ 释放后可被其他 worker 获取")
+
+    # 4. 持有方异常退出：租约过期后自动释放，转发结束
+    coordination.STREAM_OWNER_TTL = 0.2
+    assert await worker_a.claim_stream(session_id)
+    result = await asyncio.wait_for(worker_b.relay_frames(session_id, send_json, idle_timeout=0.1), 2)
+    assert result is False
+    assert await worker_b.claim_stream(session_id)
+    print("✅ 租约过期后转发结束并可重新获取")
+
+    # 5. 会话版本：worker A 处理一轮后，worker B 的缓存视为过期
+    await worker_b.bump_session(session_id)
+    assert not await worker_b.session_stale(session_id)
+    await worker_a.bump_session(session_id)
+    assert await worker_b.session_stale(session_id)
+    assert not await worker_b.session_stale(session_id)
+    print("✅ 会话版本检测")
+
+    # 6. 共享计数：两个 worker 并发递增结果精确
+    results = await asyncio.gather(*[
+        (worker_a if i % 2 else worker_b).incr("quota:daily:u1", ttl=60, initial=3)
+        for i in range(100)
+    ])
+    assert sorted(results) == list(range(4, 104)), results
+    assert await worker_a.get_counter("quota:daily:u1") == 103
+    print("✅ 共享计数精确")
+
+    # 7. 频率限制跨 worker 累计
+    allowed = [await (worker_a if i % 2 else worker_b).hit("chat:u1", 5, 60) for i in range(8)]
+    assert allowed.count(True) == 5, allowed
+    print("✅ 频率限制跨 worker 共享")
+
+    # 8. 用户余额版本：worker A 修改余额后，worker B 读到新的版本号
+    assert await worker_b.user_version("u1") is None
+    await worker_a.bump_user("u1")
+    first = await worker_b.user_version("u1")
+    await worker_a.bump_user("u1")
+    assert first is not None and await worker_b.user_version("u1") != first
+    print("✅ 用户余额版本跨 worker 可见")
+
+    print(f"\n统计: {worker_a.stats()} {worker_b.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试数据库连接池：启动预热、池满时排队与超时、取连接耗时统计
+
+需要可用的 DATABASE_URL（读取项目根目录 .env），无需启动服务。
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+os.environ["DB_POOL_SIZE"] = "3"
+os.environ["DB_MAX_OVERFLOW"] = "1"
+os.environ["DB_POOL_TIMEOUT"] = "0.5"
+os.environ.setdefault("DB_PGBOUNCER", "false")
+
+from dotenv import load_dotenv  # noqa: E402
+load_dotenv("../.env")
+
+from sqlalchemy import exc, text  # noqa: E402
+from services import metrics  # noqa: E402
+from services.database import async_engine, pool_stats, warm_pool  # noqa: E402
+
+
+async def hold(seconds):
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+        await asyncio.sleep(seconds)
+
+
+async def main():
+    try:
+        # 1. 预热后池中常驻 SIZE 个空闲连接
+        assert await warm_pool() == 3
+        stats = pool_stats()
+        assert stats["checked_in"] == 3 and stats["checked_out"] == 0, stats
+        print(f"✅ 连接池预热: {stats}")
+
+        # 2. 预热的连接被复用，取连接不需要新建
+        before = metrics.DB_POOL_CHECKOUT_SECONDS._default.count
+        await asyncio.gather(*(hold(0) for _ in range(3)))
+        assert pool_stats()["checked_in"] == 3
+        assert metrics.DB_POOL_CHECKOUT_SECONDS._default.count - before == 3
+        print("✅ 复用预热连接，记录取连接耗时")
+
+        # 3. SIZE + MAX_OVERFLOW 个连接都被占用时，后续请求等待 TIMEOUT 后超时
+        holders = [asyncio.create_task(hold(1.0)) for _ in range(4)]
+        await asyncio.sleep(0.2)
+        assert pool_stats()["utilization"] == 1.0, pool_stats()
+        try:
+            await hold(0)
+            raise AssertionError("池满时应超时")
+        except exc.TimeoutError:
+            pass
+        assert metrics.DB_POOL_TIMEOUTS._default.value == 1
+        await asyncio.gather(*holders)
+        print("✅ 池满时取连接超时并计数")
+
+        # 4. 占用的连接释放后恢复
+        await hold(0)
+        print(f"✅ 连接释放后恢复: {pool_stats()}")
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试消息写入队列的失败处理：数据库不可用时持续重试不丢数据，只丢弃自身写不进去的行
+
+无需数据库（替换实际写入）。
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+os.environ.setdefault("DATABASE_URL", "postgresql://postgres@localhost:5432/unused")
+os.environ["MESSAGE_RETRY_BACKOFF_MAX"] = "0.01"
+
+from sqlalchemy import exc  # noqa: E402
+from services.message_writer import MessageWriter  # noqa: E402
+
+
+class FakeWriter(MessageWriter):
+    """前 outage 次写入模拟数据库不可用；内容为 bad 的消息违反约束"""
+
+    def __init__(self, outage=0):
+        super().__init__(flush_interval=0.01)
+        self.outage = outage
+        self.rows = []
+
+    async def _write(self, items):
+        if self.outage:
+            self.outage -= 1
+            raise exc.OperationalError("INSERT", {}, ConnectionRefusedError("connection refused"))
+        if any(row.get("content") == "bad" for _, _, row in items):
+            raise exc.IntegrityError("INSERT", {}, Exception("violates check constraint"))
+        self.rows.extend(row for _, _, row in items)
+
+
+async def main():
+    # 1. 数据库短暂不可用：持续重试，恢复后全部写入
+    writer = FakeWriter(outage=20)
+    for i in range(5):
+        await writer.add_message("s1", "user", f"m{i}")
+    await writer.sync("s1")
+    assert [row["content"] for row in writer.rows] == [f"m{i}" for i in range(5)]
+    assert writer.failed == 0 and writer.retries == 20, writer.stats()
+    await writer.stop()
+    print(f"✅ 数据库不可用期间不丢数据: {writer.stats()}")
+
+    # 2. 批量中有违反约束的行：只丢弃该行，其余正常写入
+    writer = FakeWriter()
+    for content in ("a", "bad", "b"):
+        await writer.add_message("s2", "user", content)
+    await writer.sync("s2")
+    assert [row["content"] for row in writer.rows] == ["a", "b"] and writer.failed == 1, writer.stats()
+    await writer.stop()
+    print("✅ 只丢弃自身写不进去的行")
+
+    # 3. 逐条写入时数据库再次不可用：继续重试，不丢弃
+    writer = FakeWriter()
+    for content in ("c", "bad", "d"):
+        await writer.add_message("s3", "user", content)
+    writer.outage = 0
+    original = writer._write
+
+    async def flaky(items):
+        if len(items) == 1 and items[0][2]["content"] == "d" and not writer.retries:
+            writer.outage = 3
+        return await original(items)
+
+    writer._write = flaky
+    await writer.sync("s3")
+    assert [row["content"] for row in writer.rows] == ["c", "d"] and writer.failed == 1, writer.stats()
+    await writer.stop()
+    print("✅ 逐条写入时遇到连接错误继续重试")
+
+    # 4. 数据库持续不可用时停止不会无限等待
+    writer = FakeWriter(outage=10 ** 6)
+    await writer.add_message("s4", "user", "lost")
+    await writer.stop(timeout=0.2)
+    print("✅ 停止超时")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试流式回复的重试策略：续写去重、退避上限、进程级重试预算
+
+无需数据库与上游服务。
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+from services.retry_policy import (
+    OverlapTrimmer, RetryBudget, backoff_delay, continuation_messages, strip_overlap, is_retryable,
+    RETRY_BACKOFF_MAX, OVERLAP_PROBE,
+)
+
+import httpx
+
+
+def main():
+    # 1. 续写开头重复已输出内容时去掉重复部分
+    partial = "作为高管，你在团队管理中遇到的挑战往往源于沟通"
+    assert strip_overlap(partial, "源于沟通方式和期望的不一致。") == "方式和期望的不一致。"
+    assert strip_overlap(partial, "方式和期望的不一致。") == "方式和期望的不一致。"
+    assert strip_overlap(partial, "沟通") == "沟通", "过短的重叠不视为重复"
+    assert strip_overlap("这是", "这是一个很好的问题。") == "一个很好的问题。", "从头重新生成的部分应去掉"
+    print("✅ 去掉续写开头的重复")
+
+    # 2. 逐个增量喂入时先缓冲再检测，之后原样放行
+    trimmer = OverlapTrimmer(partial)
+    output = [trimmer.feed(delta) for delta in ["源于", "沟通方式", "和期望的不一致。", "我想先了解一下：你认为目前团队中", "最困扰的是什么？"]]
+    output.append(trimmer.flush())
+    assert "".join(output) == "方式和期望的不一致。我想先了解一下：你认为目前团队中最困扰的是什么？", output
+    short = OverlapTrimmer(partial)
+    assert short.feed("源于沟通。") == "" and short.flush() == "。"
+    print("✅ 续写增量缓冲与放行")
+
+    # 2.1 已输出内容长于缓冲长度时，从头重新生成的部分同样去掉
+    long_partial = partial + "方式和期望的不一致。我想先了解一下"
+    assert len(long_partial) > OVERLAP_PROBE
+    regenerated = OverlapTrimmer(long_partial)
+    text = long_partial + "：你认为目前团队中最困扰的是什么？"
+    output = [regenerated.feed(text[i:i + 3]) for i in range(0, len(text), 3)]
+    output.append(regenerated.flush())
+    assert "".join(output) == "：你认为目前团队中最困扰的是什么？", output
+    cut_short = OverlapTrimmer(long_partial * 8)
+    assert cut_short.feed(long_partial) == "" and cut_short.flush() == "", "重新生成未覆盖全部已输出内容时全部去掉"
+    print("✅ 从头重新生成长回复时去重")
+
+    # 3. 续写请求带上部分回复
+    messages = continuation_messages([{"role": "user", "content": "你好"}], partial)
+    assert messages[-2] == {"role": "assistant", "content": partial} and messages[-1]["role"] == "user"
+    print("✅ 续写请求")
+
+    # 4. 退避时长随次数增长且不超过上限
+    assert all(0 <= backoff_delay(1) <= 0.5 for _ in range(100))
+    assert all(0 <= backoff_delay(10) <= RETRY_BACKOFF_MAX for _ in range(100))
+    print("✅ 指数退避（带抖动）")
+
+    # 5. 预算耗尽后拒绝重试，随请求与时间补充
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_spend() and not budget.try_spend()
+    refilling = RetryBudget(ratio=0, min_per_second=50, max_tokens=1)
+    assert refilling.try_spend() and not refilling.try_spend()
+    time.sleep(0.05)
+    assert refilling.try_spend()
+    print(f"✅ 重试预算: {budget.stats()}")
+
+    # 6. 请求本身有误时不重试
+    request = httpx.Request("POST", "http://upstream/chat/completions")
+    bad_request = httpx.HTTPStatusError("bad", request=request, response=httpx.Response(400, request=request))
+    rate_limited = httpx.HTTPStatusError("429", request=request, response=httpx.Response(429, request=request))
+    assert not is_retryable(bad_request) and is_retryable(rate_limited) and is_retryable(ConnectionError())
+    print("✅ 可重试错误判断")
+
+
+if __name__ == "__main__":
+    main()
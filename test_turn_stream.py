@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试可续传的流式输出：断开订阅后上游继续输出，重连从 lastSeq 补发，缓冲区不足时发送快照
+
+无需数据库与上游服务。
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+from services.turn_stream import TurnStream, TurnStreamRegistry
+
+
+class Client:
+    """模拟 WebSocket 连接，disconnect 后发送抛出异常"""
+
+    def __init__(self):
+        self.frames = []
+        self.connected = True
+
+    async def send_text(self, text):
+        if not self.connected:
+            raise ConnectionError("client gone")
+        self.frames.append(json.loads(text))
+
+    def text(self):
+        return "".join(
+            frame["content"] for frame in self.frames if frame.get("type") in ("chunk", "snapshot")
+        )
+
+
+async def main():
+    registry = TurnStreamRegistry(grace=0.2)
+    reply = [f"第{i}段。" for i in range(20)]
+    proceed = asyncio.Event()
+
+    async def run(stream):
+        for i, part in enumerate(reply):
+            if i == 5:
+                await proceed.wait()
+            await stream.emit({"type": "chunk", "content": part})
+        await stream.emit({"type": "done", "sessionId": "s1"})
+
+    # 1. 客户端收到前 5 段后断开，上游继续输出
+    first = Client()
+    stream = registry.start("s1", run)
+    subscriber = stream.attach(first.send_text)
+    await asyncio.sleep(0.01)
+    first.connected = False
+    last_seq = first.frames[-1]["seq"]
+    assert last_seq == 5, first.frames
+    proceed.set()
+    await stream.finished.wait()
+    assert stream.subscribers == 0, "断开的订阅应被移除"
+    assert subscriber.closed
+    print("✅ 客户端断开后上游继续输出至 done")
+
+    # 2. grace 期内重连，从 lastSeq 之后补发
+    second = Client()
+    resumed = stream.attach(second.send_text, last_seq, preface={"type": "resumed"})
+    await resumed.turn_ended()
+    assert second.frames[0]["type"] == "resumed"
+    seqs = [frame["seq"] for frame in second.frames[1:]]
+    assert seqs == list(range(6, 22)), seqs
+    assert first.text() + second.text() == "".join(reply)
+    print("✅ 重连后从 lastSeq 补发，拼接结果与完整回复一致")
+
+    # 3. 缓冲区已丢弃缺失的帧：先发快照，再接收后续帧
+    small = TurnStream("s2", max_frames=4)
+    for part in reply[:10]:
+        await small.emit({"type": "chunk", "content": part})
+    third = Client()
+    small.attach(third.send_text, last_seq=2)
+    await small.emit({"type": "chunk", "content": reply[10]})
+    await small.emit({"type": "done"})
+    await asyncio.sleep(0.01)
+    assert third.frames[0]["type"] == "snapshot", third.frames
+    assert third.text() == "".join(reply[:11])
+    print("✅ 缓冲区不足时发送快照")
+
+    # 3.1 本轮已结束且缓冲区已溢出：快照之后仍补发 done，turn_ended 返回
+    finished = TurnStream("s3", turn="t1", max_frames=5)
+    for part in reply[:10]:
+        await finished.emit({"type": "chunk", "content": part})
+    await finished.emit({"type": "done"})
+    for _ in range(5):
+        await finished.emit({"type": "options", "options": []})
+    assert finished.delivers_end(2)
+    fourth = Client()
+    await asyncio.wait_for(finished.attach(fourth.send_text, last_seq=2).turn_ended(), 1)
+    assert [frame["type"] for frame in fourth.frames[:2]] == ["snapshot", "done"], fourth.frames
+    assert fourth.frames[0]["seq"] < fourth.frames[1]["seq"] == 11, fourth.frames
+    assert fourth.text() == "".join(reply[:10]) and all(frame["turn"] == "t1" for frame in fourth.frames)
+    print("✅ 已结束的一轮缓冲区溢出后续传，仍补发结束帧")
+
+    # 3.2 客户端已收到 done：不再等待结束帧
+    assert not finished.delivers_end(11)
+    fifth = Client()
+    await asyncio.wait_for(finished.attach(fifth.send_text, last_seq=11).turn_ended(), 1)
+    await asyncio.sleep(0.01)
+    assert all(frame["type"] == "options" for frame in fifth.frames), fifth.frames
+    print("✅ 已收到结束帧时续传立即结束")
+
+    # 4. grace 期后移除
+    await asyncio.sleep(0.3)
+    assert registry.get("s1") is None
+    print("✅ grace 期后释放缓冲区")
+
+    print(f"\n统计: {registry.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试上游端点池：启动两个本地 mock_openai（快 / 慢），验证按首 token 耗时选择、故障摘除与对冲请求
+
+无需数据库。用法：python test_upstream_pool.py
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "server"))
+
+FAST_PORT, SLOW_PORT = 9311, 9312
+os.environ["OPENAI_ENDPOINTS"] = json.dumps([
+    {"name": "slow", "base_url": f"http://127.0.0.1:{SLOW_PORT}", "api_key": "k1", "model": "mock-a"},
+    {"name": "fast", "base_url": f"http://127.0.0.1:{FAST_PORT}", "api_key": "k2", "model": "mock-b"},
+])
+os.environ.setdefault("LLM_EXPLORE_RATE", "0")
+os.environ.setdefault("LLM_EJECT_COOLDOWN", "1")
+os.environ.setdefault("LLM_HEDGE_INITIAL_DELAY", "0.3")
+
+from services import llm_client  # noqa: E402
+from services.sse import iter_deltas  # noqa: E402
+from services.upstream_pool import Endpoint, upstream_pool  # noqa: E402
+from services.upstream_scheduler import upstream_scheduler  # noqa: E402
+
+
+def spawn(port, ttft):
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "bench", "mock_openai.py"), "--port", str(port),
+         "--ttft", str(ttft), "--tps", "500", "--reply-tokens", "20"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(client, port):
+    for _ in range(50):
+        try:
+            await client.get(f"http://127.0.0.1:{port}/stats")
+            return
+        except httpx.HTTPError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"mock_openai :{port} 未启动")
+
+
+async def turn():
+    start = time.perf_counter()
+    async with llm_client.stream_chat_completion({"model": "x", "messages": [], "stream": True}) as response:
+        text = "".join([delta async for delta in iter_deltas(response.aiter_bytes())])
+    return response.endpoint.name, text, time.perf_counter() - start
+
+
+async def main():
+    servers = [spawn(FAST_PORT, 0.05), spawn(SLOW_PORT, 0.4)]
+    llm_client.init_llm_client()
+    try:
+        async with httpx.AsyncClient() as control:
+            await wait_ready(control, FAST_PORT)
+            await wait_ready(control, SLOW_PORT)
+
+            # 1. 两个端点各试用一次后，后续请求都发往首 token 更快的端点
+            names = [(await turn())[0] for _ in range(12)]
+            assert set(names[:2]) == {"slow", "fast"}, names
+            assert names[2:].count("fast") == 10, names
+            print(f"✅ 按首 token 耗时选择: {names}")
+
+            # 2. 快端点连续失败后被摘除，请求转到慢端点；冷却后恢复
+            await control.post(f"http://127.0.0.1:{FAST_PORT}/config", json={"error_rate": 1.0})
+            failures = 0
+            for _ in range(3):
+                try:
+                    await turn()
+                except httpx.HTTPStatusError:
+                    failures += 1
+            fast = upstream_pool.endpoints[1]
+            assert failures == 3 and not fast.healthy(time.monotonic()), fast.stats(time.monotonic())
+            assert (await turn())[0] == "slow"
+            await control.post(f"http://127.0.0.1:{FAST_PORT}/config", json={"error_rate": 0.0})
+            await asyncio.sleep(1.1)
+            assert (await turn())[0] == "fast"
+            print("✅ 故障端点摘除与恢复")
+
+            # 3. 对冲：快端点变慢，超过其 p95 后向慢端点补发，先到者胜出，落败请求被取消
+            llm_client.LLM_HEDGE_ENABLED = True
+            for _ in range(25):
+                await turn()
+            await control.post(f"http://127.0.0.1:{FAST_PORT}/config", json={"ttft": 3.0})
+            samples = len(fast._ttft_samples)
+            name, text, elapsed = await turn()
+            assert name == "slow" and text and elapsed < 2.0, (name, elapsed)
+            assert upstream_pool.hedges_won >= 1
+            assert len(fast._ttft_samples) == samples, "被取消的落败请求不应记录首 token 耗时"
+            assert upstream_scheduler.in_flight == 0, upstream_scheduler.stats()
+            await asyncio.sleep(0.1)
+            stats = (await control.get(f"http://127.0.0.1:{FAST_PORT}/stats")).json()
+            assert stats["in_flight"] == 0, "落败的请求应已断开"
+            print(f"✅ 对冲请求 {elapsed:.2f}s 完成，胜出端点 {name}")
+
+            # 4. 调度器没有空闲名额时不发对冲请求，等待原请求
+            for port in (FAST_PORT, SLOW_PORT):
+                await control.post(f"http://127.0.0.1:{port}/config", json={"ttft": 1.0})
+            upstream_scheduler.min_limit = upstream_scheduler.max_limit = 1
+            upstream_scheduler.limit = 1.0
+            hedges = upstream_pool.hedges
+            name, text, elapsed = await turn()
+            assert text and elapsed >= 1.0, (name, elapsed)
+            assert upstream_pool.hedges == hedges and upstream_pool.hedges_skipped == 1, upstream_pool.stats()
+            assert upstream_scheduler.in_flight == 0
+            print(f"✅ 无空闲名额时不对冲，{elapsed:.2f}s 完成")
+
+            # 5. 4xx 与本地连接池超时不计入端点失败；输出中途断开不重复计数
+            endpoint = Endpoint("check", "http://127.0.0.1:1")
+            request = httpx.Request("POST", endpoint.url)
+
+            def status_error(code):
+                return httpx.HTTPStatusError("", request=request, response=httpx.Response(code, request=request))
+
+            for error in (status_error(400), status_error(429), httpx.PoolTimeout("pool full")) * 3:
+                endpoint.record_failure(error)
+            assert endpoint.healthy(time.monotonic()) and endpoint.failures == 0, endpoint.stats(time.monotonic())
+            endpoint.record_success()
+            endpoint.record_failure(httpx.RemoteProtocolError("peer closed"), counted=True)
+            assert endpoint.requests == 1 and endpoint.failures == 1
+            endpoint.record_failure(status_error(502))
+            endpoint.record_failure(httpx.ReadTimeout("read timeout"))
+            assert not endpoint.healthy(time.monotonic()) and endpoint.requests == 3
+            print("✅ 只有超时、传输错误与 5xx 计入端点失败")
+    finally:
+        await llm_client.close_llm_client()
+        for server in servers:
+            server.terminate()
+
+    print(f"\n统计: {json.dumps(upstream_pool.stats(), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
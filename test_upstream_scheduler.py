@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试上游调度器：并发上限、按用户公平派发、流式优先、AIMD 调整、Retry-After 暂停与排队超时
+
+无需数据库与上游服务。
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+from services.upstream_scheduler import (
+    UpstreamScheduler, UpstreamBusy, parse_retry_after,
+    PRIORITY_STREAM, PRIORITY_OPTIONS, PRIORITY_BACKGROUND,
+)
+
+
+async def main():
+    # 1. 并发不超过上限
+    scheduler = UpstreamScheduler(initial=3, min_limit=1, max_limit=3)
+    peak = 0
+
+    async def call(user, priority=PRIORITY_STREAM, order=None, hold=0.02):
+        nonlocal peak
+        async with scheduler.slot(user, priority):
+            peak = max(peak, scheduler.in_flight)
+            if order is not None:
+                order.append((user, priority))
+            await asyncio.sleep(hold)
+
+    await asyncio.gather(*[call(f"u{i % 4}") for i in range(20)])
+    assert peak == 3, peak
+    assert scheduler.in_flight == 0 and scheduler.queued == 0
+    print("✅ 并发不超过上限")
+
+    # 2. 重度用户排了 10 个请求后，其他用户的请求不会排在它们全部之后
+    scheduler = UpstreamScheduler(initial=1, min_limit=1, max_limit=1)
+    order = []
+    blocker = asyncio.create_task(call("blocker", hold=0.05))
+    await asyncio.sleep(0.01)
+    tasks = [asyncio.create_task(call("heavy", order=order, hold=0)) for _ in range(10)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(call(user, order=order, hold=0)) for user in ("light-a", "light-b")]
+    await asyncio.gather(blocker, *tasks)
+    users = [user for user, _ in order]
+    assert users.index("light-a") <= 2 and users.index("light-b") <= 3, users
+    print(f"✅ 按用户轮转派发: {users[:5]}...")
+
+    # 3. 流式调用优先于选项与摘要
+    order = []
+    blocker = asyncio.create_task(call("blocker", hold=0.05))
+    await asyncio.sleep(0.01)
+    tasks = [
+        asyncio.create_task(call("u1", PRIORITY_BACKGROUND, order, 0)),
+        asyncio.create_task(call("u2", PRIORITY_OPTIONS, order, 0)),
+        asyncio.create_task(call("u3", PRIORITY_STREAM, order, 0)),
+    ]
+    await asyncio.gather(blocker, *tasks)
+    assert [priority for _, priority in order] == [PRIORITY_STREAM, PRIORITY_OPTIONS, PRIORITY_BACKGROUND], order
+    print("✅ 流式调用优先")
+
+    # 4. AIMD：用满且延迟正常时增长，429 减半，延迟超标收缩
+    scheduler = UpstreamScheduler(initial=4, min_limit=2, max_limit=8, latency_target=1.0)
+    scheduler.in_flight = 4
+    for _ in range(8):
+        scheduler.on_latency(0.1)
+    assert scheduler.capacity == 5, scheduler.stats()
+    scheduler.on_rate_limited()
+    assert scheduler.capacity == 2, scheduler.stats()
+    scheduler.on_rate_limited()
+    assert scheduler.decreases == 1, "冷却期内只收缩一次"
+    scheduler.in_flight = 0
+    print(f"✅ AIMD 调整: {scheduler.stats()['limit']}")
+
+    # 5. Retry-After 期间暂停派发
+    scheduler = UpstreamScheduler(initial=4, min_limit=1, max_limit=4)
+    scheduler.on_rate_limited(0.2)
+    start = time.monotonic()
+    async with scheduler.slot("u1"):
+        waited = time.monotonic() - start
+    assert waited >= 0.15, waited
+    assert parse_retry_after("3") == 3.0 and parse_retry_after("abc") == 0.0
+    print(f"✅ Retry-After 暂停 {waited:.2f}s")
+
+    # 6. 排队超时抛出 UpstreamBusy，名额不泄漏
+    scheduler = UpstreamScheduler(initial=1, min_limit=1, max_limit=1, queue_timeout=0.05)
+    blocker = asyncio.create_task(call("blocker", hold=0.2))
+    await asyncio.sleep(0.01)
+    try:
+        async with scheduler.slot("u1"):
+            raise AssertionError("不应获得名额")
+    except UpstreamBusy:
+        pass
+    await blocker
+    assert scheduler.in_flight == 0 and scheduler.queued == 0, scheduler.stats()
+    async with scheduler.slot("u1"):
+        pass
+    print("✅ 排队超时")
+
+    # 7. 排队中的调用被取消、尚未移出队列时名额恰好释放：跳过该等待者，名额不泄漏
+    scheduler = UpstreamScheduler(initial=1, min_limit=1, max_limit=1)
+    ticket = scheduler.try_acquire()
+    waiter = asyncio.create_task(call("options", PRIORITY_OPTIONS, hold=0))
+    await asyncio.sleep(0)
+    assert scheduler.queued == 1
+    waiter.cancel()
+    await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert ticket is not None and waiter.cancelled()
+    assert scheduler.in_flight == 0 and scheduler.queued == 0, scheduler.stats()
+    async with scheduler.slot("u1"):
+        assert scheduler.in_flight == 1
+    print("✅ 等待者被取消后释放名额")
+
+    print(f"\n统计: {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
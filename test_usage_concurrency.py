@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试并发扣减使用次数：同一用户大量并发请求 /api/usage/increment，计数必须精确
+
+分别测试数据库原子扣减（CONSUME_QUOTA_SQL）与使用次数内存缓存两种模式。
+
+需要可用的 DATABASE_URL 与 JWT_SECRET（读取项目根目录 .env），无需启动服务。
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+import httpx
+import jwt
+from sqlalchemy import select, delete
+from app import app
+from routes import usage as usage_routes
+from services.auth import JWT_SECRET
+from services.database import AsyncSessionLocal
+from services.quota_cache import quota_cache
+from models.user import User
+from models.usage_log import UsageLog
+
+DAILY_QUOTA = 10
+PURCHASED_QUOTA = 15
+REQUESTS = 60
+
+
+async def create_user():
+    async with AsyncSessionLocal() as db:
+        user = User(
+            openid=f"concurrency-test-{uuid.uuid4()}",
+            daily_quota=DAILY_QUOTA,
+            purchased_quota=PURCHASED_QUOTA
+        )
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+async def test_concurrent_increment(cache_enabled):
+    """并发扣减"""
+    usage_routes.QUOTA_CACHE_ENABLED = cache_enabled
+    print(f"\n模式: {'内存缓存' if cache_enabled else '数据库原子扣减'}")
+    user_id = await create_user()
+    token = jwt.encode(
+        {"user_id": str(user_id), "exp": datetime.utcnow() + timedelta(hours=1)},
+        JWT_SECRET,
+        algorithm="HS256"
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            print(f"📤 并发发送 {REQUESTS} 个扣减请求...")
+            responses = await asyncio.gather(*[
+                client.post("/api/usage/increment", headers=headers)
+                for _ in range(REQUESTS)
+            ])
+
+        # 开启次数缓存时先写回增量
+        if cache_enabled:
+            await quota_cache.flush()
+
+        results = [r.json() for r in responses]
+        succeeded = sum(1 for r in results if r["code"] == 0)
+        rejected = sum(1 for r in results if r["code"] == 1)
+
+        async with AsyncSessionLocal() as db:
+            user = await db.get(User, user_id)
+            usage = (await db.execute(
+                select(UsageLog).where(UsageLog.user_id == user_id, UsageLog.date == date.today())
+            )).scalars().first()
+
+        expected_success = min(REQUESTS, DAILY_QUOTA + PURCHASED_QUOTA)
+        print(f"成功: {succeeded}，次数不足: {rejected}")
+        print(f"当日已用: {usage.count if usage else 0}，剩余购买次数: {user.purchased_quota}")
+
+        assert succeeded == expected_success, f"成功次数 {succeeded} != {expected_success}"
+        assert rejected == REQUESTS - expected_success
+        assert usage.count == DAILY_QUOTA
+        assert user.purchased_quota == max(0, PURCHASED_QUOTA - (REQUESTS - DAILY_QUOTA))
+        remaining = sorted(r["data"]["remaining"] for r in results if r["code"] == 0)
+        assert remaining == list(range(DAILY_QUOTA + PURCHASED_QUOTA - expected_success, DAILY_QUOTA + PURCHASED_QUOTA)), remaining
+        print(f"✅ 并发扣减计数精确（{'内存缓存' if cache_enabled else '数据库原子扣减'}）")
+    finally:
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(UsageLog).where(UsageLog.user_id == user_id))
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+
+
+async def main():
+    await test_concurrent_increment(cache_enabled=False)
+    await test_concurrent_increment(cache_enabled=True)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        sys.exit(1)
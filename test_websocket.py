@@ -5,10 +5,16 @@
 import asyncio
 import websockets
 import json
+import os
 
 async def test_multi_turn_chat():
     """测试多轮对话"""
-    uri = "ws://localhost:8000/ws/chat?user_id=test_user_123"
+    # 需要数据库中已存在的用户 ID，服务端会拒绝未知用户的连接
+    user_id = os.getenv("TEST_USER_ID")
+    if not user_id:
+        print("❌ 请通过 TEST_USER_ID 指定已存在的用户 ID")
+        return
+    uri = f"ws://localhost:8000/ws/chat?user_id={user_id}"
 
     async with websockets.connect(uri) as websocket:
         print("✅ WebSocket 已连接")
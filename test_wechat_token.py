@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""测试微信 access_token 管理：缓存、并发刷新合并、失效后重取
+
+使用 bench/mock_wechat.py 的模拟接口（进程内调用），无需网络与数据库。
+"""
+
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import httpx
+import mock_wechat
+from services import wechat
+
+
+async def main():
+    wechat._client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=mock_wechat.app),
+        base_url="http://mock-wechat"
+    )
+    manager = wechat.access_token_manager
+    counters = mock_wechat.counters
+
+    # 1. 并发获取只请求一次
+    tokens = await asyncio.gather(*[manager.get() for _ in range(50)])
+    assert len(set(tokens)) == 1, tokens
+    assert counters["token"] == 1, counters
+    print(f"✅ 50 个并发请求共享 1 次刷新: {tokens[0]}")
+
+    # 2. 缓存命中不再请求
+    phones = await asyncio.gather(*[wechat.get_phone_number(f"code-{i}") for i in range(20)])
+    assert all(phones), phones
+    assert counters["token"] == 1, counters
+    print(f"✅ 20 次获取手机号复用缓存 token")
+
+    # 3. 接近过期时返回旧 token 并在后台刷新
+    manager._expires_at -= 7200 - wechat.WECHAT_TOKEN_REFRESH_AHEAD + 10
+    old = await manager.get()
+    assert old == tokens[0]
+    await manager._refresh_task
+    assert counters["token"] == 2, counters
+    assert await manager.get() != old
+    print("✅ 提前刷新不阻塞请求")
+
+    # 4. 微信侧 token 失效：刷新一次后重试成功
+    await mock_wechat.revoke()
+    phone = await asyncio.gather(*[wechat.get_phone_number("code-x") for _ in range(10)])
+    assert all(phone), phone
+    assert counters["token"] == 3, counters
+    print("✅ token 失效后合并刷新并重试成功")
+
+    # 5. 登录接口走同一连接池
+    data = await wechat.code2session("js-code")
+    assert data["openid"].startswith("mock-")
+    try:
+        await wechat.code2session("")
+        raise AssertionError("空 code 应报错")
+    except wechat.WeChatError as e:
+        assert e.errcode == 40029
+    print("✅ jscode2session 正常")
+
+    await wechat.close_wechat_client()
+    print(f"\n统计: {manager.stats()} 模拟接口调用: {counters}")
+
+
+if __name__ == "__main__":
+    mock_wechat.config["latency"] = 0.02
+    asyncio.run(main())